@@ -0,0 +1,82 @@
+"""
+Callback so'rovini handlerga yo'naltirish vaqtini o'lchash.
+
+Solishtiriladi:
+- linear  - oldingi usul: har bir handler filtri (startswith / == va admin tekshiruvi)
+            ketma-ket sinab ko'riladi, parametr split("_") bilan olinadi
+- compact - CallbackRouter: "!" + base64 callback_data, kod bo'yicha lug'atdan
+- legacy  - CallbackRouter: eski "user_manage_bot_<id>" ko'rinishidagi tugma
+- uncached - compact tugmani keshsiz ochish (tugma birinchi marta bosilganda)
+
+Har biri uchun ro'yxat boshidagi, o'rtasidagi va oxiridagi amal o'lchanadi.
+
+Ishlatish:
+    python3 benchmarks/bench_callbacks.py --calls 200000
+"""
+import argparse
+import time
+import uuid
+from types import SimpleNamespace
+
+from common import import_manager
+
+
+def per_call_ns(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) * 1e9 / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000, help="Har bir o'lchovdagi chaqiruvlar soni")
+    args = parser.parse_args()
+
+    manager = import_manager()
+    codec = manager.callback_codec
+    router = manager.CallbackRouter(codec)
+    for action in manager.CALLBACK_ACTIONS:
+        router.route(action.name)(lambda call, *params: None)
+
+    # Oldingi usul: TeleBot handlerlar ro'yxatini tartib bilan aylanadi
+    linear = []
+    for action in manager.CALLBACK_ACTIONS:
+        for prefix in action.legacy:
+            if action.params:
+                test = lambda call, prefix=prefix: call.data.startswith(prefix)
+            else:
+                test = lambda call, prefix=prefix: call.data == prefix
+            if action.admin:
+                test = lambda call, test=test: test(call) and manager.is_admin(call.from_user.id)
+            linear.append((test, bool(action.params)))
+
+    def linear_dispatch(call):
+        for test, has_params in linear:
+            if test(call):
+                return call.data.split("_")[3] if has_params else None
+        return None
+
+    user = SimpleNamespace(id=1)
+    manager.ADMIN_ID = "1"
+    bot_id = str(uuid.uuid4())
+    samples = (("admin_main_menu", ()), ("check_subscription", ()), ("user_delete_bot", (bot_id,)))
+
+    print(f"{'amal':<22}{'linear ns':>12}{'compact ns':>12}{'legacy ns':>12}{'uncached ns':>13}{'bayt':>8}")
+    for name, params in samples:
+        action = codec.by_name[name]
+        legacy_data = next(iter(action.legacy)) + "_".join(params)
+        compact_data = codec.encode(name, *params)
+        legacy_call = SimpleNamespace(data=legacy_data, from_user=user)
+        compact_call = SimpleNamespace(data=compact_data, from_user=user)
+        assert router.resolve(legacy_call) is not None and router.resolve(compact_call) is not None
+        print(f"{name:<22}"
+              f"{per_call_ns(lambda: linear_dispatch(legacy_call), args.calls):>12.0f}"
+              f"{per_call_ns(lambda: router.resolve(compact_call), args.calls):>12.0f}"
+              f"{per_call_ns(lambda: router.resolve(legacy_call), args.calls):>12.0f}"
+              f"{per_call_ns(lambda: codec._decode(compact_data), args.calls):>13.0f}"
+              f"{len(compact_data):>5}/{len(legacy_data)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Bot kanallarini yozish va global kanal o'zgarishini tarqatish tezligini o'lchash.
+
+makerbotpostgre.py dagi DB_CONFIG bazasida vaqtinchalik shablon va N ta bot
+yaratiladi (oxirida o'chiriladi). O'lchanadi:
+- loop     - eski usul: har bir kanal uchun alohida INSERT
+- batched  - insert_bot_channels: ko'p qatorli INSERT
+- add/remove - global kanal o'zgarishini butun flotga bo'laklab tarqatish
+
+Ishlatish:
+    python3 benchmarks/bench_channels.py --bots 100000 --channels 5
+"""
+import argparse
+import time
+import uuid
+
+from common import import_manager
+
+
+def seed_bots(manager, template_id, count):
+    with manager.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO bot_templates (id, name, file_path, filename)
+                VALUES (%s, 'bench', 'bench.py', 'bench.py')
+            """, (template_id,))
+            cur.execute("""
+                INSERT INTO user_bots (id, template_id, token, file_path, desired_state)
+                SELECT gen_random_uuid(), %s, 'bench', 'bench.py', 'stopped'
+                FROM generate_series(1, %s)
+            """, (template_id, count))
+            conn.commit()
+
+
+def time_bot_channel_writes(manager, template_id, channels, repeat):
+    """Bitta yangi bot uchun kanallarni yozish vaqti (ms): eski sikl va ko'p qatorli INSERT"""
+    results = {}
+    with manager.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM user_bots WHERE template_id = %s LIMIT %s", (template_id, repeat * 2))
+            bot_ids = [str(row['id']) for row in cur.fetchall()]
+            for mode, ids in (('loop', bot_ids[:repeat]), ('batched', bot_ids[repeat:])):
+                started = time.perf_counter()
+                for bot_id in ids:
+                    if mode == 'loop':
+                        for channel in channels:
+                            cur.execute("""
+                                INSERT INTO bot_channels (bot_id, channel_identifier)
+                                VALUES (%s, %s)
+                                ON CONFLICT DO NOTHING
+                            """, (bot_id, channel))
+                    else:
+                        manager.insert_bot_channels(cur, [(bot_id, channel) for channel in channels])
+                    conn.commit()
+                results[mode] = (time.perf_counter() - started) * 1000 / len(ids)
+            cur.execute("DELETE FROM bot_channels WHERE bot_id = ANY(%s::uuid[])", (bot_ids,))
+            conn.commit()
+    return results
+
+
+def time_propagation(manager, channel, action):
+    with manager.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO channel_propagation_jobs (channel_identifier, action)
+                VALUES (%s, %s) RETURNING id
+            """, (channel, action))
+            job = {'id': cur.fetchone()['id'], 'channel_identifier': channel, 'action': action,
+                   'last_bot_id': None}
+            conn.commit()
+    started = time.perf_counter()
+    chunks = 0
+    while manager.propagate_channel_chunk(job):
+        chunks += 1
+    return time.perf_counter() - started, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=100000, help="Vaqtinchalik botlar soni")
+    parser.add_argument("--channels", type=int, default=5, help="Yangi botga yoziladigan kanallar soni")
+    parser.add_argument("--repeat", type=int, default=200, help="Yozish o'lchovi uchun botlar soni")
+    args = parser.parse_args()
+
+    manager = import_manager()
+    manager.db_pool.open()
+    manager.init_database()
+    template_id = str(uuid.uuid4())
+    channel = f"@bench_{template_id[:8]}"
+    try:
+        seed_bots(manager, template_id, args.bots)
+
+        writes = time_bot_channel_writes(manager, template_id,
+                                         [f"@bench_channel_{i}" for i in range(args.channels)], args.repeat)
+        print(f"{'yozish':<10}{'ms/bot':>10}")
+        for mode, ms in writes.items():
+            print(f"{mode:<10}{ms:>10.2f}")
+
+        print(f"\n{'tarqatish':<10}{'soniya':>10}{'qismlar':>12}")
+        for action in ('add', 'remove'):
+            seconds, chunks = time_propagation(manager, channel, action)
+            print(f"{action:<10}{seconds:>10.2f}{chunks:>12}")
+    finally:
+        with manager.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM channel_propagation_jobs WHERE channel_identifier = %s", (channel,))
+                cur.execute("DELETE FROM bot_templates WHERE id = %s", (template_id,))
+                conn.commit()
+        manager.db_pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Handlerlarni bajarish usullarini solishtirish: TeleBot puli va chatlar bo'yicha tartibli taqsimlovchi.
+
+Bir nechta chatdan ketma-ket raqamlangan xabarlar aralash tartibda, getUpdates kabi
+100 talik paketlarda beriladi. Handler Bot API chaqiruvi o'rnida --latency atrofida uxlaydi.
+
+Solishtiriladi:
+- threaded - joriy polling: TeleBot.process_new_updates + util.ThreadPool (--workers oqim)
+- ordered  - ChatOrderedDispatcher (--workers oqim), HANDLER_DISPATCH = "ordered"
+
+Har biri uchun o'tkazuvchanlik, navbatga qo'yilgandan handler tugaguncha p50/p99,
+"tartib buzildi" (chat xabari o'zidan oldingisidan oldin tugagan) va "bir vaqtda"
+(bitta chatning ikki handleri parallel ishlagan) holatlari chiqariladi.
+
+Ishlatish:
+    python3 benchmarks/bench_dispatch.py --chats 200 --per-chat 10 --workers 8
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from common import import_manager
+
+
+class Recorder:
+    """Handler chaqiruvlarini chat bo'yicha kuzatish"""
+
+    def __init__(self, total):
+        self.total = total
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.submitted = {}
+        self.latencies = []
+        self.expected = {}
+        self.active = {}
+        self.violations = 0
+        self.overlaps = 0
+
+    def begin(self, chat_id):
+        with self.lock:
+            if self.active.get(chat_id):
+                self.overlaps += 1
+            self.active[chat_id] = self.active.get(chat_id, 0) + 1
+
+    def end(self, chat_id, seq, update_id):
+        with self.lock:
+            self.active[chat_id] -= 1
+            if seq != self.expected.get(chat_id, 0):
+                self.violations += 1
+            self.expected[chat_id] = max(self.expected.get(chat_id, 0), seq + 1)
+            self.latencies.append(time.perf_counter() - self.submitted[update_id])
+            if len(self.latencies) == self.total:
+                self.done.set()
+
+
+def make_updates(types, chats, per_chat, seed):
+    """Har bir chat ichida tartibni saqlagan holda aralashtirilgan xabarlar"""
+    rng = random.Random(seed)
+    pending = {chat_id: 0 for chat_id in range(1, chats + 1)}
+    updates = []
+    while pending:
+        chat_id = rng.choice(list(pending))
+        seq = pending[chat_id]
+        updates.append(types.Update.de_json({
+            'update_id': len(updates) + 1,
+            'message': {'message_id': seq + 1, 'date': 0, 'text': str(seq),
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'from': {'id': chat_id, 'is_bot': False, 'first_name': "bench"}},
+        }))
+        if seq + 1 == per_chat:
+            del pending[chat_id]
+        else:
+            pending[chat_id] = seq + 1
+    return updates
+
+
+def run(manager, mode, updates, args):
+    import telebot
+    from telebot import util
+
+    recorder = Recorder(len(updates))
+    bench_bot = telebot.TeleBot("1:bench")
+    rng = random.Random(1)
+
+    @bench_bot.message_handler(func=lambda message: True)
+    def handle(message):
+        recorder.begin(message.chat.id)
+        time.sleep(args.latency * rng.uniform(0.5, 1.5))
+        recorder.end(message.chat.id, int(message.text), update_ids[id(message)])
+
+    dispatcher = None
+    if mode == "ordered":
+        dispatcher = manager.ChatOrderedDispatcher(bench_bot.process_new_updates, args.workers,
+                                                   len(updates), args.chat_queue)
+        manager.route_polling_updates(bench_bot, dispatcher)
+        dispatcher.start()
+    else:
+        bench_bot.worker_pool = util.ThreadPool(bench_bot, num_threads=args.workers)
+
+    update_ids = {id(update.message): update.update_id for update in updates}
+    started = time.perf_counter()
+    for i in range(0, len(updates), 100):
+        batch = updates[i:i + 100]
+        now = time.perf_counter()
+        for update in batch:
+            recorder.submitted[update.update_id] = now
+        bench_bot.process_new_updates(batch)
+    rejected = dispatcher.stats()['rejected'] if dispatcher is not None else 0
+    # Rad etilganlar hech qachon bajarilmaydi
+    with recorder.lock:
+        recorder.total -= rejected
+        if len(recorder.latencies) >= recorder.total:
+            recorder.done.set()
+    finished = recorder.done.wait(args.timeout)
+    elapsed = time.perf_counter() - started
+    if dispatcher is not None:
+        dispatcher.stop(timeout=1)
+    else:
+        bench_bot.worker_pool.close()
+
+    latencies = sorted(recorder.latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+    print(f"{mode:<10}{elapsed if finished else float('nan'):>9.2f}{len(latencies) / elapsed:>10.0f}"
+          f"{statistics.median(latencies) * 1000 if latencies else 0:>10.0f}{p99 * 1000:>10.0f}"
+          f"{recorder.violations:>14}{recorder.overlaps:>11}{rejected:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--per-chat", type=int, default=10, help="Har bir chatdan xabarlar")
+    parser.add_argument("--workers", type=int, default=8, help="Handler oqimlari (ikkala usulda bir xil)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Handler ichidagi Bot API kechikishi (soniya)")
+    parser.add_argument("--chat-queue", type=int, default=20, help="HANDLER_CHAT_QUEUE_SIZE")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    manager = import_manager()
+    from telebot import types
+
+    updates = make_updates(types, args.chats, args.per_chat, args.seed)
+    print(f"{args.chats} chat x {args.per_chat} xabar, {args.workers} oqim, handler ~{args.latency * 1000:.0f} ms")
+    print(f"{'usul':<10}{'soniya':>9}{'yang./s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'tartib buz.':>14}{'bir vaqtda':>11}{'rad etildi':>11}")
+    for mode in ("threaded", "ordered"):
+        run(manager, mode, updates, args)
+
+
+if __name__ == "__main__":
+    main()
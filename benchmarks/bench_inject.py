@@ -0,0 +1,83 @@
+"""
+Token va admin ID qo'yish tezligini o'lchash.
+
+Solishtiriladi:
+- regex   - eski usul: har bir bot uchun shablon ustidan ~10 ta re.sub/re.search
+- cold    - tokenize rejasini tuzish + bitta o'tishda joylashtirish (kesh bo'sh)
+- planned - keshdagi reja bo'yicha faqat joylashtirish (bot yaratishdagi odatiy holat)
+
+Ishlatish:
+    python3 benchmarks/bench_inject.py --lines 5000 --repeat 200
+"""
+import argparse
+import time
+
+from common import import_manager
+
+HEADER = '''import telebot
+from telebot import types
+
+TOKEN = "123456:placeholder-token-placeholder-token"
+ADMIN_ID = 123456789
+bot = telebot.TeleBot(TOKEN)
+'''
+
+BLOCK = '''
+@bot.message_handler(commands=['cmd{n}'])
+def handler_{n}(message):
+    """Handler {n}"""
+    text = "Javob {n}: " + str(message.from_user.id)
+    if str(message.from_user.id) == str(ADMIN_ID):
+        text += " (admin)"
+    bot.reply_to(message, text)
+'''
+
+
+def build_template(lines):
+    parts = [HEADER]
+    n = 0
+    while sum(part.count("\n") for part in parts) < lines:
+        parts.append(BLOCK.format(n=n))
+        n += 1
+    return "".join(parts)
+
+
+def measure(func, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=5000, help="Sinov shablonining qatorlar soni")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    manager = import_manager()
+    content = build_template(args.lines)
+    token = "987654:real-token-real-token-real-token-x"
+
+    def regex(i):
+        manager.inject_token_and_admin_id_regex(content, token, str(i))
+
+    def cold(i):
+        plan = manager.build_injection_plan(content)
+        manager.apply_injection_plan(plan, content, token, str(i))
+
+    manager.get_injection_plan(content)
+
+    def planned(i):
+        manager.inject_token_and_admin_id_universal(content, token, str(i))
+
+    expected = manager.inject_token_and_admin_id_universal(content, token, "1")
+    print(f"Shablon: {content.count(chr(10))} qator, {len(content)} belgi")
+    print(f"{'usul':<10}{'ms/bot':>10}")
+    for name, func in (("regex", regex), ("cold", cold), ("planned", planned)):
+        print(f"{name:<10}{measure(func, args.repeat):>10.3f}")
+    assert manager.inject_token_and_admin_id_universal(content, token, "1") == expected
+
+
+if __name__ == "__main__":
+    main()
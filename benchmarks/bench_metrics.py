@@ -0,0 +1,67 @@
+"""
+Metrikalar (handler, DB so'rovi va Telegram API vaqtlari) qo'shadigan ortiqcha vaqtni o'lchash.
+
+O'lchanadi:
+- observe      - gistogrammaga bitta qiymat yozish
+- handler      - timed_handler bilan o'ralgan bo'sh handler va o'ralmagani
+- db           - makerbotpostgre.py dagi DB_CONFIG bazasida SELECT 1: TimedCursor va oddiy RealDictCursor
+- render       - /metrics javobini tayyorlash
+
+Ishlatish:
+    python3 benchmarks/bench_metrics.py --calls 200000 --queries 5000
+"""
+import argparse
+import time
+
+from common import import_manager
+
+
+def per_call_ns(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) * 1e9 / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000, help="Handler/observe chaqiruvlari soni")
+    parser.add_argument("--queries", type=int, default=5000, help="SELECT 1 so'rovlari soni")
+    parser.add_argument("--routes", type=int, default=60, help="/metrics dagi route yorliqlari soni")
+    args = parser.parse_args()
+
+    manager = import_manager()
+    histogram = manager.Histogram("bench_seconds", "bench", "route")
+
+    def handler(message):
+        return None
+
+    timed = manager.timed_handler(handler)
+    print(f"{'o‘lchov':<22}{'ns/chaqiruv':>14}")
+    print(f"{'observe':<22}{per_call_ns(lambda: histogram.observe('route', 0.003), args.calls):>14.0f}")
+    raw = per_call_ns(lambda: handler(None), args.calls)
+    wrapped = per_call_ns(lambda: timed(None), args.calls)
+    print(f"{'handler (o‘ralmagan)':<22}{raw:>14.0f}")
+    print(f"{'handler (timed)':<22}{wrapped:>14.0f}")
+
+    manager.db_pool.open()
+    try:
+        with manager.get_db_connection() as conn:
+            for name, factory in (("db RealDictCursor", manager.RealDictCursor), ("db TimedCursor", manager.TimedCursor)):
+                with conn.cursor(cursor_factory=factory) as cur:
+                    def query():
+                        cur.execute("SELECT 1")
+                        cur.fetchone()
+                    print(f"{name:<22}{per_call_ns(query, args.queries):>14.0f}")
+    finally:
+        manager.db_pool.closeall()
+
+    for i in range(args.routes):
+        manager.handler_latency.observe(f"route_{i}", 0.01)
+    started = time.perf_counter()
+    body = manager.metrics.render()
+    print(f"\n/metrics: {len(body)} bayt, {(time.perf_counter() - started) * 1000:.2f} ms ({args.routes} route)")
+
+
+if __name__ == "__main__":
+    main()
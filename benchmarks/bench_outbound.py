@@ -0,0 +1,153 @@
+"""
+Chiquvchi so'rovlar rejalashtiruvchisini portlash (burst) ostida o'lchash.
+
+Soxta Telegram global (30/s), shaxsiy chat (1/s, 3 tagacha portlash) va guruh
+(20/min) limitlarini tekshiradi va oshib ketganda 429 (retry_after) qaytaradi.
+Bir vaqtda:
+- ommaviy yuborish: guruhlarga ko'p xabar
+- foydalanuvchilar: callback javobi + shu xabarni bir vaqtda bir necha marta tahrirlash
+
+Solishtiriladi:
+- direct    - hozirgi holat: so'rov darhol yuboriladi, 429 faqat chop etiladi
+- scheduled - OutboundScheduler orqali
+
+Ishlatish:
+    python3 benchmarks/bench_outbound.py --users 100 --bulk 300
+"""
+import argparse
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common import import_manager
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Error code: 429. retry after {retry_after}")
+        self.error_code = 429
+        self.result_json = {'parameters': {'retry_after': retry_after}}
+
+
+class FakeTelegram:
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.global_log = deque()
+        self.chat_logs = {}
+        self.requests = 0
+        self.rejected = 0
+
+    def _over(self, log, now, window, limit):
+        while log and log[0] <= now - window:
+            log.popleft()
+        return len(log) >= limit
+
+    def call(self, method, params):
+        time.sleep(self.latency)
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            if method == 'answerCallbackQuery':
+                return True
+            chat_id = str(params['chat_id'])
+            chat_log = self.chat_logs.setdefault(chat_id, deque())
+            group = chat_id.startswith('-')
+            if (self._over(self.global_log, now, 1, 30)
+                    or (group and self._over(chat_log, now, 60, 20))
+                    or (not group and self._over(chat_log, now, 1, 3))):
+                self.rejected += 1
+                raise RateLimited(1)
+            self.global_log.append(now)
+            chat_log.append(now)
+            return {'message_id': params.get('message_id', 1)}
+
+
+def run(mode, args, manager):
+    telegram = FakeTelegram(args.latency)
+    scheduler = None
+    if mode == 'scheduled':
+        scheduler = manager.OutboundScheduler()
+        scheduler.start()
+
+    def request(method, params):
+        if scheduler is None:
+            try:
+                return telegram.call(method, params)
+            except RateLimited:
+                return None  # hozirgi kod: xato chop etiladi va yo'qoladi
+        try:
+            return scheduler.submit(method, params, lambda p: telegram.call(method, p)).result()
+        except RateLimited:
+            return None
+
+    callback_latencies = []
+    lost = [0]
+
+    def user_session(user_id):
+        started = time.perf_counter()
+        if request('answerCallbackQuery', {'callback_query_id': str(user_id)}) is None:
+            lost[0] += 1
+        callback_latencies.append((time.perf_counter() - started) * 1000)
+        # Tugmani tez-tez bosish: bitta xabarning tahrirlari parallel oqimlarda keladi
+        with ThreadPoolExecutor(max_workers=args.edits) as edits:
+            results = list(edits.map(
+                lambda i: request('editMessageText', {'chat_id': user_id, 'message_id': 1, 'text': f"holat {i}"}),
+                range(args.edits)))
+        lost[0] += results.count(None)
+
+    def bulk_send(i):
+        if request('sendMessage', {'chat_id': -1000 - (i % args.groups), 'text': f"xabar {i}"}) is None:
+            lost[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        futures = [pool.submit(bulk_send, i) for i in range(args.bulk)]
+        time.sleep(0.05)
+        futures += [pool.submit(user_session, user_id) for user_id in range(1, args.users + 1)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    if scheduler is not None:
+        stats = scheduler.stats()
+        scheduler.stop()
+    else:
+        stats = {'coalesced': 0}
+
+    callback_latencies.sort()
+    return {
+        'mode': mode,
+        'callback_p50_ms': statistics.median(callback_latencies),
+        'callback_p99_ms': callback_latencies[int(len(callback_latencies) * 0.99)],
+        'requests': telegram.requests,
+        'rejected_429': telegram.rejected,
+        'lost': lost[0],
+        'coalesced': stats['coalesced'],
+        'elapsed_s': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="Tugma bosgan foydalanuvchilar")
+    parser.add_argument("--edits", type=int, default=3, help="Har bir foydalanuvchi xabarining tahrirlari")
+    parser.add_argument("--bulk", type=int, default=300, help="Guruhlarga ommaviy xabarlar")
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=64, help="Handler oqimlari")
+    parser.add_argument("--latency", type=float, default=0.05, help="Telegram javob vaqti (soniya)")
+    args = parser.parse_args()
+
+    manager = import_manager()
+    print(f"{'usul':<11}{'cb p50 ms':>11}{'cb p99 ms':>11}{'so‘rovlar':>11}{'429':>7}"
+          f"{'yo‘qolgan':>11}{'birlashgan':>12}{'vaqt s':>8}")
+    for mode in ('direct', 'scheduled'):
+        result = run(mode, args, manager)
+        print(f"{result['mode']:<11}{result['callback_p50_ms']:>11.0f}{result['callback_p99_ms']:>11.0f}"
+              f"{result['requests']:>11}{result['rejected_429']:>7}{result['lost']:>11}"
+              f"{result['coalesced']:>12}{result['elapsed_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
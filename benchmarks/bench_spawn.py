@@ -0,0 +1,113 @@
+"""
+Bot ishga tushirish usullarini solishtirish: oddiy Popen va fork-server (zigota).
+
+Har bir usulda N ta sinov boti ishga tushiriladi va o'lchanadi:
+- ishga tushish kechikishi (so'rovdan bot modullarni import qilib bo'lguncha)
+- barcha botlarning umumiy PSS xotirasi (/proc/<pid>/smaps_rollup)
+
+Ishlatish:
+    python3 benchmarks/bench_spawn.py --count 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_zygote import DEFAULT_PRELOAD, ForkServerClient  # noqa: E402
+
+BOT_SOURCE = """
+import os
+import time
+import telebot
+import requests
+
+open(os.environ["BENCH_READY_FILE"], "w").close()
+time.sleep(600)
+"""
+
+
+def read_pss_kb(pid):
+    """Jarayonning PSS xotirasi (kB)"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def wait_ready(path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Bot tayyor bo'lmadi: {path}")
+        time.sleep(0.001)
+
+
+def run_mode(mode, count, workdir, bot_path):
+    client = None
+    if mode == "forkserver":
+        client = ForkServerClient(DEFAULT_PRELOAD)
+        client.start()
+
+    latencies, processes = [], []
+    try:
+        for i in range(count):
+            ready_file = os.path.join(workdir, f"{mode}-{i}.ready")
+            env = {"BENCH_READY_FILE": ready_file}
+            started = time.perf_counter()
+            if client is not None:
+                process = client.spawn(bot_path, env=env)
+            else:
+                process = subprocess.Popen([sys.executable, bot_path], env={**os.environ, **env})
+            wait_ready(ready_file)
+            latencies.append((time.perf_counter() - started) * 1000)
+            processes.append(process)
+
+        pss_total = sum(read_pss_kb(process.pid) for process in processes)
+    finally:
+        for process in processes:
+            process.kill()
+        for process in processes:
+            process.wait()
+        if client is not None:
+            client.close()
+
+    return {
+        'mode': mode,
+        'count': count,
+        'latency_p50_ms': statistics.median(latencies),
+        'latency_max_ms': max(latencies),
+        'latency_mean_ms': statistics.mean(latencies),
+        'pss_total_mb': pss_total / 1024,
+        'pss_per_bot_mb': pss_total / 1024 / count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20, help="Har bir usulda ishga tushiriladigan botlar soni")
+    parser.add_argument("--modes", default="popen,forkserver")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot_path = os.path.join(workdir, "bench_bot.py")
+        with open(bot_path, "w") as f:
+            f.write(BOT_SOURCE)
+
+        print(f"{'usul':<12}{'p50 ms':>10}{'max ms':>10}{'PSS jami MB':>14}{'PSS/bot MB':>12}")
+        for mode in args.modes.split(","):
+            result = run_mode(mode, args.count, workdir, bot_path)
+            print(f"{result['mode']:<12}{result['latency_p50_ms']:>10.1f}{result['latency_max_ms']:>10.1f}"
+                  f"{result['pss_total_mb']:>14.1f}{result['pss_per_bot_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Benchmark skriptlari uchun umumiy yordamchilar"""
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def import_manager():
+    """
+    makerbotpostgre modulini import qilish.
+    Konfiguratsiyada hali haqiqiy token yozilmagan bo'lsa ham ishlashi uchun
+    telebot token formatini tekshirmaydigan qilib qo'yiladi.
+    """
+    import telebot.util
+
+    telebot.util.validate_token = lambda token: True
+    telebot.util.extract_bot_id = lambda token: None
+    import makerbotpostgre
+
+    return makerbotpostgre
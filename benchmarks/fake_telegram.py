@@ -0,0 +1,323 @@
+"""
+Sinov va benchmarklar uchun soxta Telegram.
+
+FakeTelegramClient - Telegram serveri o'rnida webhook manziliga yangilanishlar
+yuboradi (X-Telegram-Bot-Api-Secret-Token sarlavhasi bilan).
+
+FakeBotApi - Bot API serveri o'rnida ishlovchi lokal HTTP server: getUpdates
+(long polling), getChatMember, sendMessage, editMessageText, answerCallbackQuery,
+getFile va fayl yuklab olishni sozlanadigan kechikish bilan taqlid qiladi. Bot yuborgan xabarlar
+chat bo'yicha yoziladi va wait_message() orqali kutiladi.
+
+Misol:
+    client = FakeTelegramClient("http://127.0.0.1:8080/telegram/webhook", "secret")
+    client.send_command(user_id=42, text="/start")
+    client.press_button(user_id=42, data=callback_codec.encode("user_show_bots"), message_id=10)
+
+    api = FakeBotApi(latency=0.03).start()
+    apihelper.API_URL, apihelper.FILE_URL = api.api_url, api.file_url
+    api.put_update(api.message_update(42, "/start"))
+    reply = api.wait_message(42, lambda m: callback_codec.encode("user_show_bots") in m['raw_markup'])
+"""
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegramClient:
+    """Webhook ga Telegram kabi yangilanish yuboruvchi mijoz"""
+
+    def __init__(self, webhook_url, secret):
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+
+    @staticmethod
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    @staticmethod
+    def private_chat(user_id):
+        return {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+    def message_update(self, user_id, text):
+        message = {
+            "message_id": next(self._message_ids),
+            "from": self.user(user_id),
+            "chat": self.private_chat(user_id),
+            "date": int(time.time()),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback_update(self, user_id, data, message_id):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self.user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "from": {"id": 1, "is_bot": True, "first_name": "Manager"},
+                    "chat": self.private_chat(user_id),
+                    "date": int(time.time()),
+                    "text": "...",
+                },
+            },
+        }
+
+    def post(self, update, secret=None):
+        """Yangilanishni webhook ga yuborish, HTTP holat kodini qaytaradi"""
+        request = urllib.request.Request(
+            self.webhook_url,
+            data=json.dumps(update).encode("utf-8"),
+            headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": self.secret if secret is None else secret,
+            },
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def send_command(self, user_id, text):
+        return self.post(self.message_update(user_id, text))
+
+    def press_button(self, user_id, data, message_id):
+        return self.post(self.callback_update(user_id, data, message_id))
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    """/bot<token>/<metod> va /file/bot<token>/<yo'l> so'rovlarini FakeBotApi ga uzatadi"""
+
+    def _params(self):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            elif self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+        return params
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        api = self.server.api
+        parts = urllib.parse.urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) >= 3 and parts[0] == "file":
+            data = api.download("/".join(parts[2:]))
+            if data is None:
+                self._send(404, b"")
+            else:
+                self._send(200, data, "application/octet-stream")
+            return
+        if len(parts) != 2:
+            self._send(404, b"")
+            return
+        ok, result = api.call(parts[1], self._params())
+        payload = {"ok": True, "result": result} if ok else {"ok": False, "error_code": 400, "description": result}
+        self._send(200 if ok else 400, json.dumps(payload).encode("utf-8"))
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApi(FakeTelegramClient):
+    """Lokal soxta Bot API serveri"""
+
+    def __init__(self, latency=0.0, method_latency=None, host="127.0.0.1", port=0):
+        super().__init__(webhook_url=None, secret=None)
+        self.latency = latency
+        self.method_latency = method_latency or {}
+        self.calls = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), FakeBotApiHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.api = self
+        self._cond = threading.Condition()
+        self._updates = []
+        self._outbox = {}            # chat_id -> [yuborilgan xabarlar]
+        self._seq = itertools.count(1)
+        self._files = {}             # file_id -> (file_path, mazmun)
+        self._answers = {}           # callback_query_id -> answerCallbackQuery parametrlari
+        self._bot_message_ids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        return self.base_url + "/bot{0}/{1}"
+
+    @property
+    def file_url(self):
+        return self.base_url + "/file/bot{0}/{1}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-bot-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # ---------- Benchmark tomoni ----------
+    def post(self, update, secret=None):
+        """Yangilanishni getUpdates navbatiga qo'yish (FakeTelegramClient.send_command va press_button ham shu orqali)"""
+        self.put_update(update)
+        return 200
+
+    def put_update(self, update):
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+
+    def add_file(self, data, file_path):
+        """Yuklab olinadigan fayl qo'shish, file_id qaytaradi"""
+        file_id = f"file{len(self._files) + 1}"
+        self._files[file_id] = (file_path, data)
+        return file_id
+
+    def document_update(self, user_id, file_id, file_name):
+        update = self.message_update(user_id, "")
+        message = update["message"]
+        del message["text"]
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name,
+                               "file_size": len(self._files[file_id][1])}
+        return update
+
+    def mark(self):
+        """Hozirgi tartib raqami: wait_message shundan keyin yuborilgan xabarlarni kutadi"""
+        with self._cond:
+            return next(self._seq)
+
+    def wait_message(self, chat_id, predicate, after=0, timeout=10):
+        """Bot chatga yuborgan (yoki tahrirlagan) va shartga mos xabarni kutish; topilmasa None"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for message in self._outbox.get(chat_id, ()):
+                    if message['seq'] > after and predicate(message):
+                        return message
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def messages(self, chat_id, after=0):
+        """Bot chatga mark() dan keyin yuborgan (yoki tahrirlagan) barcha xabarlar"""
+        with self._cond:
+            return [message for message in self._outbox.get(chat_id, ()) if message['seq'] > after]
+
+    def pop_callback_answer(self, callback_query_id):
+        """Tugma bosilishiga berilgan javob (text, show_alert); javob berilmagan bo'lsa None"""
+        with self._cond:
+            answer = self._answers.pop(str(callback_query_id), None)
+        if answer is None:
+            return None
+        return answer.get("text", ""), str(answer.get("show_alert", "")).lower() == "true"
+
+    def last_message(self, chat_id):
+        with self._cond:
+            messages = self._outbox.get(chat_id)
+            return messages[-1] if messages else None
+
+    # ---------- Bot API tomoni ----------
+    def call(self, method, params):
+        if method != "getUpdates":
+            delay = self.method_latency.get(method, self.latency)
+            if delay:
+                time.sleep(delay)
+        with self._cond:
+            self.calls[method] += 1
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return True, True
+        return handler(params)
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._cond:
+            while True:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+                if self._updates:
+                    return True, list(self._updates[:int(params.get("limit") or 100)])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return True, []
+                self._cond.wait(remaining)
+
+    def _api_getMe(self, params):
+        return True, {"id": 1, "is_bot": True, "first_name": "Manager", "username": "manager_bot"}
+
+    def _api_getChatMember(self, params):
+        return True, {"status": "member", "user": self.user(int(params["user_id"]))}
+
+    def _record(self, chat_id, message_id, params):
+        markup = params.get("reply_markup") or ""
+        message = {
+            "message_id": message_id,
+            "from": {"id": 1, "is_bot": True, "first_name": "Manager"},
+            "chat": self.private_chat(chat_id),
+            "date": int(time.time()),
+            "text": params.get("text", ""),
+        }
+        if markup:
+            message["reply_markup"] = json.loads(markup)
+        with self._cond:
+            self._outbox.setdefault(chat_id, []).append(
+                {"seq": next(self._seq), "message_id": message_id, "text": message["text"], "raw_markup": markup})
+            self._cond.notify_all()
+        return message
+
+    def _api_sendMessage(self, params):
+        return True, self._record(int(params["chat_id"]), next(self._bot_message_ids), params)
+
+    def _api_editMessageText(self, params):
+        return True, self._record(int(params["chat_id"]), int(params["message_id"]), params)
+
+    def _api_answerCallbackQuery(self, params):
+        with self._cond:
+            self._answers[str(params["callback_query_id"])] = params
+        return True, True
+
+    def _api_getFile(self, params):
+        file = self._files.get(params.get("file_id"))
+        if file is None:
+            return False, "Bad Request: invalid file_id"
+        file_path, data = file
+        return True, {"file_id": params["file_id"], "file_unique_id": params["file_id"],
+                      "file_size": len(data), "file_path": file_path}
+
+    def download(self, file_path):
+        time.sleep(self.method_latency.get("getFile", self.latency))
+        for path, data in self._files.values():
+            if path == file_path:
+                return data
+        return None
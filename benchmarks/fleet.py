@@ -0,0 +1,199 @@
+"""
+Bir nechta ishchi tugunni (python3 makerbotpostgre.py worker) bitta vaqtinchalik
+PostgreSQL bilan mahalliy sinash.
+
+Bazaga --bots ta bot yoziladi (har biri uxlab turuvchi kichik python fayli), so'ng
+--nodes ta ishchi jarayon ishga tushiriladi va bosqichma-bosqich o'lchanadi:
+    start    - barcha botlar bittadan jarayonda ishlaguncha
+    join     - yana bitta tugun qo'shilib, botlar tugunlar orasida tenglashguncha
+    failover - birinchi tugun SIGKILL qilinib, uning botlari boshqalarda yoqilguncha
+    shutdown - qolgan tugunlar SIGTERM bilan to'xtab, bot jarayonlari qolmaguncha
+
+Har bir bosqichda /proc orqali har bir bot uchun jarayonlar soni kuzatiladi (ikkala
+BOT_LAUNCH_MODE da, --launch-mode):
+"ikki nusxa" ustuni bitta token bir vaqtda ikki jarayonda ishlagan holatlar soni (0 bo'lishi kerak).
+
+Ishlatish:
+    python3 benchmarks/fleet.py --pg-server /var/run/postgresql --bots 60 --nodes 3
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+from common import import_manager
+from local_postgres import ThrowawayPostgres
+
+# Bot o'z faylini ochiq ushlab turadi: zigota bolalarining cmdline i zigotaniki bo'lgani uchun
+# jarayonlar /proc/<pid>/fd orqali topiladi
+IDLE_BOT = b"import time\nmarker = open(__file__)\nwhile True:\n    time.sleep(3600)\n"
+
+
+def tune(manager, args):
+    """Sinov uchun qisqa heartbeat va lease vaqtlari"""
+    manager.WORKER_HEARTBEAT_INTERVAL = args.heartbeat
+    manager.WORKER_LEASE_TTL = args.lease_ttl
+    manager.WORKER_CLAIM_BATCH = args.claim_batch
+    manager.SUPERVISOR_STOP_TIMEOUT = 2
+    manager.BOT_LAUNCH_MODE = args.launch_mode
+
+
+def run_child(args):
+    """Bola jarayon: bitta ishchi tugun"""
+    manager = import_manager()
+    tune(manager, args)
+    db_config = json.loads(args.db_config)
+    manager.db_pool.config = db_config
+    manager.cache_invalidator.config = db_config
+    manager.db_pool.open()
+    try:
+        manager.run_worker(SimpleNamespace(node_id=args.child, capacity=args.capacity, metrics_port=0))
+    finally:
+        manager.db_pool.closeall()
+
+
+def bot_processes(bots_dir):
+    """Har bir bot fayli uchun ishlab turgan jarayonlar soni"""
+    counts = Counter()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", 'rb') as f:
+                if f.read().rsplit(b')', 1)[1].split()[0] == b'Z':
+                    continue
+            targets = {os.readlink(f"/proc/{pid}/fd/{fd}") for fd in os.listdir(f"/proc/{pid}/fd")}
+        except OSError:
+            continue
+        for target in targets:
+            if target.startswith(bots_dir):
+                counts[target] += 1
+    return counts
+
+
+def lease_counts(manager):
+    with manager.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT node_id, count(*) AS bots FROM bot_leases GROUP BY node_id")
+            return {row['node_id']: row['bots'] for row in cur.fetchall()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=60)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--capacity", type=int, default=500, help="Har bir tugun sig'imi")
+    parser.add_argument("--heartbeat", type=float, default=1, help="WORKER_HEARTBEAT_INTERVAL (soniya)")
+    parser.add_argument("--lease-ttl", type=float, default=4, help="WORKER_LEASE_TTL (soniya)")
+    parser.add_argument("--claim-batch", type=int, default=50, help="WORKER_CLAIM_BATCH")
+    parser.add_argument("--launch-mode", choices=("popen", "forkserver"), default="popen",
+                        help="BOT_LAUNCH_MODE")
+    parser.add_argument("--timeout", type=float, default=60, help="Bitta bosqich uchun vaqt chegarasi (soniya)")
+    parser.add_argument("--pg-bin", help="initdb va pg_ctl joylashgan papka (vaqtinchalik klaster)")
+    parser.add_argument("--pg-server", help="Mavjud server hosti yoki soket papkasi (vaqtinchalik baza)")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default="")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--db-config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    manager = import_manager()
+    postgres = ThrowawayPostgres(pg_bin=args.pg_bin, server=args.pg_server, user=args.pg_user,
+                                 password=args.pg_password)
+    db_config = postgres.start()
+    manager.db_pool.config = db_config
+    workdir = tempfile.mkdtemp(prefix="makerbot_fleet_")
+    bots_dir = os.path.join(workdir, "bots")
+    os.makedirs(bots_dir)
+    nodes = {}
+
+    def spawn_node(name):
+        nodes[name] = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--child", name, "--db-config", json.dumps(db_config),
+             "--capacity", str(args.capacity), "--heartbeat", str(args.heartbeat),
+             "--lease-ttl", str(args.lease_ttl), "--claim-batch", str(args.claim_batch),
+             "--launch-mode", args.launch_mode],
+            stdout=subprocess.DEVNULL)
+
+    def wait_until(phase, done):
+        """Shart bajarilguncha kuzatish; (vaqt, ikki nusxa holatlari) qaytaradi"""
+        started = time.monotonic()
+        duplicates = 0
+        while True:
+            counts = bot_processes(bots_dir)
+            duplicates = max(duplicates, sum(1 for count in counts.values() if count > 1))
+            leases = lease_counts(manager)
+            if done(counts, leases):
+                elapsed = time.monotonic() - started
+                spread = " ".join(f"{node}={bots}" for node, bots in sorted(leases.items())) or "-"
+                print(f"{phase:<10}{elapsed:>8.1f}{duplicates:>12}   {spread}")
+                return
+            if time.monotonic() - started > args.timeout:
+                running = sum(1 for count in counts.values() if count)
+                print(f"{phase:<10}{'vaqt tugadi':>8}{duplicates:>12}   ishlayapti {running}/{args.bots}, lease {leases}")
+                return
+            time.sleep(0.2)
+
+    def all_running(counts, leases):
+        return (len(counts) == args.bots and all(count == 1 for count in counts.values())
+                and sum(leases.values()) == args.bots)
+
+    try:
+        manager.db_pool.open()
+        manager.init_database()
+        template_path = os.path.join(workdir, "idle_bot.py")
+        with open(template_path, 'wb') as f:
+            f.write(IDLE_BOT)
+        template_id = str(uuid.uuid4())
+        manager.save_bot_template(template_id, "fleet", template_path, "idle_bot.py")
+        bots = []
+        for i in range(args.bots):
+            bot_id = str(uuid.uuid4())
+            path = os.path.join(bots_dir, f"{bot_id}.py")
+            with open(path, 'wb') as f:
+                f.write(IDLE_BOT)
+            bots.append({'id': bot_id, 'template_id': template_id, 'token': f"{100000 + i}:fleet",
+                         'admin_id': None, 'owner_id': None, 'path': path, 'launch_mode': 'copy'})
+        manager.save_user_bots_batch(bots, ())
+
+        print(f"{args.bots} ta bot, {args.nodes} ta tugun, heartbeat {args.heartbeat} s, lease {args.lease_ttl} s, "
+              f"{args.launch_mode}")
+        print(f"{'bosqich':<10}{'soniya':>8}{'ikki nusxa':>12}   tugunlardagi botlar")
+        for i in range(args.nodes):
+            spawn_node(f"node{i + 1}")
+        wait_until("start", all_running)
+
+        spawn_node(f"node{args.nodes + 1}")
+        # Tugun ulushi yuqoriga yaxlitlanadi: hech bir tugunda ceil(botlar / tugunlar) dan ortiq qolmaguncha
+        share = -(-args.bots // len(nodes))
+        wait_until("join", lambda counts, leases: all_running(counts, leases) and len(leases) == len(nodes)
+                   and max(leases.values()) <= share)
+
+        nodes.pop("node1").send_signal(signal.SIGKILL)
+        wait_until("failover", lambda counts, leases: all_running(counts, leases) and "node1" not in leases)
+
+        for process in nodes.values():
+            process.send_signal(signal.SIGTERM)
+        for process in nodes.values():
+            process.wait(timeout=args.timeout)
+        nodes.clear()
+        wait_until("shutdown", lambda counts, leases: not counts and not leases)
+    finally:
+        for process in nodes.values():
+            process.kill()
+        manager.db_pool.closeall()
+        postgres.stop()
+
+
+if __name__ == "__main__":
+    main()
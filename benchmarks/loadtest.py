@@ -0,0 +1,334 @@
+"""
+Menejer botni haqiqiy handlerlari bilan yuklama ostida sinash.
+
+Soxta Bot API serveri (fake_telegram.FakeBotApi) va vaqtinchalik PostgreSQL
+(local_postgres.ThrowawayPostgres) ko'tariladi, bot odatdagidek getUpdates
+(yoki --mode webhook da webhook serveri) orqali yangilanishlarni oladi.
+Avval admin shablonni getFile orqali yuklaydi, so'ng har bir parallellik
+darajasida foydalanuvchi sessiyalari o'ynaladi:
+    /start -> botlar katalogi -> shablon -> bot yaratish (token, admin ID) -> mening botlarim -> boshqaruv
+
+Har bir qadam uchun o'tkazuvchanlik, p50/p99 kechikish (yangilanish yuborilgandan
+bot javobigacha) va sessiyaga to'g'ri keladigan DB so'rovlari (funksiya bo'yicha)
+chiqariladi - masalan load_user_bots so'rovlari ko'payib qolsa shu yerda ko'rinadi.
+
+Bot jarayonlari sukut bo'yicha ishga tushirilmaydi (nazoratchiga bo'sh jarayon
+beriladi), --spawn bilan haqiqiy jarayonlar yoqiladi.
+
+Ishlatish:
+    python3 benchmarks/loadtest.py --pg-bin /usr/lib/postgresql/16/bin --concurrency 1,5,20
+    python3 benchmarks/loadtest.py --pg-server /var/run/postgresql --latency 0.05 --json natija.json
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from common import import_manager
+from fake_telegram import FakeBotApi, FakeTelegramClient
+from local_postgres import ThrowawayPostgres
+
+ADMIN_ID = 1
+TEMPLATE_SOURCE = b'''import telebot
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+ADMIN_ID = 1
+bot = telebot.TeleBot(TOKEN)
+
+
+@bot.message_handler(commands=['start'])
+def start(message):
+    bot.reply_to(message, "Salom!")
+
+
+bot.infinity_polling()
+'''
+STEPS = ('start', 'catalog', 'template', 'create', 'token', 'admin_id', 'my_bots', 'manage')
+
+
+def has_button(data):
+    return lambda message: data in message['raw_markup']
+
+
+def button_args(codec, message, action):
+    """Xabar tugmalari orasidan berilgan amal tugmasining parametrlari"""
+    for row in json.loads(message['raw_markup'])['inline_keyboard']:
+        for button in row:
+            decoded = codec.decode(button.get('callback_data'))
+            if decoded is not None and decoded[0].name == action:
+                return decoded[1]
+    return None
+
+
+def has_text(fragment):
+    return lambda message: fragment in message['text']
+
+
+class IdleProcess:
+    """Bot jarayoni o'rnida turadigan bo'sh obyekt (jarayon yoqish vaqti o'lchovga kirmaydi)"""
+
+    _pids = itertools.count(4_000_000)
+
+    def __init__(self):
+        self.pid = next(self._pids)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = 0
+
+    kill = terminate
+
+
+class Session:
+    """Bitta foydalanuvchining to'liq sessiyasi"""
+
+    def __init__(self, api, deliver, codec, user_id, template_id, timeout):
+        self.api = api
+        self.deliver = deliver
+        self.codec = codec
+        self.user_id = user_id
+        self.template_id = template_id
+        self.timeout = timeout
+        self.timings = []   # (qadam, soniya yoki None)
+
+    def _step(self, name, update, predicate):
+        mark = self.api.mark()
+        started = time.perf_counter()
+        self.deliver(update)
+        message = self.api.wait_message(self.user_id, predicate, after=mark, timeout=self.timeout)
+        self.timings.append((name, time.perf_counter() - started if message else None))
+        if message is None:
+            raise TimeoutError(name)
+        return message
+
+    def _message(self, name, text, predicate):
+        return self._step(name, self.api.message_update(self.user_id, text), predicate)
+
+    def _press(self, name, data, predicate):
+        message_id = self.api.last_message(self.user_id)['message_id']
+        return self._step(name, self.api.callback_update(self.user_id, data, message_id), predicate)
+
+    def run(self):
+        template_id, encode = self.template_id, self.codec.encode
+        show_bots = encode("user_show_bots")
+        select_template = encode("user_select_template", template_id)
+        create_bot = encode("user_create_bot", template_id)
+        try:
+            self._message('start', "/start", has_button(show_bots))
+            self._press('catalog', show_bots, has_button(select_template))
+            self._press('template', select_template, has_button(create_bot))
+            self._press('create', create_bot, has_text("token"))
+            self._message('token', f"{self.user_id}:{'A' * 35}", has_text("admin ID"))
+            created = self._message('admin_id', "yoq", has_text("muvaffaqiyatli"))
+            bot_id, = button_args(self.codec, created, "user_manage_bot")
+            manage_bot = encode("user_manage_bot", bot_id)
+            self._press('my_bots', encode("user_my_bots", 'template', template_id), has_button(manage_bot))
+            self._press('manage', manage_bot, has_button(encode("user_stop_bot", bot_id)))
+        except TimeoutError:
+            pass
+
+
+def upload_template(api, deliver, manager, timeout):
+    """Admin sifatida shablonni handlerlar orqali yuklash (getFile va fayl yuklab olish ishlatiladi)"""
+    add_template = manager.callback_codec.encode("admin_add_template")
+    session = Session(api, deliver, manager.callback_codec, ADMIN_ID, None, timeout)
+    session._message('admin_start', "/start", has_button(add_template))
+    session._press('admin_add_template', add_template, has_text(".py"))
+    file_id = api.add_file(TEMPLATE_SOURCE, "documents/bench_template.py")
+    session._step('admin_upload', api.document_update(ADMIN_ID, file_id, "bench_template.py"), has_text("nom"))
+    session._message('admin_name', "Bench", has_text("muvaffaqiyatli"))
+    for template_id, template_data in manager.load_bot_templates().items():
+        if template_data['name'] == "Bench":
+            return template_id
+    raise RuntimeError("Shablon saqlanmadi")
+
+
+def run_level(api, deliver, manager, template_id, concurrency, sessions, timeout, user_ids):
+    """Bitta parallellik darajasi: concurrency ta oqim, har biri sessions ta sessiya"""
+    db_before = manager.db_query_latency.snapshot()
+    api_before = Counter(api.calls)
+    completed = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(sessions):
+            with lock:
+                user_id = next(user_ids)
+            session = Session(api, deliver, manager.callback_codec, user_id, template_id, timeout)
+            session.run()
+            with lock:
+                completed.append(session)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings = defaultdict(list)
+    failures = Counter()
+    for session in completed:
+        for name, seconds in session.timings:
+            if seconds is None:
+                failures[name] += 1
+            else:
+                timings[name].append(seconds)
+
+    db_after = manager.db_query_latency.snapshot()
+    db_queries = {helper: (count - db_before.get(helper, (0, 0.0))[0]) / len(completed)
+                  for helper, (count, _) in db_after.items()
+                  if count > db_before.get(helper, (0, 0.0))[0]}
+    api_calls = {method: (count - api_before[method]) / len(completed)
+                 for method, count in api.calls.items() if count > api_before[method]}
+
+    steps = {}
+    for name in STEPS:
+        values = sorted(timings.get(name, ()))
+        steps[name] = {
+            'count': len(values),
+            'failed': failures[name],
+            'throughput': len(values) / elapsed,
+            'p50_ms': statistics.median(values) * 1000 if values else None,
+            'p99_ms': values[min(int(len(values) * 0.99), len(values) - 1)] * 1000 if values else None,
+        }
+    return {
+        'concurrency': concurrency,
+        'sessions': len(completed),
+        'elapsed_s': elapsed,
+        'sessions_per_s': len(completed) / elapsed,
+        'steps': steps,
+        'db_queries_per_session': db_queries,
+        'api_calls_per_session': api_calls,
+    }
+
+
+def print_level(result):
+    print(f"\n== {result['concurrency']} ta parallel foydalanuvchi: {result['sessions']} sessiya, "
+          f"{result['elapsed_s']:.1f} s, {result['sessions_per_s']:.1f} sessiya/s ==")
+    print(f"{'qadam':<12}{'soni':>7}{'xato':>6}{'qadam/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, step in result['steps'].items():
+        p50 = f"{step['p50_ms']:.1f}" if step['p50_ms'] is not None else "-"
+        p99 = f"{step['p99_ms']:.1f}" if step['p99_ms'] is not None else "-"
+        print(f"{name:<12}{step['count']:>7}{step['failed']:>6}{step['throughput']:>10.1f}{p50:>10}{p99:>10}")
+    queries = result['db_queries_per_session']
+    print(f"DB so'rovlari (sessiyaga): jami {sum(queries.values()):.1f}")
+    for helper, count in sorted(queries.items(), key=lambda item: -item[1]):
+        print(f"  {helper:<32}{count:>8.2f}")
+    calls = result['api_calls_per_session']
+    print("Bot API so'rovlari (sessiyaga): " + ", ".join(f"{method} {count:.1f}" for method, count in sorted(calls.items())
+                                                        if method != "getUpdates"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,5,20", help="Parallel foydalanuvchilar darajalari (vergul bilan)")
+    parser.add_argument("--sessions", type=int, default=5, help="Har bir oqimdagi ketma-ket sessiyalar")
+    parser.add_argument("--latency", type=float, default=0.03, help="Bot API javob vaqti (soniya)")
+    parser.add_argument("--member-latency", type=float, default=None, help="getChatMember javob vaqti (soniya)")
+    parser.add_argument("--channels", type=int, default=1, help="Majburiy obuna kanallari soni")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--dispatch", choices=("ordered", "threaded"), default="ordered",
+                        help="HANDLER_DISPATCH: chatlar bo'yicha tartibli yoki umumiy pul")
+    parser.add_argument("--handler-threads", type=int, default=None,
+                        help="Handler oqimlari (ordered: HANDLER_WORKERS, threaded: TeleBot puli / WEBHOOK_WORKERS)")
+    parser.add_argument("--outbound", action="store_true", help="Chiquvchi so'rovlar rejalashtiruvchisini yoqish")
+    parser.add_argument("--spawn", action="store_true", help="Bot jarayonlarini haqiqatan ishga tushirish")
+    parser.add_argument("--timeout", type=float, default=30, help="Bitta qadam javobini kutish (soniya)")
+    parser.add_argument("--pg-bin", help="initdb va pg_ctl joylashgan papka (vaqtinchalik klaster)")
+    parser.add_argument("--pg-server", help="Mavjud server hosti yoki soket papkasi (vaqtinchalik baza)")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default="")
+    parser.add_argument("--json", help="Natijalarni shu faylga yozish (o'zgarishlarni solishtirish uchun)")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Bot va shablon fayllari vaqtinchalik papkaga yoziladi
+    work_dir = tempfile.mkdtemp(prefix="makerbot-loadtest-")
+    os.chdir(work_dir)
+    manager = import_manager()
+    from telebot import apihelper, util
+
+    method_latency = {} if args.member_latency is None else {'getChatMember': args.member_latency}
+    api = FakeBotApi(latency=args.latency, method_latency=method_latency).start()
+    apihelper.API_URL, apihelper.FILE_URL = api.api_url, api.file_url
+    manager.ADMIN_ID = str(ADMIN_ID)
+    if not args.spawn:
+        manager.bot_supervisor._spawn = lambda entry: IdleProcess()
+
+    postgres = ThrowawayPostgres(pg_bin=args.pg_bin, server=args.pg_server, user=args.pg_user,
+                                 password=args.pg_password)
+    manager.db_pool.config = postgres.start()
+    webhook = None
+    try:
+        manager.db_pool.open()
+        manager.init_database()
+        for i in range(args.channels):
+            manager.add_global_channel(f"@bench_channel_{i}")
+        manager.list_global_channels.cache_clear()
+        if args.outbound:
+            manager.outbound_scheduler.start()
+
+        bot = manager.bot
+        if args.handler_threads:
+            manager.HANDLER_WORKERS = manager.WEBHOOK_WORKERS = args.handler_threads
+        if args.mode == "webhook" or args.dispatch == "ordered":
+            manager.update_dispatcher = manager.create_update_dispatcher(bot.process_new_updates, args.dispatch)
+        if args.mode == "webhook":
+            bot.threaded = False
+            webhook = manager.WebhookServer("127.0.0.1", 0, "/telegram/webhook", "bench", manager.update_dispatcher)
+            webhook.start()
+            client = FakeTelegramClient(f"http://127.0.0.1:{webhook.port}/telegram/webhook", "bench")
+            deliver = client.post
+        else:
+            if manager.update_dispatcher is not None:
+                manager.route_polling_updates(bot, manager.update_dispatcher)
+                manager.update_dispatcher.start()
+            elif args.handler_threads:
+                bot.worker_pool = util.ThreadPool(bot, num_threads=args.handler_threads)
+            threading.Thread(target=bot.polling, name="loadtest-polling", daemon=True,
+                             kwargs={'non_stop': True, 'interval': 0, 'timeout': 5, 'long_polling_timeout': 1}).start()
+            deliver = api.put_update
+
+        template_id = upload_template(api, deliver, manager, args.timeout)
+        print(f"Shablon yuklandi: {template_id} (rejim: {args.mode}/{args.dispatch}, Bot API kechikishi: {args.latency * 1000:.0f} ms)")
+
+        user_ids = itertools.count(1_000_000)
+        results = []
+        for concurrency in levels:
+            result = run_level(api, deliver, manager, template_id, concurrency, args.sessions, args.timeout, user_ids)
+            print_level(result)
+            results.append(result)
+
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump({'args': vars(args), 'levels': results}, f, ensure_ascii=False, indent=2)
+    finally:
+        if webhook is not None:
+            webhook.stop(timeout=5)
+        else:
+            manager.bot.stop_polling()
+            if manager.update_dispatcher is not None:
+                manager.update_dispatcher.stop(timeout=5)
+        manager.outbound_scheduler.stop()
+        manager.bot_supervisor.shutdown()
+        manager.db_pool.closeall()
+        postgres.stop()
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
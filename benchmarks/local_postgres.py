@@ -0,0 +1,94 @@
+"""
+Benchmarklar uchun vaqtinchalik PostgreSQL.
+
+Ikki usul:
+- cluster - initdb bilan vaqtinchalik papkada yangi klaster (faqat unix soket,
+  fsync o'chirilgan), oxirida to'xtatilib o'chiriladi. initdb root foydalanuvchidan
+  ishlamaydi.
+- server  - mavjud serverda vaqtinchalik baza yaratiladi va oxirida o'chiriladi.
+
+Misol:
+    with ThrowawayPostgres(pg_bin="/usr/lib/postgresql/16/bin") as db_config:
+        manager.db_pool.config = db_config
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+
+import psycopg2
+
+
+class ThrowawayPostgres:
+    """Vaqtinchalik klaster yoki mavjud serverdagi vaqtinchalik baza"""
+
+    def __init__(self, pg_bin=None, server=None, user="postgres", password="", port=None):
+        self.pg_bin = pg_bin
+        self.server = server
+        self.user = user
+        self.password = password
+        self.port = port
+        self.data_dir = None
+        self.database = None
+
+    def _tool(self, name):
+        if self.pg_bin:
+            return os.path.join(self.pg_bin, name)
+        path = shutil.which(name)
+        if path is None:
+            raise RuntimeError(f"{name} topilmadi: --pg-bin yoki --pg-server ni ko'rsating")
+        return path
+
+    def _server_config(self, database):
+        config = {'host': self.server, 'database': database, 'user': self.user, 'password': self.password}
+        if self.port:
+            config['port'] = self.port
+        return config
+
+    def start(self):
+        """Bazani tayyorlash va makerbotpostgre.DB_CONFIG ko'rinishidagi sozlamani qaytarish"""
+        if self.server:
+            self.database = f"makerbot_bench_{uuid.uuid4().hex[:12]}"
+            conn = psycopg2.connect(**self._server_config('postgres'))
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f'CREATE DATABASE "{self.database}"')
+            finally:
+                conn.close()
+            return self._server_config(self.database)
+
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise RuntimeError("initdb root foydalanuvchidan ishlamaydi: boshqa foydalanuvchidan "
+                               "ishga tushiring yoki --pg-server ni ko'rsating")
+        self.data_dir = tempfile.mkdtemp(prefix="makerbot-pg-")
+        subprocess.run([self._tool("initdb"), "-D", self.data_dir, "-U", self.user, "-A", "trust",
+                        "-E", "UTF8", "--no-sync"], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._tool("pg_ctl"), "-D", self.data_dir, "-w", "-l", os.path.join(self.data_dir, "server.log"),
+                        "-o", f"-k {self.data_dir} -h '' -c fsync=off -c synchronous_commit=off", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        return {'host': self.data_dir, 'database': 'postgres', 'user': self.user, 'password': ''}
+
+    def stop(self):
+        """Vaqtinchalik bazani o'chirish (ulanishlar oldin yopilgan bo'lishi kerak)"""
+        if self.server and self.database:
+            conn = psycopg2.connect(**self._server_config('postgres'))
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f'DROP DATABASE IF EXISTS "{self.database}" WITH (FORCE)')
+            finally:
+                conn.close()
+            self.database = None
+        if self.data_dir:
+            subprocess.run([self._tool("pg_ctl"), "-D", self.data_dir, "-m", "immediate", "stop"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+            self.data_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,313 @@
+"""
+Foydalanuvchi botlari uchun fork-server (zigota).
+
+Zigota umumiy modullarni (telebot, requests, ...) bir marta import qiladi va
+har bir bot uchun o'zidan fork qiladi. Bolalar import qilingan modullarni
+qayta yuklamaydi va xotira sahifalarini zigota bilan copy-on-write tarzida
+bo'lishadi.
+
+Protokol: menejer zigotaning stdin iga JSON qatorlar yozadi, zigota javoblarni
+--reply-fd orqali berilgan pipe ga yozadi:
+    -> {"id": 1, "cmd": "spawn", "path": "...", "env": {...}, "limits": [[resurs, yumshoq, qattiq], ...]}
+    <- {"id": 1, "pid": 12345}
+    <- {"event": "exit", "pid": 12345, "returncode": 1}
+"""
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_PRELOAD = ("telebot", "requests")
+PR_SET_PDEATHSIG = 1
+
+
+# ==================== ZIGOTA JARAYONI ====================
+def _preload(modules):
+    """Umumiy modullarni oldindan import qilish"""
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception as e:
+            print(f"Zigota: '{name}' modulini yuklab bo'lmadi: {e}", file=sys.stderr)
+
+
+def _set_parent_death_signal(parent_pid):
+    """Zigota o'lsa (SIGKILL ham) bola SIGTERM oladi"""
+    import ctypes
+    import signal
+
+    ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    # Zigota fork va prctl orasida o'lgan bo'lsa
+    if os.getppid() != parent_pid:
+        os._exit(1)
+
+
+def _run_child(request, reply_fd, kill_with_parent=False, parent_pid=None):
+    """Fork qilingan bolada bot faylini ishga tushirish"""
+    import runpy
+    import signal
+    import traceback
+
+    if kill_with_parent:
+        _set_parent_death_signal(parent_pid)
+    os.setsid()
+    os.close(reply_fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    import resource
+    for resource_id, soft, hard in request.get('limits') or ():
+        try:
+            resource.setrlimit(resource_id, (soft, hard))
+        except (OSError, ValueError) as e:
+            print(f"Zigota: resurs chegarasini qo'yib bo'lmadi: {e}", file=sys.stderr)
+
+    os.environ.update(request.get('env') or {})
+    path = request['path']
+    sys.argv = [path]
+    code = 0
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(code)
+
+
+def _reap_children(reply, children):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        children.discard(pid)
+        reply({'event': 'exit', 'pid': pid, 'returncode': os.waitstatus_to_exitcode(status)})
+
+
+def _terminate_children(children):
+    """Har bir bolaning sessiyasini (bot o'zi yoqqan jarayonlar bilan) SIGTERM bilan to'xtatish"""
+    import signal
+
+    for pid in children:
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def serve(reply_fd, preload, kill_children=False):
+    """
+    Zigota asosiy sikli: so'rovlarni o'qish, fork qilish, tugaganlarni yig'ish.
+    kill_children=True bo'lsa bolalar menejer (stdin yopilishi) yoki zigota bilan birga to'xtaydi.
+    """
+    import gc
+
+    _preload(preload)
+    # Yuklangan obyektlarni GC kuzatuvidan chiqaramiz, aks holda bolalarda
+    # GC ularning sarlavhalariga yozib, umumiy sahifalarni nusxalab yuboradi
+    gc.collect()
+    gc.freeze()
+
+    def reply(message):
+        os.write(reply_fd, (json.dumps(message) + "\n").encode())
+
+    buffer = b""
+    children = set()
+    zygote_pid = os.getpid()
+    stdin_fd = sys.stdin.fileno()
+    while True:
+        ready, _, _ = select.select([stdin_fd], [], [], 0.5)
+        _reap_children(reply, children)
+        if not ready:
+            continue
+        chunk = os.read(stdin_fd, 65536)
+        if not chunk:
+            # Menejer yopildi yoki o'ldi - odatda bolalar o'z sessiyalarida ishlashda davom etadi
+            if kill_children:
+                _terminate_children(children)
+            return
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if request.get('cmd') != 'spawn':
+                reply({'id': request.get('id'), 'error': f"Noma'lum buyruq: {request.get('cmd')}"})
+                continue
+            try:
+                pid = os.fork()
+            except OSError as e:
+                reply({'id': request.get('id'), 'error': str(e)})
+                continue
+            if pid == 0:
+                _run_child(request, reply_fd, kill_children, zygote_pid)
+            children.add(pid)
+            reply({'id': request.get('id'), 'pid': pid})
+
+
+# ==================== MENEJER TOMONI ====================
+class ForkedProcess:
+    """Zigota fork qilgan jarayon uchun subprocess.Popen ga o'xshash boshqaruvchi"""
+
+    def __init__(self, client, pid):
+        self._client = client
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            self.returncode = self._client.exit_code(self.pid)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"pid {self.pid}", timeout)
+            self._client.wait_for_exit(0.1)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        import signal
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        import signal
+        self.send_signal(signal.SIGKILL)
+
+
+class ForkServerClient:
+    """Zigota jarayonini ishga tushiradi va unga fork so'rovlarini yuboradi"""
+
+    def __init__(self, preload=DEFAULT_PRELOAD, python=sys.executable, spawn_timeout=10, kill_children=False):
+        self.preload = tuple(preload)
+        self.python = python
+        self.spawn_timeout = spawn_timeout
+        self.kill_children = kill_children
+        self._process = None
+        self._reader = None
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._next_id = 0
+        self._replies = {}
+        self._exits = {}
+
+    def start(self):
+        """Zigotani ishga tushirish"""
+        read_fd, write_fd = os.pipe()
+        command = [self.python, os.path.abspath(__file__), "--reply-fd", str(write_fd),
+                   "--preload", ",".join(self.preload)]
+        if self.kill_children:
+            command.append("--kill-children")
+        try:
+            self._process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                pass_fds=(write_fd,),
+            )
+        finally:
+            os.close(write_fd)
+        self._reader = threading.Thread(target=self._read_replies, args=(read_fd,),
+                                        name="forkserver-reader", daemon=True)
+        self._reader.start()
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _read_replies(self, read_fd):
+        with os.fdopen(read_fd, 'rb') as stream:
+            for line in stream:
+                message = json.loads(line)
+                with self._cond:
+                    if message.get('event') == 'exit':
+                        self._exits[message['pid']] = message['returncode']
+                    else:
+                        self._replies[message['id']] = message
+                    self._cond.notify_all()
+        with self._cond:
+            self._cond.notify_all()
+
+    def spawn(self, path, env=None, limits=None):
+        """Bot faylini zigotadan fork qilingan jarayonda ishga tushirish (limits - setrlimit qiymatlari)"""
+        with self._cond:
+            self._next_id += 1
+            request_id = self._next_id
+        request = {'id': request_id, 'cmd': 'spawn', 'path': os.path.abspath(path),
+                   'env': env or {}, 'limits': list(limits or ())}
+        with self._write_lock:
+            self._process.stdin.write((json.dumps(request) + "\n").encode())
+            self._process.stdin.flush()
+
+        deadline = time.monotonic() + self.spawn_timeout
+        with self._cond:
+            while request_id not in self._replies:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.alive():
+                    raise RuntimeError("Zigota fork so'roviga javob bermadi")
+                self._cond.wait(min(remaining, 0.5))
+            reply = self._replies.pop(request_id)
+        if 'error' in reply:
+            raise RuntimeError(f"Zigota xatosi: {reply['error']}")
+        return ForkedProcess(self, reply['pid'])
+
+    def exit_code(self, pid):
+        """Jarayon tugagan bo'lsa uning kodi, aks holda None"""
+        with self._cond:
+            if pid in self._exits:
+                return self._exits.pop(pid)
+        if self.alive():
+            return None
+        # Zigota o'lgan: bolalar init ga o'tgan, faqat borligini tekshira olamiz
+        try:
+            os.kill(pid, 0)
+            return None
+        except ProcessLookupError:
+            return -1
+        except PermissionError:
+            return None
+
+    def wait_for_exit(self, timeout):
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def close(self):
+        """Zigotani yopish (kill_children=False bo'lsa fork qilingan botlar ishlashda davom etadi)"""
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=5)
+        except Exception:
+            self._process.kill()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Foydalanuvchi botlari uchun fork-server")
+    parser.add_argument("--reply-fd", type=int, required=True)
+    parser.add_argument("--preload", default=",".join(DEFAULT_PRELOAD))
+    parser.add_argument("--kill-children", action="store_true",
+                        help="Menejer yoki zigota o'lganda bolalarni ham to'xtatish (ishchi tugunlar)")
+    args = parser.parse_args()
+    serve(args.reply_fd, [name for name in args.preload.split(",") if name], args.kill_children)
@@ -0,0 +1,605 @@
+"""
+Bot menejerining asyncio varianti (AsyncTeleBot asosida).
+
+makerbotpostgre.py dagi admin va foydalanuvchi oqimlari shu yerda bitta event
+loop ustida ishlaydi. Ekran matnlari, tugmalar va biznes amallari
+makerbotpostgre.py dan olinadi, shuning uchun ikkala variant bir xil javob
+beradi. Ma'lumotlar bazasi va fayl/jarayon amallari umumiy ulanishlar puli
+orqali asyncio.to_thread da bajariladi, Telegram so'rovlari esa aiohttp
+orqali bloklamasdan yuboriladi (AsyncTeleBot uchun aiohttp kerak).
+
+Ishlatish:
+    python3 makerbot_async.py
+"""
+import asyncio
+import signal
+import threading
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_handler_backends import ContinueHandling
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
+
+import makerbotpostgre as core
+from makerbotpostgre import (
+    SUBSCRIPTION_CHECK_DEADLINE,
+    TOKEN,
+    is_admin,
+    membership_cache,
+)
+
+bot = AsyncTeleBot(TOKEN)
+
+# ==================== CHIQUVCHI SO'ROVLAR ====================
+# Xabar yuboruvchi so'rovlar sinxron variantdagi core.outbound_scheduler limitlari va
+# ustuvorliklari bo'yicha yuboriladi; so'rovning o'zi shu event loop da bajariladi
+_direct_process_request = core.timed_api_request(asyncio_helper._process_request)
+
+async def scheduled_process_request(token, url, method='get', params=None, files=None, **kwargs):
+    scheduler = core.outbound_scheduler
+    if not scheduler.running or url not in core.OUTBOUND_METHODS:
+        return await _direct_process_request(token, url, method, params=params, files=files, **kwargs)
+    loop = asyncio.get_running_loop()
+    rewind = core.upload_rewinder(files)
+
+    def send(job_params):
+        # Rejalashtiruvchi oqimida: so'rovni event loop da bajarib, natijani kutish
+        if rewind is not None:
+            rewind()
+        request = _direct_process_request(token, url, method, params=job_params, files=files, **kwargs)
+        return asyncio.run_coroutine_threadsafe(request, loop).result()
+
+    # Muddat o'tsa Future bekor qilinadi - hali navbatdagi so'rov yuborilmaydi
+    future = scheduler.submit(url, params, send, retryable=rewind is not None)
+    return await asyncio.wait_for(asyncio.wrap_future(future), core.OUTBOUND_RESULT_TIMEOUT)
+
+asyncio_helper._process_request = scheduled_process_request
+
+# ==================== KEYINGI QADAMLAR ====================
+# AsyncTeleBot da register_next_step_handler yo'q: kutilayotgan qadam nomi
+# makerbotpostgre.conversation_store ga yoziladi (sinxron variant bilan bir xil
+# nomlar, shuning uchun Postgres omborida suhbatni istalgan nusxa davom ettiradi)
+conversation_steps = {}
+
+def conversation_step(func):
+    """Korutinani keyingi qadam handleri sifatida nomi bilan ro'yxatdan o'tkazish"""
+    func = core.timed_handler(func)
+    conversation_steps[func.__name__] = func
+    return func
+
+async def register_next_step(chat_id, handler, *args):
+    await asyncio.to_thread(core.conversation_store.set, chat_id, handler.__name__, args)
+
+@bot.message_handler(content_types=['text', 'document'])
+async def run_next_step(message):
+    state = await asyncio.to_thread(core.conversation_store.pop, message.chat.id)
+    if state is None or state[0] not in conversation_steps:
+        # Kutilayotgan qadam yo'q - xabar odatiy handlerlarga o'tadi
+        return ContinueHandling()
+    step, args = state
+    await conversation_steps[step](message, *args)
+
+# ==================== YORDAMCHI FUNKSIYALAR ====================
+async def safe_edit_message_text(text, chat_id, message_id, reply_markup=None):
+    """Xabarni tahrirlashda xatoliklarni ushlaydi"""
+    try:
+        await bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup)
+        return True
+    except ApiTelegramException as e:
+        if "Bad Request: message to edit not found" in str(e):
+            # Agar xabar topilmasa, yangi xabar yuboramiz
+            await bot.send_message(chat_id, text, reply_markup=reply_markup)
+            return False
+        else:
+            print(f"API Xato (edit_message_text): {e}")
+            return False
+    except Exception as e:
+        print(f"Umumiy Xato (edit_message_text): {e}")
+        return False
+
+async def safe_answer_callback_query(callback_query_id, text=None, show_alert=False, url=None, cache_time=None):
+    """Callback so'rovini javoblashda xatoliklarni ushlaydi"""
+    try:
+        await bot.answer_callback_query(callback_query_id, text, show_alert, url, cache_time)
+    except Exception as e:
+        print(f"Callback javoblashda xato: {e}")
+
+async def edit_and_answer(call, screen, answer=None):
+    """Ekranni chizish va callback ga javob berishni bir vaqtda bajarish"""
+    response_text, markup = screen
+    await asyncio.gather(
+        safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup),
+        safe_answer_callback_query(call.id, answer),
+    )
+
+async def fetch_channel_membership(channel, user_id):
+    """Telegramdan bitta kanal a'zoligini so'rash (xatolikda None)"""
+    try:
+        chat_member = await bot.get_chat_member(channel, user_id)
+        return chat_member.status not in ['left', 'kicked']
+    except Exception as e:
+        print(f"Kanal tekshiruvida xato: {e}")
+        return None
+
+async def check_subscription(user_id, channels=None, recheck_negative=False):
+    """
+    core.check_subscription ning asinxron varianti: o'sha kesh ishlatiladi,
+    keshda yo'q kanallar bitta event loop ichida parallel so'raladi.
+    """
+    if channels is None:
+        channels = await asyncio.to_thread(core.list_global_channels)
+
+    if not channels:
+        return True
+
+    missing = []
+    for channel in channels:
+        cached = membership_cache.get(user_id, channel)
+        if cached is False and not recheck_negative:
+            return False
+        if not cached:
+            missing.append(channel)
+
+    if not missing:
+        return True
+
+    if core.SUBSCRIPTION_SOURCE == "tracked":
+        missing = await asyncio.to_thread(core.resolve_tracked_membership, user_id, missing, recheck_negative)
+        if missing is None:
+            return False
+        if not missing:
+            return True
+
+    core.membership_lookups.inc('api', len(missing))
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(fetch_channel_membership(channel, user_id) for channel in missing)),
+            timeout=SUBSCRIPTION_CHECK_DEADLINE,
+        )
+    except asyncio.TimeoutError:
+        print(f"Kanal tekshiruvi {SUBSCRIPTION_CHECK_DEADLINE} soniyada tugamadi")
+        return False
+
+    subscribed = True
+    observed = []
+    for channel, is_member in zip(missing, results):
+        if is_member is None:
+            # Xatolik natijasini keshlamaymiz
+            subscribed = False
+            continue
+        membership_cache.put(user_id, channel, is_member)
+        observed.append((channel, user_id, is_member, None))
+        subscribed = subscribed and is_member
+    if core.SUBSCRIPTION_SOURCE == "tracked":
+        await asyncio.to_thread(core.channel_member_store.record, observed)
+    return subscribed
+
+@bot.chat_member_handler()
+async def chat_member_update_handler(update):
+    await asyncio.to_thread(core.track_channel_member, update)
+
+# ==================== CALLBACK MARSHRUTLARI ====================
+# Amallar va callback_data kodlari makerbotpostgre.CALLBACK_ACTIONS da; bu yerda
+# faqat korutina handlerlar bog'lanadi
+callback_router = core.CallbackRouter(core.callback_codec)
+
+@bot.callback_query_handler(func=lambda call: True)
+async def route_callback(call):
+    resolved = callback_router.resolve(call)
+    if resolved is not None:
+        handler, args = resolved
+        await handler(call, *args)
+
+# ==================== ADMIN PANEL ====================
+@bot.message_handler(commands=['start'])
+async def start(message):
+    user_id = str(message.from_user.id)
+
+    # Global majburiy kanallarni olish
+    global_channels = await asyncio.to_thread(core.list_global_channels)
+
+    # Majburiy obuna tekshiruvi
+    if global_channels and not await check_subscription(user_id, global_channels):
+        response_text, markup = core.subscription_required_screen(global_channels)
+        await bot.reply_to(message, response_text, parse_mode='HTML', reply_markup=markup)
+        return
+
+    # Admin uchun maxsus menyular
+    if is_admin(user_id):
+        await show_admin_menu(message)
+    else:
+        await show_user_menu(message)
+
+@bot.message_handler(commands=['addchannel'])
+async def add_channel_command(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    await register_next_step(message.chat.id, process_add_channel)
+    await bot.reply_to(message, "🆔 Qo'shish uchun kanal username yoki ID sini kiriting (@username yoki -100123456789 formatida):")
+
+@conversation_step
+async def process_add_channel(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    await bot.reply_to(message, await asyncio.to_thread(core.add_channel_action, message.text.strip()))
+
+@bot.message_handler(commands=['removechannel'])
+async def remove_channel_command(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    await register_next_step(message.chat.id, process_remove_channel)
+    await bot.reply_to(message, "🆔 O'chirish uchun kanal username yoki ID sini kiriting:")
+
+@conversation_step
+async def process_remove_channel(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    await bot.reply_to(message, await asyncio.to_thread(core.remove_channel_action, message.text.strip()))
+
+@bot.message_handler(commands=['listchannels'])
+async def list_channels_command(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    await bot.reply_to(message, core.channels_text(await asyncio.to_thread(core.list_global_channels)))
+
+@bot.message_handler(commands=['stats'])
+async def stats_command(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    await bot.reply_to(message, await asyncio.to_thread(core.stats_text))
+
+async def show_admin_menu(message):
+    """Admin menyusi"""
+    response_text, markup = core.admin_menu_screen()
+    await bot.send_message(message.chat.id, response_text, reply_markup=markup)
+
+async def show_user_menu(message):
+    """Oddiy foydalanuvchi menyusi"""
+    response_text, markup = core.user_menu_screen()
+    await bot.send_message(message.chat.id, response_text, reply_markup=markup)
+
+@callback_router.route("admin_top_bots")
+async def admin_top_bots(call, sort_key):
+    await edit_and_answer(call, await asyncio.to_thread(core.load_top_bots_screen, sort_key))
+
+# ==================== MAJBURIY OBUNA MENYUSI ====================
+@callback_router.route("admin_subscription_menu")
+async def admin_subscription_menu(call):
+    await edit_and_answer(call, core.subscription_menu_screen())
+
+@callback_router.route("admin_add_channel")
+async def admin_add_channel_callback(call):
+    await register_next_step(call.message.chat.id, admin_process_add_channel)
+    await asyncio.gather(
+        bot.send_message(call.message.chat.id, "🆔 Qo'shish uchun kanal username yoki ID sini kiriting (@username yoki -100123456789 formatida):"),
+        safe_answer_callback_query(call.id),
+    )
+
+@conversation_step
+async def admin_process_add_channel(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    await bot.reply_to(message, await asyncio.to_thread(core.add_channel_action, message.text.strip()))
+
+    # Menyuga qaytish
+    await show_admin_menu(message)
+
+@callback_router.route("admin_list_channels")
+async def admin_list_channels_callback(call):
+    response_text = core.channels_text(await asyncio.to_thread(core.list_global_channels))
+    await edit_and_answer(call, (response_text, core.back_markup("admin_subscription_menu")))
+
+@callback_router.route("admin_clear_channels")
+async def admin_clear_channels_callback(call):
+    await asyncio.to_thread(core.clear_global_channels)
+    await edit_and_answer(call, ("📢 Majburiy obuna boshqaruvi:", core.back_markup("admin_subscription_menu")),
+                          "✅ Barcha kanallar o'chirildi!")
+
+@callback_router.route("check_subscription")
+async def check_subscription_callback(call):
+    user_id = call.from_user.id
+    global_channels = await asyncio.to_thread(core.list_global_channels)
+
+    if await check_subscription(user_id, global_channels, recheck_negative=True):
+        # Foydalanuvchi menyusini ko'rsatish
+        show_menu = show_admin_menu if is_admin(user_id) else show_user_menu
+        await asyncio.gather(
+            safe_edit_message_text(
+                "✅ Barcha kanallarga obuna bo'ldingiz! Endi botdan foydalanishingiz mumkin.",
+                call.message.chat.id,
+                call.message.message_id
+            ),
+            show_menu(call.message),
+        )
+    else:
+        await safe_answer_callback_query(call.id, "❌ Hali barcha kanallarga obuna bo'lmadingiz!", show_alert=True)
+
+@callback_router.route("admin_main_menu")
+async def admin_main_menu_callback(call):
+    await asyncio.gather(show_admin_menu(call.message), safe_answer_callback_query(call.id))
+
+# ==================== ADMIN: SHABLONLARNI QO'SHISH ====================
+@callback_router.route("admin_add_template")
+async def admin_add_template_handler(call):
+    await register_next_step(call.message.chat.id, admin_handle_template_file)
+    await asyncio.gather(
+        bot.send_message(call.message.chat.id, "📁 Bot shablon faylini yuboring (.py formatda):"),
+        safe_answer_callback_query(call.id),
+    )
+
+@conversation_step
+async def admin_handle_template_file(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    if not message.document or not message.document.file_name.endswith('.py'):
+        await register_next_step(message.chat.id, admin_handle_template_file)
+        await bot.send_message(message.chat.id, "⚠️ Iltimos, faqat .py faylini yuboring!")
+        return
+
+    # Faylni bo'laklab yuklab olib saqlash (yuklash, xeshlash va tekshiruv oqimda)
+    upload, error = await asyncio.to_thread(core.receive_template_upload, message.document)
+    if error:
+        await register_next_step(message.chat.id, admin_handle_template_file)
+        await bot.send_message(message.chat.id, error)
+        return
+
+    await register_next_step(message.chat.id, admin_get_template_name, upload)
+    await bot.send_message(message.chat.id, "📝 Shablon uchun nom kiriting:")
+
+@conversation_step
+async def admin_get_template_name(message, upload):
+    if not is_admin(message.from_user.id):
+        return
+
+    template_name = message.text
+    template_id = await asyncio.to_thread(core.register_template, template_name, upload)
+    if template_id is None:
+        response_text, markup = core.template_save_failed_screen()
+    elif template_id is False:
+        response_text, markup = core.template_exists_screen()
+    else:
+        response_text, markup = core.template_saved_screen(template_name)
+    await bot.send_message(message.chat.id, response_text, reply_markup=markup)
+
+# ==================== ADMIN: SHABLONLAR RO'YXATI ====================
+@callback_router.route("admin_list_templates")
+async def admin_list_templates(call, answer=None):
+    screen = await asyncio.to_thread(core.load_admin_templates_screen)
+    if screen is None:
+        await asyncio.gather(
+            bot.send_message(call.message.chat.id, "📭 Hozircha hech qanday shablon qo'shilmagan."),
+            safe_answer_callback_query(call.id, answer),
+        )
+        return
+
+    await edit_and_answer(call, screen, answer)
+
+@callback_router.route("admin_view_template")
+async def admin_view_template(call, template_id):
+    bot_templates = await asyncio.to_thread(core.load_bot_templates, template_id)
+
+    if template_id not in bot_templates:
+        await safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+        return
+
+    await edit_and_answer(call, core.admin_template_screen(template_id, bot_templates[template_id]))
+
+@callback_router.route("admin_delete_template")
+async def admin_delete_template(call, template_id):
+    if await asyncio.to_thread(core.remove_template, template_id):
+        # Orqaga qaytish
+        await admin_list_templates(call, "✅ Shablon o'chirildi!")
+    else:
+        await safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+
+# ==================== FOYDALANUVCHI: BOTLAR MENYUSI ====================
+@callback_router.route("user_show_bots")
+async def user_show_bots(call):
+    screen = await asyncio.to_thread(core.load_catalog_screen, call.from_user.id)
+    if screen is None:
+        await asyncio.gather(
+            bot.send_message(call.message.chat.id, "📭 Hozircha hech qanday bot shabloni mavjud emas."),
+            safe_answer_callback_query(call.id),
+        )
+        return
+
+    await edit_and_answer(call, screen)
+
+@callback_router.route("user_select_template")
+async def user_select_template(call, template_id):
+    screens, (my_bots, _, _) = await asyncio.gather(
+        asyncio.to_thread(core.load_template_screens, template_id),
+        asyncio.to_thread(core.load_owner_bots_page, call.from_user.id, template_id, limit=1),
+    )
+
+    if screens is None:
+        await safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+        return
+
+    await edit_and_answer(call, screens[bool(my_bots)])
+
+@callback_router.route("user_create_bot")
+async def user_create_bot(call, template_id):
+    # Avval majburiy obunani tekshirish
+    user_id = str(call.from_user.id)
+    global_channels, bot_templates = await asyncio.gather(
+        asyncio.to_thread(core.list_global_channels),
+        asyncio.to_thread(core.load_bot_templates, template_id),
+    )
+
+    if global_channels and not await check_subscription(user_id, global_channels):
+        response_text, markup = core.subscription_required_screen(global_channels, "Bot yaratish")
+        await asyncio.gather(
+            bot.send_message(call.message.chat.id, response_text, parse_mode='HTML', reply_markup=markup),
+            safe_answer_callback_query(call.id),
+        )
+        return
+
+    if template_id not in bot_templates:
+        await safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+        return
+
+    # Avval token so'raymiz
+    await register_next_step(call.message.chat.id, user_get_bot_token, template_id)
+    await asyncio.gather(
+        bot.send_message(call.message.chat.id, "🔑 Yangi bot uchun token kiriting:"),
+        safe_answer_callback_query(call.id),
+    )
+
+@conversation_step
+async def user_get_bot_token(message, template_id):
+    user_token = message.text.strip()
+
+    # Endi admin ID so'raymiz
+    await register_next_step(message.chat.id, user_get_admin_id, template_id, user_token)
+    await bot.send_message(message.chat.id, "🆔 Yangi bot uchun admin ID kiriting (agar kerak bo'lmasa 'yoq' deb yozing):")
+
+@conversation_step
+async def user_get_admin_id(message, template_id, user_token):
+    admin_id = core.parse_admin_id(message.text)
+    result, channels_count = await asyncio.to_thread(
+        core.create_and_start_user_bot, template_id, user_token, admin_id, message.from_user.id)
+
+    if result:
+        response_text, markup = core.bot_created_screen(result, user_token, admin_id, channels_count)
+        await bot.send_message(message.chat.id, response_text, reply_markup=markup)
+    else:
+        await bot.send_message(message.chat.id, "❌ Xatolik yuz berdi! Bot yaratilmadi.")
+
+# ==================== FOYDALANUVCHI: MENING BOTLARIM ====================
+@callback_router.route("user_my_bots")
+async def user_my_bots(call, view, target_id):
+    my_bots, has_prev, has_next = await asyncio.to_thread(
+        core.load_owner_bots_page, call.from_user.id, **core.my_bots_page_args(view, target_id))
+
+    if not my_bots:
+        await asyncio.gather(
+            bot.send_message(call.message.chat.id, "📭 Siz hali bot yaratmagansiz."),
+            safe_answer_callback_query(call.id),
+        )
+        return
+
+    await edit_and_answer(call, core.my_bots_screen(my_bots, has_prev, has_next))
+
+@callback_router.route("user_manage_bot")
+async def user_manage_bot(call, bot_id):
+    screen = await asyncio.to_thread(core.load_manage_bot_screen, bot_id, call.from_user.id)
+
+    if screen is None:
+        await safe_answer_callback_query(call.id, "❌ Bot topilmadi!")
+        return
+
+    await edit_and_answer(call, screen)
+
+async def answer_bot_lifecycle(call, action, bot_id):
+    answer, screen = await asyncio.to_thread(core.bot_lifecycle_action, action, bot_id, call.from_user.id)
+    if screen is None:
+        await safe_answer_callback_query(call.id, answer)
+    else:
+        await edit_and_answer(call, screen, answer)
+
+@callback_router.route("user_stop_bot")
+async def user_stop_bot(call, bot_id):
+    await answer_bot_lifecycle(call, 'stop', bot_id)
+
+@callback_router.route("user_start_bot")
+async def user_start_bot(call, bot_id):
+    await answer_bot_lifecycle(call, 'start', bot_id)
+
+@callback_router.route("user_restart_bot")
+async def user_restart_bot(call, bot_id):
+    await answer_bot_lifecycle(call, 'restart', bot_id)
+
+@callback_router.route("user_delete_bot")
+async def user_delete_bot(call, bot_id):
+    await answer_bot_lifecycle(call, 'delete', bot_id)
+
+@callback_router.route("user_back_to_main")
+async def user_back_to_main(call):
+    await asyncio.gather(show_user_menu(call.message), safe_answer_callback_query(call.id))
+
+# ==================== DASTURNI ISHGA TUSHIRISH ====================
+# Barcha handlerlar e'lon qilindi - ularni kechikish metrikalariga ulaymiz
+core.instrument_handlers(bot)
+
+async def main():
+    """Polling ni SIGTERM/SIGINT kelguncha ishlatish"""
+    loop = asyncio.get_running_loop()
+    try:
+        # Webhook o'chirilmaguncha getUpdates 409 qaytaradi - polling undan keyin boshlanadi
+        await bot.remove_webhook()
+        polling = asyncio.create_task(bot.polling(non_stop=True, allowed_updates=core.subscription_allowed_updates()))
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, polling.cancel)
+        await polling
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await bot.close_session()
+
+if __name__ == "__main__":
+    print("Bot menejeri (asyncio) ishga tushmoqda...")
+
+    # Ulanishlar pulini ochish
+    try:
+        core.db_pool.open()
+    except Exception as e:
+        print(f"Ulanishlar pulini ochishda xatolik: {e}")
+
+    # Ma'lumotlar bazasini sozlash
+    core.init_database()
+
+    print("Ma'lumotlar bazasi sozlandi")
+
+    # Foydalanuvchi botlarini kuzatish va qayta yoqish
+    if core.BOT_PLACEMENT == "local":
+        core.bot_supervisor.run()
+        threading.Thread(target=core.bot_supervisor.boot, name="supervisor-boot", daemon=True).start()
+    else:
+        print("Botlar ishchi tugunlarda ishlaydi: python3 makerbotpostgre.py worker")
+
+    # Global kanal o'zgarishlarini mavjud botlarga tarqatish
+    core.channel_propagator.start()
+
+    # Boshqa nusxalardagi o'zgarishlarda mahalliy keshlarni tozalash
+    core.cache_invalidator.start()
+
+    # Xabar yuborish limitlarini ushlab turuvchi navbat
+    core.outbound_scheduler.start()
+
+    # Bot jarayonlarining resurs sarfini o'lchash
+    core.bot_usage_sampler.start()
+
+    # Kanal a'zoligi jadvalini API bilan davriy solishtirish
+    if core.SUBSCRIPTION_SOURCE == "tracked":
+        core.membership_sweeper.start()
+
+    # Prometheus metrikalari
+    metrics_server = core.start_metrics_server() if core.METRICS_ENABLED else None
+
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        print(f"Bot pollingda xato: {e}")
+    finally:
+        core.membership_sweeper.stop()
+        core.channel_propagator.stop()
+        core.cache_invalidator.stop()
+        core.outbound_scheduler.stop()
+        core.bot_usage_sampler.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        core.bot_supervisor.shutdown()
+        core.db_pool.closeall()
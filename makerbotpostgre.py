@@ -1,14 +1,38 @@
 import telebot
-from telebot import types
+from telebot import types, apihelper, util
+from telebot.handler_backends import HandlerBackend
 import os
+import signal
 import subprocess
 import uuid
 import re
+import ast
+import py_compile
+import hashlib
+import base64
+import io
+import tokenize
+import hmac
+import json
+import queue
+import csv
+import sys
+import tempfile
+import select
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
 from contextlib import contextmanager
 import functools
+import threading
 import time
+import resource
+import bisect
+import inspect
+from array import array
 
 # ==================== KONFIGURATSIYA ====================
 # Admin sozlamalari
@@ -26,131 +50,877 @@ DB_CONFIG = {
     'port': 5432                                   # Port (odatiy 5432)
 }
 
-bot = telebot.TeleBot(TOKEN)
+# Ulanishlar puli sozlamalari
+DB_POOL_MIN_SIZE = 2          # Doimiy ochiq turadigan ulanishlar soni
+DB_POOL_MAX_SIZE = 10         # Bir vaqtda ochilishi mumkin bo'lgan maksimal ulanishlar
+DB_POOL_TIMEOUT = 10          # Bo'sh ulanishni kutish vaqti (soniya)
+DB_POOL_IDLE_CHECK = 30       # Shuncha soniya bo'sh turgan ulanish ishlatishdan oldin tekshiriladi
+
+# "Mening botlarim" ro'yxatidagi bir sahifadagi botlar soni
+MY_BOTS_PAGE_SIZE = 10
+
+# Majburiy obuna tekshiruvi sozlamalari
+SUBSCRIPTION_CACHE_TTL = 300          # Obuna bo'lgan foydalanuvchi natijasi saqlanadigan vaqt (soniya)
+SUBSCRIPTION_NEGATIVE_TTL = 20        # Obuna bo'lmagan foydalanuvchi natijasi saqlanadigan vaqt (soniya)
+SUBSCRIPTION_CACHE_SIZE = 50000       # Keshdagi maksimal (foydalanuvchi, kanal) yozuvlari
+SUBSCRIPTION_CHECK_WORKERS = 8        # Kanallarni parallel tekshiruvchi oqimlar soni
+SUBSCRIPTION_CHECK_DEADLINE = 5       # Bitta tekshiruv uchun umumiy vaqt chegarasi (soniya)
+# Obuna manbai: "api" - keshda yo'q har bir tekshiruv getChatMember bilan; "tracked" - menejer bot
+# admin bo'lgan majburiy kanallarning chat_member yangilanishlari channel_members jadvalida
+# saqlanadi, API faqat jadvalda yo'q foydalanuvchi uchun (birinchi tekshiruvda) so'raladi
+SUBSCRIPTION_SOURCE = "api"
+MEMBERSHIP_SWEEP_INTERVAL = 600       # Fon tekshiruvlari oralig'i (soniya)
+MEMBERSHIP_RECHECK_AGE = 86400        # Shuncha soniya tasdiqlanmagan qator API bilan qayta solishtiriladi
+MEMBERSHIP_SWEEP_BATCH = 200          # Bitta bosqichda qayta tekshiriladigan qatorlar
+
+# Global kanal o'zgarishlarini mavjud botlarga tarqatish sozlamalari
+CHANNEL_PROPAGATION_CHUNK = 5000      # Bitta tranzaksiyada yangilanadigan botlar soni
+CHANNEL_PROPAGATION_PAUSE = 0.05      # Bo'laklar orasidagi tanaffus (soniya), boshqa so'rovlarga joy berish uchun
+CHANNEL_PROPAGATION_POLL = 30         # Kutilayotgan vazifalarni qayta tekshirish oralig'i (soniya)
+
+# Foydalanuvchi botlari jarayonlari nazoratchisi sozlamalari
+SUPERVISOR_BOOT_CONCURRENCY = 4       # Ishga tushishda bir vaqtda yoqiladigan botlar soni
+SUPERVISOR_BOOT_STAGGER = 0.5         # Har bir yoqishdan keyingi tanaffus (soniya)
+SUPERVISOR_BACKOFF_BASE = 2           # Qulagan botni qayta yoqish uchun boshlang'ich kutish (soniya)
+SUPERVISOR_BACKOFF_MAX = 300          # Maksimal kutish (soniya)
+SUPERVISOR_STABLE_AFTER = 60          # Shuncha ishlagan bot barqaror hisoblanadi (kutish qayta boshlanadi)
+SUPERVISOR_STOP_TIMEOUT = 10          # To'xtatishda jarayon tugashini kutish (soniya)
+SUPERVISOR_POLL_INTERVAL = 1          # Jarayonlarni tekshirish oralig'i (soniya)
+SUPERVISOR_SYNC_INTERVAL = 60         # Baza bilan solishtirish oralig'i (soniya)
+
+# Botlarni joylashtirish: "local" - menejer botlarni o'zi ishga tushiradi; "workers" - botlar
+# "python3 makerbotpostgre.py worker" tugunlarida lease (ijara) orqali taqsimlanadi, menejer
+# faqat bazadagi kerakli holatni o'zgartiradi. Tugunlar bot_templates/ va user_bots/ papkalarini
+# bir xil yo'l bilan ko'rishi kerak (bitta mashina yoki umumiy disk)
+BOT_PLACEMENT = "local"
+WORKER_CAPACITY = 500                 # Tugundagi maksimal botlar; botlar tugunlarga sig'imiga mutanosib bo'linadi
+WORKER_HEARTBEAT_INTERVAL = 5         # Heartbeat va lease larni yangilash oralig'i (soniya)
+WORKER_LEASE_TTL = 20                 # Yangilanmagan lease muddati: yetim botlar ~TTL + interval ichida boshqa tugunga o'tadi
+WORKER_CLAIM_BATCH = 50               # Bitta heartbeatda olinadigan yoki bo'shatiladigan botlar soni
+WORKER_DB_TIMEOUT = 5                 # Heartbeat ulanishi va so'rovlari uchun vaqt chegarasi (soniya)
+
+# Har bir bot jarayoni uchun resurs chegaralari (0 - cheklanmaydi). Chegaradan oshgan
+# jarayon to'xtaydi va nazoratchi uni odatdagidek qayta yoqadi
+BOT_CPU_TIME_LIMIT = 3600             # Jarayonning umumiy CPU vaqti (soniya)
+BOT_ADDRESS_SPACE_LIMIT = 2 * 1024 ** 3  # Virtual xotira (bayt); RSS bundan ancha kichik bo'ladi
+BOT_OPEN_FILES_LIMIT = 1024           # Ochiq fayllar va soketlar soni
+BOT_USAGE_SAMPLE_INTERVAL = 10        # /proc dan RSS va CPU ni o'lchash oralig'i (soniya)
+BOT_USAGE_HISTORY = 60                # Har bir bot uchun saqlanadigan o'lchovlar soni
+TOP_BOTS_LIMIT = 10                   # "Top botlar" oynasida ko'rsatiladigan botlar soni
+
+# Prometheus metrikalari: http://METRICS_LISTEN:METRICS_PORT/metrics
+METRICS_ENABLED = True
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9108
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # soniya
+
+# Botlarni ishga tushirish usuli: "popen" - har bir bot uchun yangi python3,
+# "forkserver" - oldindan modullar yuklangan zigotadan fork qilish (bot_zygote.py)
+BOT_LAUNCH_MODE = "popen"
+FORKSERVER_PRELOAD = ("telebot", "requests")
+
+# Bot fayli usuli: "shared" - bir shablondagi barcha botlar bitta kompilyatsiya qilingan
+# shablon faylidan ishlaydi, token va admin ID muhit o'zgaruvchilari orqali beriladi;
+# "copy" - har bir bot uchun token qo'yilgan alohida nusxa yoziladi
+BOT_FILE_MODE = "shared"
+INJECTION_PLAN_CACHE_SIZE = 64        # Keshlanadigan token qo'yish rejalari soni (shablon mazmuni bo'yicha)
+
+# Ochilgan callback_data (tugma amali va parametrlari) keshi hajmi
+CALLBACK_DECODE_CACHE_SIZE = 4096
+# Katalog ekranlari (shablonlar ro'yxati, katalog, shablon oynasi) keshidagi maksimal ekranlar
+SCREEN_CACHE_SIZE = 1024
+
+# Keshlarni menejer nusxalari orasida tozalash (Postgres LISTEN/NOTIFY): o'zgarish tranzaksiyasi
+# CACHE_NOTIFY_PREFIX + obyekt (global_channels, templates, bots) kanaliga NOTIFY yuboradi,
+# har bir nusxa shu kanallarni tinglab o'z keshlarini tozalaydi
+CACHE_NOTIFY_PREFIX = "makerbot_"
+CACHE_STALE_TTL = 60                  # Tinglovchi uzilganida keshlar shuncha soniyada bir to'liq tozalanadi
+CACHE_LISTEN_RETRY = 5                # Tinglovchini qayta ulash oralig'i (soniya)
+
+# Yangilanishlarni qabul qilish usuli: "polling" yoki "webhook"
+UPDATE_MODE = "polling"
+# Webhook sozlamalari (HTTPS odatda oldidagi reverse proxy tomonidan beriladi)
+WEBHOOK_URL = "WEBHOOK_URL"           # Telegram yuboradigan tashqi manzil, masalan https://example.com/telegram/webhook
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = "WEBHOOK_SECRET"     # X-Telegram-Bot-Api-Secret-Token sarlavhasi qiymati
+WEBHOOK_WORKERS = 8                   # Yangilanishlarni qayta ishlovchi oqimlar soni (HANDLER_DISPATCH = "threaded" da)
+WEBHOOK_QUEUE_SIZE = 1000             # Navbatdagi maksimal yangilanishlar (to'lsa 503 qaytariladi)
+WEBHOOK_MAX_BODY = 1024 * 1024        # Bitta so'rovning maksimal hajmi (bayt)
+WEBHOOK_DRAIN_TIMEOUT = 30            # To'xtatishda navbatni tugatish uchun kutish (soniya)
+
+# Handlerlarni bajarish: "ordered" - bitta chat yangilanishlari qat'iy kelgan tartibda (oldingisi
+# tugagandan keyin), turli chatlar HANDLER_WORKERS oqimda parallel; "threaded" - TeleBot puli
+# (pollingda) yoki umumiy navbat (webhookda), bitta chatdagi tartib kafolatlanmaydi
+HANDLER_DISPATCH = "ordered"
+HANDLER_WORKERS = 8                   # Chatlarni parallel qayta ishlovchi oqimlar
+HANDLER_QUEUE_SIZE = 1000             # Barcha chatlar navbatidagi maksimal yangilanishlar
+HANDLER_CHAT_QUEUE_SIZE = 20          # Bitta chat navbatidagi maksimal yangilanishlar
+                                      # (webhookda ortig'i rad etiladi, pollingda joy bo'shashi kutiladi)
+
+# Telegramga chiquvchi so'rovlar rejalashtiruvchisi (xabar yuborish/tahrirlash limitlari)
+# (portlash + tezlik Telegram limitidan oshmasin: 5 + 25 <= 30 ta/s, 2 + 1 <= 3 ta/s)
+OUTBOUND_GLOBAL_RATE = 25             # Bot bo'yicha sekundiga xabarlar
+OUTBOUND_GLOBAL_BURST = 5             # Global qisqa portlash
+OUTBOUND_CHAT_RATE = 1                # Bitta shaxsiy chatga sekundiga xabarlar
+OUTBOUND_CHAT_BURST = 2               # Shaxsiy chatga ketma-ket ruxsat etilgan qisqa portlash
+OUTBOUND_GROUP_RATE = 20 / 60         # Guruh/kanalga sekundiga xabarlar (minutiga 20 ta)
+OUTBOUND_WORKERS = 8                  # So'rovlarni bir vaqtda yuboruvchi oqimlar
+OUTBOUND_MAX_RETRIES = 3              # 429 (retry_after) dan keyin qayta urinishlar soni
+OUTBOUND_RESULT_TIMEOUT = 60          # Navbat va qayta urinishlar bilan natijani kutish chegarasi (soniya)
+
+# Ko'p bosqichli suhbatlar (keyingi qadam handlerlari) holati:
+# "memory" - jarayon xotirasida, "postgres" - bazada (qayta ishga tushganda saqlanadi,
+# bir nechta menejer nusxasi bo'lishadi)
+CONVERSATION_STORE = "memory"
+CONVERSATION_TTL = 900                # Javobsiz qolgan suhbat holati saqlanadigan vaqt (soniya)
+CONVERSATION_MAX_SIZE = 10000         # Saqlanadigan maksimal suhbatlar (eng eskisi chiqariladi)
+CONVERSATION_SWEEP_INTERVAL = 60      # Bazadagi eskirgan holatlarni tozalash oralig'i (soniya)
+
+# Sxema migratsiyalari: migrations/NNNN_nomi.sql fayllari faqat oldinga, versiya tartibida
+# bajariladi; bajarilganlari schema_version jadvalida saqlanadi
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_LOCK_ID = 7_302_019         # pg_advisory_lock kaliti (bir vaqtda ishga tushgan nusxalar uchun)
+
+# Ommaviy bot yaratish (python3 makerbotpostgre.py provision ...) sozlamalari
+PROVISION_BATCH_SIZE = 500            # Bitta tranzaksiyada yoziladigan botlar soni
+PROVISION_WORKERS = 8                 # Bot fayllarini tayyorlovchi oqimlar soni
+
+# Shablon yuklash sozlamalari
+TEMPLATE_MAX_SIZE = 1024 * 1024       # Shablon faylining maksimal hajmi (bayt)
+TEMPLATE_DOWNLOAD_CHUNK = 64 * 1024   # Yuklab olishda diskka yoziladigan bo'lak hajmi (bayt)
+TEMPLATE_DOWNLOAD_TIMEOUT = 60        # Faylni yuklab olish uchun vaqt chegarasi (soniya)
+TEMPLATE_CHECK_TIMEOUT = 30           # Sintaksis tekshiruvi uchun vaqt chegarasi (soniya)
+
+class ManagerBot(telebot.TeleBot):
+    """TeleBot, keyingi qadam handlerlari tuzatilgan holda"""
+
+    def _notify_next_handlers(self, new_messages):
+        """
+        Asl usul ro'yxatni aylanish paytida pop qiladi va bitta getUpdates to'plamida
+        keyingi qadamga ketgan xabardan keyingi xabarni o'tkazib yuboradi.
+        Bu yerda qolgan xabarlar alohida yig'iladi.
+        """
+        pending = []
+        for message in new_messages:
+            handlers = self.next_step_backend.get_handlers(message.chat.id)
+            if not handlers:
+                pending.append(message)
+                continue
+            for handler in handlers:
+                self._exec_task(handler["callback"], message, *handler["args"], **handler["kwargs"])
+        new_messages[:] = pending
+
+
+bot = ManagerBot(TOKEN)
 
 # ==================== PAPKALARNI YARATISH ====================
 os.makedirs("bot_templates", exist_ok=True)
 os.makedirs("user_bots", exist_ok=True)
 
+# ==================== METRIKALAR ====================
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Bitta yorliq bo'yicha ajratilgan kechikish gistogrammasi"""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}  # yorliq qiymati -> [har bir oraliqdagi soni, yig'indi]
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def snapshot(self):
+        """{yorliq qiymati: (kuzatuvlar soni, yig'indi)}"""
+        with self._lock:
+            return {value: (sum(counts), total) for value, (counts, total) in self._series.items()}
+
+    def render(self):
+        with self._lock:
+            snapshot = [(value, list(counts), total) for value, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value, counts, total in sorted(snapshot):
+            label = f'{self.label}="{_escape_label(value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Bitta yorliq bo'yicha ajratilgan hisoblagich"""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value, amount=1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for value, count in snapshot:
+            lines.append(f'{self.name}{{{self.label}="{_escape_label(value)}"}} {count}')
+        return lines
+
+
+class Gauge:
+    """O'qilganda hisoblanadigan ko'rsatkich: collect() son yoki {yorliq qiymati: son} qaytaradi"""
+
+    def __init__(self, name, help_text, label, collect):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.collect = collect
+
+    def render(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Metrika {self.name} ni hisoblashda xato: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if self.label is None:
+            lines.append(f"{self.name} {values}")
+        else:
+            for value, number in sorted(values.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape_label(value)}"}} {number}')
+        return lines
+
+
+class MetricsRegistry:
+    """Barcha metrikalar va ularni Prometheus matn formatida chiqarish"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label):
+        return self.register(Histogram(name, help_text, label))
+
+    def counter(self, name, help_text, label):
+        return self.register(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, label, collect):
+        return self.register(Gauge(name, help_text, label, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+handler_latency = metrics.histogram(
+    "makerbot_handler_duration_seconds", "Handler bajarilish vaqti", "route")
+handler_errors = metrics.counter(
+    "makerbot_handler_errors_total", "Xato bilan tugagan handlerlar", "route")
+db_query_latency = metrics.histogram(
+    "makerbot_db_query_duration_seconds", "So'rov bajarilish vaqti (get_db_connection chaqirgan funksiya bo'yicha)", "helper")
+telegram_api_latency = metrics.histogram(
+    "makerbot_telegram_api_duration_seconds", "Telegram API so'rovi vaqti", "method")
+telegram_api_errors = metrics.counter(
+    "makerbot_telegram_api_errors_total", "Xato bilan tugagan Telegram API so'rovlari", "method")
+# Long polling so'rovi yangilanish kelguncha (timeout gacha) ochiq turadi - uning vaqti API
+# kechikishi emas va gistogramma oraliqlarini buzadi, shuning uchun o'lchanmaydi (xatolari sanaladi)
+UNTIMED_API_METHODS = {'getUpdates'}
+
+def timed_handler(func):
+    """Handlerni funksiya nomi (route) bo'yicha vaqt o'lchovchi bilan o'rash"""
+    if getattr(func, '_timed', False):
+        return func
+    route = func.__name__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(route)
+                raise
+            finally:
+                handler_latency.observe(route, time.perf_counter() - started)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(route)
+                raise
+            finally:
+                handler_latency.observe(route, time.perf_counter() - started)
+    wrapper._timed = True
+    return wrapper
+
+def instrument_handlers(bot_instance):
+    """Botga ro'yxatdan o'tgan barcha handlerlarni vaqt o'lchovchi bilan o'rash"""
+    for name, handlers in vars(bot_instance).items():
+        if not name.endswith('_handlers') or not isinstance(handlers, list):
+            continue
+        for handler in handlers:
+            if isinstance(handler, dict) and 'function' in handler:
+                handler['function'] = timed_handler(handler['function'])
+
+def timed_api_request(make_request):
+    """Telegram API so'rov funksiyasini (token, metod, ...) metod bo'yicha vaqt o'lchovchi bilan o'rash"""
+    if inspect.iscoroutinefunction(make_request):
+        async def wrapper(token, method_name, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await make_request(token, method_name, *args, **kwargs)
+            except Exception:
+                telegram_api_errors.inc(method_name)
+                raise
+            finally:
+                if method_name not in UNTIMED_API_METHODS:
+                    telegram_api_latency.observe(method_name, time.perf_counter() - started)
+    else:
+        def wrapper(token, method_name, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return make_request(token, method_name, *args, **kwargs)
+            except Exception:
+                telegram_api_errors.inc(method_name)
+                raise
+            finally:
+                if method_name not in UNTIMED_API_METHODS:
+                    telegram_api_latency.observe(method_name, time.perf_counter() - started)
+    return wrapper
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics - Prometheus matn formati"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=METRICS_LISTEN, port=METRICS_PORT):
+    """Metrikalar HTTP serverini fon oqimida ishga tushirish"""
+    httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrikalar http://{host}:{httpd.server_address[1]}/metrics manzilida")
+    return httpd
+
 # ==================== MA'LUMOTLAR BAZASI BOSHQARUVCHI ====================
+class TimedConnection(psycopg2.extensions.connection):
+    """So'rovlar qaysi funksiyadan kelayotganini eslab qoluvchi ulanish"""
+    query_label = "unknown"
+
+
+class TimedCursor(RealDictCursor):
+    """Har bir so'rov vaqtini ulanish yorlig'i bo'yicha o'lchaydigan kursor"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            db_query_latency.observe(self.connection.query_label, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            db_query_latency.observe(self.connection.query_label, time.perf_counter() - started)
+
+
+class PoolTimeoutError(Exception):
+    """Belgilangan vaqt ichida bo'sh ulanish topilmadi"""
+
+
+class DatabasePool:
+    """Oqimlar uchun xavfsiz PostgreSQL ulanishlar puli"""
+
+    def __init__(self, config, min_size, max_size, timeout, idle_check):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._cond = threading.Condition()
+        self._idle = []       # (ulanish, oxirgi ishlatilgan vaqt)
+        self._size = 0        # Ochilgan ulanishlar soni (bo'sh + band)
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        return psycopg2.connect(**self.config, connection_factory=TimedConnection, cursor_factory=TimedCursor)
+
+    def open(self):
+        """Minimal miqdordagi ulanishlarni oldindan ochish"""
+        with self._cond:
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= missing - len(opened)
+                now = time.monotonic()
+                self._idle.extend((conn, now) for conn in opened)
+                self._cond.notify_all()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.idle_check:
+            return True
+        try:
+            conn.query_label = "pool_health_check"
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Puldan ulanish olish (kerak bo'lsa kutadi yoki yangisini ochadi)"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = last_used = None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"{self.timeout} soniya ichida bo'sh ulanish topilmadi")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                # Server qayta ishga tushgan yoki ulanish uzilgan - qayta ulanamiz
+                self._close_quietly(conn)
+                conn = None
+                with self._cond:
+                    self._reconnects += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Ulanishni pulga qaytarish"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            self._close_quietly(conn)
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+                # Bitta ulanish uzilgan bo'lsa, qolganlarini ham keyingi safar tekshiramiz
+                self._idle = [(idle_conn, 0.0) for idle_conn, _ in self._idle]
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Barcha bo'sh ulanishlarni yopish"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """Pul holati statistikasi"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'checkout_avg_ms': (self._checkout_time_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                'checkout_max_ms': self._checkout_time_max * 1000,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+            }
+
+
+db_pool = DatabasePool(DB_CONFIG, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_IDLE_CHECK)
+metrics.gauge("makerbot_db_pool_connections", "Puldagi ulanishlar", "state",
+              lambda: {key: value for key, value in db_pool.stats().items() if key in ('idle', 'in_use', 'waiting')})
+
 @contextmanager
 def get_db_connection():
-    """Ma'lumotlar bazasi ulanishini boshqarish"""
-    conn = None
+    """Ma'lumotlar bazasi ulanishini puldan olish va qaytarish"""
+    conn = db_pool.getconn()
+    # So'rovlar metrikasi uchun: with get_db_connection() yozilgan funksiya nomi
+    # (0 - shu generator, 1 - contextmanager.__enter__, 2 - chaqiruvchi)
+    conn.query_label = sys._getframe(2).f_code.co_name
+    discard = False
     try:
-        conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
         yield conn
     except Exception as e:
         print(f"Ma'lumotlar bazasi ulanishida xatolik: {e}")
-        if conn:
+        # Uzilgan ulanishni pulga qaytarmaymiz
+        discard = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not conn.closed and not discard:
             conn.rollback()
         raise
     finally:
-        if conn:
-            conn.close()
+        db_pool.putconn(conn, discard=discard)
+
+# ==================== KESHLARNI NUSXALAR ORASIDA TOZALASH ====================
+# Keshlar har bir jarayon xotirasida. Yozuvchi funksiyalar o'zgarish tranzaksiyasida
+# notify_cache_change() chaqiradi - NOTIFY faqat commit bo'lganda yetkaziladi. Har bir
+# nusxadagi cache_invalidator shu kanallarni tinglab, mos keshni tozalaydi.
+def notify_cache_change(cur, entity, key=''):
+    """Boshqa nusxalarga obyekt o'zgarganini bildirish (joriy tranzaksiya ichida)"""
+    cur.execute("SELECT pg_notify(%s, %s)", (CACHE_NOTIFY_PREFIX + entity, str(key)))
+
+
+class CacheInvalidator:
+    """
+    Alohida ulanishda LISTEN qilib, kelgan xabarlar bo'yicha mahalliy keshlarni tozalaydi.
+    Ulanish uzilsa, tiklanguncha keshlar har CACHE_STALE_TTL soniyada to'liq tozalanadi,
+    qayta ulanganda ham bir marta tozalanadi (uzilish paytidagi xabarlar yo'qolgan).
+    """
+
+    def __init__(self, config, handlers):
+        self.config = config
+        self.handlers = handlers    # obyekt -> keshni tozalash funksiyasi
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        self.fallback_flushes = 0
+
+    def invalidate(self, entity):
+        try:
+            self.handlers[entity]()
+        except Exception as e:
+            print(f"{entity} keshini tozalashda xato: {e}")
+        cache_invalidations.inc(entity)
+
+    def invalidate_all(self):
+        for entity in self.handlers:
+            self.invalidate(entity)
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.config)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for entity in self.handlers:
+                cur.execute(f"LISTEN {CACHE_NOTIFY_PREFIX}{entity}")
+        return conn
+
+    def _listen(self, conn):
+        """To'xtatilguncha yoki ulanish uzilguncha xabarlarni qayta ishlash"""
+        last_activity = time.monotonic()
+        while not self._stop_event.is_set():
+            if select.select([conn], [], [], 1)[0]:
+                conn.poll()
+                last_activity = time.monotonic()
+            elif time.monotonic() - last_activity >= CACHE_STALE_TTL / 2:
+                # Jim ulanish tirikligini tekshirish: sezilmay uzilgan ulanishda
+                # eskirish CACHE_STALE_TTL dan oshmasligi uchun
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                last_activity = time.monotonic()
+            # Bir partiyadagi ko'p o'zgarish har bir kesh uchun bitta tozalashga aylanadi
+            entities = set()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.received += 1
+                entities.add(notify.channel[len(CACHE_NOTIFY_PREFIX):])
+            for entity in entities & self.handlers.keys():
+                self.invalidate(entity)
+
+    def _loop(self):
+        first = True
+        last_flush = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                conn = self._connect()
+            except Exception as e:
+                print(f"Kesh tinglovchisi ulana olmadi: {e}")
+                if time.monotonic() - last_flush >= CACHE_STALE_TTL:
+                    self.fallback_flushes += 1
+                    self.invalidate_all()
+                    last_flush = time.monotonic()
+                self._stop_event.wait(CACHE_LISTEN_RETRY)
+                continue
+
+            self.connected = True
+            if not first:
+                self.reconnects += 1
+                self.invalidate_all()
+            first = False
+            try:
+                self._listen(conn)
+            except Exception as e:
+                print(f"Kesh tinglovchisi uzildi: {e}")
+                # Qachon uzilgani noma'lum - keyingi muvaffaqiyatsiz ulanishda darhol tozalaymiz
+                last_flush = 0
+            finally:
+                self.connected = False
+                DatabasePool._close_quietly(conn)
+
+    def start(self):
+        """Tinglovchi oqimini ishga tushirish"""
+        self._thread = threading.Thread(target=self._loop, name="cache-invalidator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        return {
+            'connected': self.connected,
+            'received': self.received,
+            'reconnects': self.reconnects,
+            'fallback_flushes': self.fallback_flushes,
+        }
+
+
+cache_invalidator = CacheInvalidator(DB_CONFIG, {
+    'global_channels': lambda: list_global_channels.cache_clear(),
+    'templates': lambda: screen_cache.invalidate(),
+    # Nazoratchi bazadagi kerakli holatni qayta o'qiydi (boshqa nusxa to'xtatgan/o'chirgan botlar)
+    'bots': lambda: bots_changed(),
+})
+cache_invalidations = metrics.counter(
+    "makerbot_cache_invalidations_total", "Mahalliy keshlarni tozalashlar (NOTIFY yoki zaxira TTL)", "entity")
+metrics.gauge("makerbot_cache_listener_connected", "Kesh tinglovchisi ulanganmi (1/0)", None,
+              lambda: int(cache_invalidator.connected))
 
 # ==================== MA'LUMOTLAR BAZASINI SOZLASH ====================
+def load_migrations(directory=MIGRATIONS_DIR):
+    """migrations/ papkasidagi NNNN_nomi.sql fayllarini versiya tartibida o'qish"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = re.fullmatch(r"(\d+)_\w+\.sql", filename)
+        if match is None:
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            migrations.append((int(match.group(1)), filename, f.read()))
+    migrations.sort()
+    return migrations
+
+def current_schema_version(cur):
+    """Bazadagi oxirgi bajarilgan migratsiya versiyasi (schema_version bo'lmasa 0)"""
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS versioned")
+    if not cur.fetchone()['versioned']:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+    return cur.fetchone()['version']
+
 def init_database():
-    """Ma'lumotlar bazasi jadvallarini yaratish"""
-    create_tables_sql = [
-        """
-        CREATE TABLE IF NOT EXISTS bot_templates (
-            id UUID PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            file_path TEXT NOT NULL,
-            filename VARCHAR(255) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS required_channels (
-            id SERIAL PRIMARY KEY,
-            template_id UUID REFERENCES bot_templates(id) ON DELETE CASCADE,
-            channel_identifier TEXT NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(template_id, channel_identifier)
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS user_bots (
-            id UUID PRIMARY KEY,
-            template_id UUID REFERENCES bot_templates(id) ON DELETE CASCADE,
-            token TEXT NOT NULL,
-            admin_id TEXT,
-            file_path TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT TRUE
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS bot_channels (
-            id SERIAL PRIMARY KEY,
-            bot_id UUID REFERENCES user_bots(id) ON DELETE CASCADE,
-            channel_identifier TEXT NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS global_required_channels (
-            id SERIAL PRIMARY KEY,
-            channel_identifier TEXT UNIQUE NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    ]
-    
+    """Ma'lumotlar bazasi sxemasini migratsiyalar bilan oxirgi versiyaga keltirish"""
     try:
+        migrations = load_migrations()
+        latest = migrations[-1][0] if migrations else 0
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                for statement in create_tables_sql:
-                    cur.execute(statement)
+                version = current_schema_version(cur)
                 conn.commit()
-        print("Ma'lumotlar bazasi jadvallari yaratildi")
+                # Sxema dolzarb bo'lsa hech qanday DDL bajarilmaydi
+                if version >= latest:
+                    print(f"Ma'lumotlar bazasi sxemasi dolzarb (versiya {version})")
+                    return
+
+                # Bir vaqtda ishga tushgan nusxalardan faqat qulfni olgani migratsiya qiladi,
+                # qolganlari kutib turadi va keyin versiyani qayta o'qiydi
+                cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+                try:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS schema_version (
+                            version INTEGER PRIMARY KEY,
+                            name TEXT NOT NULL,
+                            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                        )
+                    """)
+                    conn.commit()
+                    version = current_schema_version(cur)
+                    for number, filename, sql in migrations:
+                        if number <= version:
+                            continue
+                        # Har bir migratsiya va uning versiya yozuvi bitta tranzaksiyada
+                        cur.execute(sql)
+                        cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                                    (number, filename))
+                        conn.commit()
+                        print(f"Migratsiya bajarildi: {filename}")
+                finally:
+                    conn.rollback()
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                    conn.commit()
+        print(f"Ma'lumotlar bazasi sxemasi versiya {latest} ga keltirildi (oldin {version})")
     except Exception as e:
         print(f"Ma'lumotlar bazasini sozlashda xatolik: {e}")
 
 # ==================== MA'LUMOTLARNI BAZADAN YUKLASH ====================
-def load_bot_templates():
-    """Bot shablonlarini ma'lumotlar bazasidan yuklash"""
+def load_bot_templates(template_id=None):
+    """Bot shablonlarini kanallari bilan birga bitta so'rovda yuklash"""
     templates = {}
+    conditions, params = [], []
+    if template_id is not None:
+        conditions.append("t.id = %s")
+        params.append(template_id)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, name, file_path, filename FROM bot_templates
-                """)
-                rows = cur.fetchall()
-                for row in rows:
-                    template_id = str(row['id'])
-                    templates[template_id] = {
+                cur.execute(f"""
+                    SELECT t.id, t.name, t.file_path, t.filename, t.runtime_path,
+                           COALESCE(array_agg(rc.channel_identifier ORDER BY rc.id)
+                                    FILTER (WHERE rc.id IS NOT NULL), '{{}}') AS channels
+                    FROM bot_templates t
+                    LEFT JOIN required_channels rc ON rc.template_id = t.id
+                    {where_sql}
+                    GROUP BY t.id
+                    ORDER BY t.created_at, t.id
+                """, params)
+                for row in cur.fetchall():
+                    templates[str(row['id'])] = {
                         'name': row['name'],
                         'path': row['file_path'],
-                        'filename': row['filename']
+                        'filename': row['filename'],
+                        'runtime_path': row['runtime_path'],
+                        'channels': list(row['channels'])
                     }
-                    
-                    # Shablonga bog'liq kanallarni ham yuklash
-                    cur.execute("""
-                        SELECT channel_identifier FROM required_channels 
-                        WHERE template_id = %s
-                    """, (row['id'],))
-                    channels = [c['channel_identifier'] for c in cur.fetchall()]
-                    templates[template_id]['channels'] = channels
     except Exception as e:
         print(f"Shablonlarni yuklashda xatolik: {e}")
     return templates
 
-def save_bot_template(template_id, name, file_path, filename):
-    """Bot shablonini ma'lumotlar bazasiga saqlash"""
+def save_bot_template(template_id, name, file_path, filename, content_hash=None):
+    """
+    Bot shablonini ma'lumotlar bazasiga saqlash. Saqlansa True, shu mazmundagi shablon
+    allaqachon bo'lsa False, bazada xato bo'lsa None qaytaradi.
+    """
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO bot_templates (id, name, file_path, filename)
-                    VALUES (%s, %s, %s, %s)
-                """, (template_id, name, file_path, filename))
+                    INSERT INTO bot_templates (id, name, file_path, filename, content_hash)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (content_hash) DO NOTHING
+                """, (template_id, name, file_path, filename, content_hash))
+                saved = cur.rowcount > 0
+                if saved:
+                    notify_cache_change(cur, 'templates', template_id)
                 conn.commit()
+        if saved:
+            screen_cache.invalidate()
+        return saved
     except Exception as e:
         print(f"Shablonni saqlashda xatolik: {e}")
+        return None
+
+def find_template_by_hash(content_hash):
+    """Shu mazmundagi shablon nomini qaytarish; topilmasa None"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM bot_templates WHERE content_hash = %s", (content_hash,))
+                row = cur.fetchone()
+                return row['name'] if row else None
+    except Exception as e:
+        print(f"Shablonni qidirishda xatolik: {e}")
+        return None
+
+def set_template_runtime_path(template_id, runtime_path):
+    """Shablonning umumiy (runtime) faylini saqlash; '' - shablon runtime konfiguratsiyani qo'llamaydi"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE bot_templates SET runtime_path = %s WHERE id = %s", (runtime_path, template_id))
+                conn.commit()
+    except Exception as e:
+        print(f"Shablon runtime faylini saqlashda xatolik: {e}")
 
 def delete_bot_template(template_id):
     """Bot shablonini ma'lumotlar bazasidan o'chirish"""
@@ -158,67 +928,220 @@ def delete_bot_template(template_id):
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM bot_templates WHERE id = %s", (template_id,))
+                notify_cache_change(cur, 'templates', template_id)
                 conn.commit()
+        screen_cache.invalidate()
     except Exception as e:
         print(f"Shablonni o'chirishda xatolik: {e}")
 
-def load_user_bots():
-    """Foydalanuvchi botlarini ma'lumotlar bazasidan yuklash"""
-    bots = {}
+def load_bot_labels(bot_ids):
+    """Botlarning qisqa nomlari: {bot ID: "shablon · Telegram bot ID"}"""
+    labels = {}
+    if not bot_ids:
+        return labels
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT id, template_id, token, admin_id, file_path FROM user_bots
-                    WHERE is_active = TRUE
-                """)
-                rows = cur.fetchall()
-                for row in rows:
-                    bot_id = str(row['id'])
-                    bots[bot_id] = {
+                    SELECT b.id, b.token, t.name
+                    FROM user_bots b
+                    JOIN bot_templates t ON t.id = b.template_id
+                    WHERE b.id = ANY(%s::uuid[])
+                """, (list(bot_ids),))
+                for row in cur.fetchall():
+                    labels[str(row['id'])] = f"{row['name']} · {row['token'].split(':')[0]}"
+    except Exception as e:
+        print(f"Bot nomlarini yuklashda xatolik: {e}")
+    return labels
+
+def load_user_bots(bot_id=None, template_id=None, owner_id=None):
+    """Faol foydalanuvchi botlarini kanallari bilan birga bitta so'rovda yuklash"""
+    bots = {}
+    conditions, params = ["b.is_active = TRUE"], []
+    if bot_id is not None:
+        conditions.append("b.id = %s")
+        params.append(bot_id)
+    if template_id is not None:
+        conditions.append("b.template_id = %s")
+        params.append(template_id)
+    if owner_id is not None:
+        conditions.append("b.owner_id = %s")
+        params.append(str(owner_id))
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT b.id, b.template_id, b.token, b.admin_id, b.owner_id, b.file_path,
+                           b.launch_mode, b.desired_state, b.process_state, b.pid,
+                           (SELECT node_id FROM bot_leases WHERE bot_id = b.id AND released_at IS NULL) AS node_id,
+                           COALESCE(array_agg(bc.channel_identifier ORDER BY bc.id)
+                                    FILTER (WHERE bc.id IS NOT NULL), '{{}}') AS channels
+                    FROM user_bots b
+                    LEFT JOIN bot_channels bc ON bc.bot_id = b.id
+                    WHERE {' AND '.join(conditions)}
+                    GROUP BY b.id
+                    ORDER BY b.created_at, b.id
+                """, params)
+                for row in cur.fetchall():
+                    bots[str(row['id'])] = {
                         'template_id': str(row['template_id']),
                         'token': row['token'],
                         'admin_id': row['admin_id'],
+                        'owner_id': row['owner_id'],
                         'path': row['file_path'],
-                        'process': None,  # Bu jarayonni keyin boshqarish kerak
-                        'channels': []  # Kanallarni alohida yuklash kerak
+                        'launch_mode': row['launch_mode'],
+                        'desired_state': row['desired_state'],
+                        'process_state': row['process_state'],
+                        'pid': row['pid'],
+                        'node_id': row['node_id'],
+                        'channels': list(row['channels'])
                     }
-                    
-                    # Botga bog'liq kanallarni yuklash
-                    cur.execute("""
-                        SELECT channel_identifier FROM bot_channels 
-                        WHERE bot_id = %s
-                    """, (row['id'],))
-                    channels = [c['channel_identifier'] for c in cur.fetchall()]
-                    bots[bot_id]['channels'] = channels
     except Exception as e:
         print(f"Botlarni yuklashda xatolik: {e}")
     return bots
 
-def save_user_bot(bot_id, template_id, token, admin_id, file_path):
-    """Foydalanuvchi botini ma'lumotlar bazasiga saqlash"""
+def load_owner_bots_page(owner_id, template_id=None, cursor=None, direction='next', limit=MY_BOTS_PAGE_SIZE):
+    """
+    Egasining botlarini kalit (keyset) bo'yicha sahifalab yuklash.
+    cursor - oldingi sahifadagi chetki botning ID si; shablon berilmasa u shu botdan olinadi.
+    (botlar ro'yxati, oldingi sahifa bormi, keyingi sahifa bormi) qaytaradi.
+    """
+    conditions = ["b.owner_id = %s", "b.is_active = TRUE"]
+    params = [str(owner_id)]
+    if template_id is not None:
+        conditions.append("b.template_id = %s")
+        params.append(template_id)
+    elif cursor is not None:
+        conditions.append("b.template_id = (SELECT template_id FROM user_bots WHERE id = %s)")
+        params.append(cursor)
+    if cursor is not None:
+        operator = ">" if direction == 'next' else "<"
+        conditions.append(f"(b.created_at, b.id) {operator} (SELECT created_at, id FROM user_bots WHERE id = %s)")
+        params.append(cursor)
+    order = "ASC" if direction == 'next' else "DESC"
+    params.append(limit + 1)
+
+    bots = []
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT b.id, b.template_id, b.token, b.admin_id,
+                           (SELECT count(*) FROM bot_channels bc WHERE bc.bot_id = b.id) AS channels_count
+                    FROM user_bots b
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY b.created_at {order}, b.id {order}
+                    LIMIT %s
+                """, params)
+                for row in cur.fetchall():
+                    bots.append({
+                        'id': str(row['id']),
+                        'template_id': str(row['template_id']),
+                        'token': row['token'],
+                        'admin_id': row['admin_id'],
+                        'channels_count': row['channels_count']
+                    })
+    except Exception as e:
+        print(f"Botlar sahifasini yuklashda xatolik: {e}")
+        return [], False, False
+
+    has_more = len(bots) > limit
+    bots = bots[:limit]
+    if direction == 'next':
+        return bots, cursor is not None, has_more
+    bots.reverse()
+    return bots, has_more, True
+
+def insert_bot_channels(cur, rows):
+    """(bot_id, kanal) juftliklarini ko'p qatorli INSERT lar bilan yozish"""
+    if rows:
+        execute_values(cur, """
+            INSERT INTO bot_channels (bot_id, channel_identifier) VALUES %s
+            ON CONFLICT DO NOTHING
+        """, rows, page_size=1000)
+
+def save_user_bot(bot_id, template_id, token, admin_id, file_path, owner_id=None, launch_mode='copy', channels=()):
+    """Foydalanuvchi botini majburiy kanallari bilan birga bitta tranzaksiyada saqlash"""
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO user_bots (id, template_id, token, admin_id, file_path)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (bot_id, template_id, token, admin_id, file_path))
+                    INSERT INTO user_bots (id, template_id, token, admin_id, owner_id, file_path, launch_mode)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, (bot_id, template_id, token, admin_id, owner_id, file_path, launch_mode))
+                insert_bot_channels(cur, [(bot_id, channel) for channel in channels])
+                notify_cache_change(cur, 'bots', bot_id)
                 conn.commit()
     except Exception as e:
         print(f"Botni saqlashda xatolik: {e}")
 
+def load_bots_to_run(node_id=None):
+    """
+    Ishlab turishi kerak bo'lgan faol botlarni yuklash (node_id berilsa - faqat shu tugun
+    lease qilganlari). Xatolikda None - bo'sh ro'yxat botlarni to'xtatib yubormasligi uchun.
+    """
+    lease_sql = ""
+    if node_id is not None:
+        lease_sql = """
+            AND id IN (SELECT bot_id FROM bot_leases
+                       WHERE node_id = %s AND released_at IS NULL AND lease_until > CURRENT_TIMESTAMP)
+        """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT id, file_path, token, admin_id, launch_mode, pid FROM user_bots
+                    WHERE is_active = TRUE AND desired_state = 'running' {lease_sql}
+                    ORDER BY created_at, id
+                """, (node_id,) if node_id is not None else None)
+                return [{'id': str(row['id']), 'path': row['file_path'], 'token': row['token'],
+                         'admin_id': row['admin_id'], 'launch_mode': row['launch_mode'], 'pid': row['pid']}
+                        for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Ishga tushiriladigan botlarni yuklashda xatolik: {e}")
+        return None
+
+def set_bot_desired_state(bot_id, desired_state):
+    """Bot qaysi holatda bo'lishi kerakligini saqlash ('running' yoki 'stopped')"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE user_bots SET desired_state = %s WHERE id = %s", (desired_state, bot_id))
+                notify_cache_change(cur, 'bots', bot_id)
+                conn.commit()
+    except Exception as e:
+        print(f"Bot holatini saqlashda xatolik: {e}")
+
+def update_bot_process_state(bot_id, process_state, pid=None, restart_count=None):
+    """Bot jarayonining haqiqiy holati va PID sini saqlash"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE user_bots
+                    SET process_state = %s, pid = %s,
+                        restart_count = COALESCE(%s, restart_count),
+                        state_changed_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (process_state, pid, restart_count, bot_id))
+                conn.commit()
+    except Exception as e:
+        print(f"Jarayon holatini saqlashda xatolik: {e}")
+
 def delete_user_bot(bot_id):
     """Foydalanuvchi botini ma'lumotlar bazasidan o'chirish"""
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("UPDATE user_bots SET is_active = FALSE WHERE id = %s", (bot_id,))
+                notify_cache_change(cur, 'bots', bot_id)
                 conn.commit()
     except Exception as e:
         print(f"Botni o'chirishda xatolik: {e}")
 
 # ==================== GLOBAL KANAL BOSHQARUVI ====================
+# Global kanal o'zgarishi o'sha tranzaksiyada channel_propagation_jobs ga yoziladi,
+# mavjud botlarning bot_channels qatorlarini esa channel_propagator bo'laklab yangilaydi
 def add_global_channel(channel):
     """Global majburiy kanal qo'shish"""
     try:
@@ -229,8 +1152,17 @@ def add_global_channel(channel):
                     VALUES (%s)
                     ON CONFLICT (channel_identifier) DO NOTHING
                 """, (channel,))
+                added = cur.rowcount > 0
+                if added:
+                    cur.execute("""
+                        INSERT INTO channel_propagation_jobs (channel_identifier, action)
+                        VALUES (%s, 'add')
+                    """, (channel,))
+                    notify_cache_change(cur, 'global_channels', channel)
                 conn.commit()
-                return True
+        if added:
+            channel_propagator.wake()
+        return added
     except Exception as e:
         print(f"Kanal qo'shishda xatolik: {e}")
         return False
@@ -241,8 +1173,17 @@ def remove_global_channel(channel):
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM global_required_channels WHERE channel_identifier = %s", (channel,))
+                removed = cur.rowcount > 0
+                if removed:
+                    cur.execute("""
+                        INSERT INTO channel_propagation_jobs (channel_identifier, action)
+                        VALUES (%s, 'remove')
+                    """, (channel,))
+                    notify_cache_change(cur, 'global_channels', channel)
                 conn.commit()
-                return cur.rowcount > 0
+        if removed:
+            channel_propagator.wake()
+        return removed
     except Exception as e:
         print(f"Kanal o'chirishda xatolik: {e}")
         return False
@@ -264,33 +1205,282 @@ def clear_global_channels():
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO channel_propagation_jobs (channel_identifier, action)
+                    SELECT channel_identifier, 'remove' FROM global_required_channels
+                """)
                 cur.execute("DELETE FROM global_required_channels")
+                notify_cache_change(cur, 'global_channels')
                 conn.commit()
                 # Keshni tozalash
                 list_global_channels.cache_clear()
+        channel_propagator.wake()
     except Exception as e:
         print(f"Kanallarni tozalashda xatolik: {e}")
 
+# ==================== KANAL O'ZGARISHLARINI TARQATISH ====================
+def propagate_channel_chunk(job):
+    """
+    Vazifaning navbatdagi bo'lagini bitta set-based so'rov va qisqa tranzaksiyada
+    bajarish. Botlar id bo'yicha tartiblanadi, erishilgan joy vazifaga o'sha
+    tranzaksiyada yoziladi - to'xtab qolgan vazifa keyingi safar shu joydan
+    davom etadi. Vazifa qatori shu tranzaksiyada qulflanadi va holat hamda
+    erishilgan joy lug'atdan emas, qulflangan qatordan olinadi - boshqa nusxa
+    bajarayotgan yoki allaqachon tugagan vazifa qayta qo'llanmaydi.
+    Yangilangan botlar sonini qaytaradi (0 - vazifa tugadi, None - vazifa
+    band, tugagan yoki shu kanalning oldingi vazifasi hali tugamagan).
+    """
+    if job['action'] == 'add':
+        # O'chirilgan botlarga kanal qo'shmaymiz
+        apply_sql = """
+            INSERT INTO bot_channels (bot_id, channel_identifier)
+            SELECT id, %(channel)s FROM chunk WHERE is_active
+            ON CONFLICT DO NOTHING
+        """
+    else:
+        apply_sql = """
+            DELETE FROM bot_channels
+            WHERE channel_identifier = %(channel)s AND bot_id IN (SELECT id FROM chunk)
+        """
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT last_bot_id, processed FROM channel_propagation_jobs j
+                WHERE id = %s AND status = 'pending'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM channel_propagation_jobs p
+                      WHERE p.channel_identifier = j.channel_identifier
+                        AND p.status = 'pending' AND p.id < j.id
+                  )
+                FOR UPDATE SKIP LOCKED
+            """, (job['id'],))
+            locked = cur.fetchone()
+            if locked is None:
+                conn.rollback()
+                return None
+            job['last_bot_id'] = str(locked['last_bot_id']) if locked['last_bot_id'] else None
+            job['processed'] = locked['processed']
+
+            cur.execute(f"""
+                WITH chunk AS (
+                    SELECT id, is_active FROM user_bots
+                    WHERE %(last_bot_id)s::uuid IS NULL OR id > %(last_bot_id)s::uuid
+                    ORDER BY id
+                    LIMIT %(limit)s
+                ),
+                applied AS ({apply_sql})
+                SELECT count(*) AS processed, (SELECT id FROM chunk ORDER BY id DESC LIMIT 1) AS last_bot_id
+                FROM chunk
+            """, {'channel': job['channel_identifier'], 'last_bot_id': job['last_bot_id'],
+                  'limit': CHANNEL_PROPAGATION_CHUNK})
+            row = cur.fetchone()
+            if not row['processed']:
+                cur.execute("""
+                    UPDATE channel_propagation_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (job['id'],))
+                conn.commit()
+                return 0
+
+            job['last_bot_id'] = str(row['last_bot_id'])
+            job['processed'] += row['processed']
+            cur.execute("""
+                UPDATE channel_propagation_jobs
+                SET last_bot_id = %s, processed = %s
+                WHERE id = %s
+            """, (job['last_bot_id'], job['processed'], job['id']))
+            conn.commit()
+            return row['processed']
+
+def pending_propagation_jobs():
+    """Tugallanmagan tarqatish vazifalari (yaratilish tartibida)"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, channel_identifier, action, last_bot_id, processed
+                    FROM channel_propagation_jobs
+                    WHERE status = 'pending'
+                    ORDER BY id
+                """)
+                return [dict(row, last_bot_id=str(row['last_bot_id']) if row['last_bot_id'] else None)
+                        for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Tarqatish vazifalarini yuklashda xatolik: {e}")
+        return []
+
+class ChannelPropagator:
+    """Tarqatish vazifalarini bitta fon oqimida navbat bilan bajaradi"""
+
+    def __init__(self):
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        self._wake_event.set()
+
+    def run_pending(self):
+        """Barcha kutilayotgan vazifalarni tugatish (vazifalar tartibi saqlanadi)"""
+        for job in pending_propagation_jobs():
+            started = time.monotonic()
+            while not self._stop_event.is_set():
+                try:
+                    count = propagate_channel_chunk(job)
+                except Exception as e:
+                    print(f"Kanal o'zgarishini tarqatishda xatolik ({job['channel_identifier']}): {e}")
+                    return
+                if count is None:
+                    # Boshqa nusxa bajaryapti yoki navbati kelmagan - keyingi safar qaraymiz
+                    break
+                if not count:
+                    print(f"Kanal {job['channel_identifier']} ({job['action']}): "
+                          f"{job['processed']} ta bot, {time.monotonic() - started:.1f} s")
+                    break
+                time.sleep(CHANNEL_PROPAGATION_PAUSE)
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+            self.run_pending()
+            self._wake_event.wait(CHANNEL_PROPAGATION_POLL)
+
+    def start(self):
+        """Fon oqimini ishga tushirish; avvalgi tugallanmagan vazifalar ham davom ettiriladi"""
+        self._thread = threading.Thread(target=self._loop, name="channel-propagator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+channel_propagator = ChannelPropagator()
+
 # ==================== MAJBURIY OBUNA FUNKSIYALARI ====================
-def check_subscription(bot_instance, user_id, channels=None):
-    """Foydalanuvchining barcha kanallarga obuna bo'lganini tekshirish"""
+class MembershipCache:
+    """(foydalanuvchi, kanal) obuna natijalari uchun TTL va LRU cheklovli kesh"""
+
+    def __init__(self, ttl, negative_ttl, max_size):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (user_id, channel) -> (obuna bormi, amal qilish muddati)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, channel):
+        """Keshdagi natija: True, False yoki None (kesh yo'q / eskirgan)"""
+        key = (str(user_id), channel)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, channel, is_member):
+        ttl = self.ttl if is_member else self.negative_ttl
+        with self._lock:
+            self._entries[(str(user_id), channel)] = (is_member, time.monotonic() + ttl)
+            self._entries.move_to_end((str(user_id), channel))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+membership_cache = MembershipCache(SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_NEGATIVE_TTL, SUBSCRIPTION_CACHE_SIZE)
+membership_lookups = metrics.counter(
+    "makerbot_membership_lookups_total", "Keshda topilmagan kanal a'zoligi tekshiruvlari manba bo'yicha", "source")
+subscription_executor = ThreadPoolExecutor(max_workers=SUBSCRIPTION_CHECK_WORKERS, thread_name_prefix="subscription")
+
+def fetch_channel_membership(bot_instance, channel, user_id):
+    """Telegramdan bitta kanal a'zoligini so'rash (xatolikda None)"""
+    try:
+        chat_member = bot_instance.get_chat_member(channel, user_id)
+        return chat_member.status not in ['left', 'kicked']
+    except Exception as e:
+        print(f"Kanal tekshiruvida xato: {e}")
+        return None
+
+def check_subscription(bot_instance, user_id, channels=None, recheck_negative=False):
+    """
+    Foydalanuvchining barcha kanallarga obuna bo'lganini tekshirish.
+    Natijalar keshlanadi, keshda yo'q kanallar parallel so'raladi.
+    recheck_negative=True bo'lsa, keshdagi salbiy natijalar qayta tekshiriladi.
+    """
     if channels is None:
         channels = list_global_channels()
     
     if not channels:
         return True
-    
+
+    missing = []
     for channel in channels:
-        try:
-            chat_member = bot_instance.get_chat_member(channel, user_id)
-            if chat_member.status in ['left', 'kicked']:
-                return False
-        except Exception as e:
-            print(f"Kanal tekshiruvida xato: {e}")
+        cached = membership_cache.get(user_id, channel)
+        if cached is False and not recheck_negative:
             return False
-    return True
+        if not cached:
+            missing.append(channel)
 
-def create_subscription_markup(channels=None):
+    if not missing:
+        return True
+
+    if SUBSCRIPTION_SOURCE == "tracked":
+        missing = resolve_tracked_membership(user_id, missing, recheck_negative)
+        if missing is None:
+            return False
+        if not missing:
+            return True
+
+    membership_lookups.inc('api', len(missing))
+    futures = [subscription_executor.submit(fetch_channel_membership, bot_instance, channel, user_id)
+               for channel in missing]
+    done, not_done = wait(futures, timeout=SUBSCRIPTION_CHECK_DEADLINE)
+    for future in not_done:
+        future.cancel()
+    if not_done:
+        print(f"Kanal tekshiruvi {SUBSCRIPTION_CHECK_DEADLINE} soniyada tugamadi")
+        return False
+
+    subscribed = True
+    observed = []
+    for channel, future in zip(missing, futures):
+        is_member = future.result()
+        if is_member is None:
+            # Xatolik natijasini keshlamaymiz
+            subscribed = False
+            continue
+        membership_cache.put(user_id, channel, is_member)
+        observed.append((channel, user_id, is_member, None))
+        subscribed = subscribed and is_member
+    if SUBSCRIPTION_SOURCE == "tracked":
+        channel_member_store.record(observed)
+    return subscribed
+
+def create_subscription_markup(channels=None):
     """Obuna tugmalarini yaratish"""
     if channels is None:
         channels = list_global_channels()
@@ -311,9 +1501,717 @@ def create_subscription_markup(channels=None):
                 url="https://t.me"
             ))
     
-    markup.add(types.InlineKeyboardButton("✅ Tekshirish", callback_data="check_subscription"))
+    markup.add(types.InlineKeyboardButton("✅ Tekshirish", callback_data=callback_codec.encode("check_subscription")))
     return markup
 
+# ==================== KANAL A'ZOLIGINI KUZATISH ====================
+# SUBSCRIPTION_SOURCE = "tracked": chat_member yangilanishlari channel_members jadvaliga yoziladi.
+# Keshda yo'q tekshiruv avval jadvaldan o'qiladi, jadvalda yo'q foydalanuvchi bir marta API dan
+# to'ldiriladi. Fon tekshiruvi uzoq tasdiqlanmagan qatorlarni API bilan solishtiradi - bot admin
+# huquqini yo'qotgan yoki yangilanishlar kelmay qolgan vaqtdagi o'zgarishlar shu bilan tuzatiladi.
+class ChannelMemberStore:
+    """channel_members jadvali: (kanal, foydalanuvchi) bo'yicha oxirgi ma'lum a'zolik"""
+
+    def __init__(self):
+        self.table_hits = 0
+        self.backfills = 0
+        self.events = 0
+
+    def lookup(self, user_id, channels):
+        """Jadvaldagi natijalar {kanal: obuna bormi} (xatolikda bo'sh lug'at)"""
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT channel, is_member FROM channel_members
+                        WHERE channel = ANY(%s) AND user_id = %s
+                    """, (list(channels), int(user_id)))
+                    return {row['channel']: row['is_member'] for row in cur.fetchall()}
+        except Exception as e:
+            print(f"Kanal a'zoligini o'qishda xatolik: {e}")
+            return {}
+
+    def record(self, rows):
+        """
+        (kanal, foydalanuvchi, obuna bormi, kuzatuv unix vaqti yoki None - hozir) qatorlarini yozish.
+        Eskiroq kuzatuv jadvaldagi yangiroq holatni almashtirmaydi.
+        """
+        if not rows:
+            return
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO channel_members (channel, user_id, is_member, observed_at, checked_at)
+                        VALUES %s
+                        ON CONFLICT (channel, user_id) DO UPDATE
+                        SET is_member = EXCLUDED.is_member, observed_at = EXCLUDED.observed_at,
+                            checked_at = EXCLUDED.checked_at
+                        WHERE channel_members.observed_at <= EXCLUDED.observed_at
+                    """, [(channel, int(user_id), is_member, observed_at)
+                          for channel, user_id, is_member, observed_at in rows],
+                        template="(%s, %s, %s, COALESCE(to_timestamp(%s::double precision), now()), now())")
+                conn.commit()
+        except Exception as e:
+            print(f"Kanal a'zoligini yozishda xatolik: {e}")
+
+    def claim_stale(self, channels, max_age, limit):
+        """Uzoq tasdiqlanmagan qatorlarni fon tekshiruviga olish (checked_at suriladi - boshqa nusxa olmaydi)"""
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE channel_members SET checked_at = now()
+                        WHERE (channel, user_id) IN (
+                            SELECT channel, user_id FROM channel_members
+                            WHERE channel = ANY(%s) AND checked_at < now() - make_interval(secs => %s)
+                            ORDER BY checked_at
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING channel, user_id, is_member
+                    """, (list(channels), max_age, limit))
+                    rows = cur.fetchall()
+                conn.commit()
+                return rows
+        except Exception as e:
+            print(f"Kanal a'zoligi fon tekshiruvini olishda xatolik: {e}")
+            return []
+
+    def prune(self, channels):
+        """Majburiy ro'yxatdan chiqarilgan kanallar qatorlarini o'chirish"""
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM channel_members WHERE channel <> ALL(%s)", (list(channels),))
+                    removed = cur.rowcount
+                conn.commit()
+                return removed
+        except Exception as e:
+            print(f"Eski kanal a'zoliklarini o'chirishda xatolik: {e}")
+            return 0
+
+
+channel_member_store = ChannelMemberStore()
+
+def resolve_tracked_membership(user_id, channels, recheck_negative=False):
+    """
+    Keshda yo'q kanallarni channel_members dan hal qilish. API dan so'rash kerak bo'lgan
+    kanallar ro'yxatini qaytaradi; biror kanalga obuna yo'qligi jadvaldan aniq bo'lsa - None.
+    recheck_negative=True bo'lsa jadvaldagi salbiy natijalar ham API dan qayta so'raladi.
+    """
+    known = channel_member_store.lookup(user_id, channels)
+    unknown = []
+    for channel in channels:
+        is_member = known.get(channel)
+        if is_member is None or (not is_member and recheck_negative):
+            unknown.append(channel)
+            continue
+        channel_member_store.table_hits += 1
+        membership_lookups.inc('table')
+        membership_cache.put(user_id, channel, is_member)
+        if not is_member:
+            return None
+    channel_member_store.backfills += len(unknown)
+    return unknown
+
+def required_channel_for_chat(chat, channels=None):
+    """Yangilanishdagi chatga mos majburiy kanal identifikatori (@username yoki ID bo'yicha)"""
+    if channels is None:
+        channels = list_global_channels()
+    username = f"@{chat.username}".lower() if chat.username else None
+    for channel in channels:
+        if channel == str(chat.id) or (username is not None and channel.lower() == username):
+            return channel
+    return None
+
+def track_channel_member(update):
+    """chat_member yangilanishini majburiy kanal a'zoligi sifatida yozish"""
+    if SUBSCRIPTION_SOURCE != "tracked":
+        return
+    channel = required_channel_for_chat(update.chat)
+    if channel is None:
+        return
+    user_id = update.new_chat_member.user.id
+    is_member = update.new_chat_member.status not in ['left', 'kicked']
+    channel_member_store.events += 1
+    # date soniyagacha yaxlitlangan: shu soniyadagi getChatMember natijasi hodisani bosib ketmasin
+    channel_member_store.record([(channel, user_id, is_member, update.date + 1)])
+    membership_cache.put(user_id, channel, is_member)
+
+def subscription_allowed_updates():
+    """getUpdates / setWebhook uchun allowed_updates: chat_member faqat aniq so'ralganda yuboriladi"""
+    if SUBSCRIPTION_SOURCE != "tracked":
+        return None
+    return util.update_types
+
+
+class MembershipSweeper:
+    """Fon oqimi: uzoq tasdiqlanmagan channel_members qatorlarini getChatMember bilan solishtirish"""
+
+    def __init__(self, store):
+        self.store = store
+        self.checked = 0
+        self.changed = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def sweep(self):
+        """Bitta bosqich: qayta tekshirilgan qatorlar soni"""
+        channels = list_global_channels()
+        if not channels:
+            return 0
+        self.store.prune(channels)
+        rows = self.store.claim_stale(channels, MEMBERSHIP_RECHECK_AGE, MEMBERSHIP_SWEEP_BATCH)
+        observed = []
+        for row in rows:
+            if self._stop_event.is_set():
+                break
+            is_member = fetch_channel_membership(bot, row['channel'], row['user_id'])
+            if is_member is None:
+                continue
+            observed.append((row['channel'], row['user_id'], is_member, None))
+            if is_member != row['is_member']:
+                self.changed += 1
+                membership_cache.put(row['user_id'], row['channel'], is_member)
+        self.store.record(observed)
+        self.checked += len(observed)
+        return len(rows)
+
+    def _loop(self):
+        while not self._stop_event.wait(MEMBERSHIP_SWEEP_INTERVAL):
+            # To'liq bosqichdan keyin navbatda yana qatorlar bo'lishi mumkin
+            while not self._stop_event.is_set() and self.sweep() >= MEMBERSHIP_SWEEP_BATCH:
+                pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="membership-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+membership_sweeper = MembershipSweeper(channel_member_store)
+
+@bot.chat_member_handler()
+def chat_member_update_handler(update):
+    track_channel_member(update)
+
+# ==================== CHIQUVCHI SO'ROVLAR REJALASHTIRUVCHISI ====================
+# Xabar yuboruvchi Telegram metodlari shu yerdan o'tadi: token chelaklari global,
+# chat va guruh limitlarini ushlab turadi, callback javoblari birinchi yuboriladi,
+# 429 javobidagi retry_after kutiladi, bitta xabarning ketma-ket tahrirlari
+# yuborilmaguncha oxirgisiga birlashtiriladi. Qolgan metodlar (getUpdates,
+# getChatMember, ...) to'g'ridan-to'g'ri ketadi.
+PRIORITY_CALLBACK = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+OUTBOUND_METHODS = {
+    'answerCallbackQuery', 'sendMessage', 'editMessageText', 'editMessageReplyMarkup',
+    'sendDocument', 'sendPhoto', 'copyMessage', 'forwardMessage', 'deleteMessage',
+}
+COALESCED_METHODS = {'editMessageText', 'editMessageReplyMarkup'}
+
+class TokenBucket:
+    """Sekundiga rate ta, capacity tagacha yig'iladigan tokenlar"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Token olish uchun kutish kerak bo'lgan vaqt (0 - hozir mumkin)"""
+        self._refill(now)
+        blocked = max(self.blocked_until - now, 0)
+        return max(blocked, (1 - self.tokens) / self.rate if self.tokens < 1 else 0)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundJob:
+    """Navbatdagi bitta so'rov; birlashtirilgan tahrirlar kutuvchilari futures da"""
+
+    def __init__(self, method_name, chat_key, is_group, priority, params, send, seq, edit_key=None):
+        self.method_name = method_name
+        self.chat_key = chat_key
+        self.is_group = is_group
+        self.priority = priority
+        self.edit_key = edit_key
+        self.params = params
+        self.send = send
+        self.seq = seq
+        self.not_before = 0
+        self.retries = 0
+        self.retryable = True
+        self.created = time.monotonic()
+        self.futures = [Future()]
+
+    def cancelled(self):
+        """Barcha kutuvchilar kutish muddati o'tib voz kechgan - yuborish shart emas"""
+        return all(future.cancelled() for future in self.futures)
+
+    def resolve(self, result=None, error=None):
+        for future in self.futures:
+            try:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            except InvalidStateError:
+                # Kutuvchi shu orada voz kechgan (cancel)
+                pass
+
+
+class OutboundScheduler:
+    """Chiquvchi so'rovlar navbati va ularni limitlar bo'yicha yuboruvchi oqimlar"""
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, global_burst=OUTBOUND_GLOBAL_BURST,
+                 chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST, group_rate=OUTBOUND_GROUP_RATE,
+                 workers=OUTBOUND_WORKERS, max_retries=OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.workers = workers
+        self.max_retries = max_retries
+        self.running = False
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}              # chat kaliti -> TokenBucket
+        self._jobs = []               # kutayotgan vazifalar
+        self._pending_edits = {}      # (chat, xabar) -> hali yuborilmagan tahrir vazifasi
+        self._cond = threading.Condition()
+        self._executor = None
+        self._seq = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self._waits = {PRIORITY_CALLBACK: deque(maxlen=1000), PRIORITY_INTERACTIVE: deque(maxlen=1000),
+                       PRIORITY_BULK: deque(maxlen=1000)}
+
+    @staticmethod
+    def classify(method_name, params):
+        """(chat kaliti, guruhmi, ustuvorlik)"""
+        if method_name == 'answerCallbackQuery':
+            return None, False, PRIORITY_CALLBACK
+        chat_id = str((params or {}).get('chat_id', ''))
+        is_group = chat_id.startswith(('-', '@'))
+        if is_group or method_name in ('sendDocument', 'sendPhoto', 'copyMessage', 'forwardMessage'):
+            return chat_id, is_group, PRIORITY_BULK
+        return chat_id, is_group, PRIORITY_INTERACTIVE
+
+    def _chat_bucket(self, chat_key, is_group):
+        bucket = self._chats.get(chat_key)
+        if bucket is None:
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_key] = bucket
+        return bucket
+
+    def submit(self, method_name, params, send, retryable=True):
+        """
+        So'rovni navbatga qo'yish. send(params) so'rovni haqiqatda yuboradi; retryable=False
+        bo'lsa 429 da qayta yuborilmaydi. Natija (yoki xato) qaytariladigan Future -
+        kutuvchi uni bekor qilsa (cancel), hali navbatdagi so'rov yuborilmaydi.
+        """
+        chat_key, is_group, priority = self.classify(method_name, params)
+        with self._cond:
+            edit_key = None
+            if method_name in COALESCED_METHODS and params and 'message_id' in params:
+                edit_key = (method_name, chat_key, str(params['message_id']))
+                pending = self._pending_edits.get(edit_key)
+                if pending is not None:
+                    # Hali yuborilmagan tahrir - faqat oxirgi holat yuboriladi
+                    pending.params = params
+                    pending.send = send
+                    pending.retryable = retryable
+                    future = Future()
+                    pending.futures.append(future)
+                    self.coalesced += 1
+                    return future
+            self._seq += 1
+            job = OutboundJob(method_name, chat_key, is_group, priority, params, send, self._seq, edit_key)
+            job.retryable = retryable
+            if edit_key:
+                self._pending_edits[edit_key] = job
+            self._jobs.append(job)
+            self._cond.notify()
+            return job.futures[0]
+
+    def _next_ready(self, now):
+        """Limitlar ruxsat beradigan eng ustuvor vazifa yoki (None, kutish vaqti)"""
+        best = None
+        wait_time = 1.0
+        global_wait = self._global.wait_time(now)
+        for job in self._jobs:
+            job_wait = max(job.not_before - now, 0)
+            if job.chat_key is not None:
+                job_wait = max(job_wait, self._chat_bucket(job.chat_key, job.is_group).wait_time(now))
+            # Callback javoblari Telegram xabar limitlariga kirmaydi
+            if job.priority != PRIORITY_CALLBACK:
+                job_wait = max(job_wait, global_wait)
+            if job_wait > 0:
+                wait_time = min(wait_time, job_wait)
+                continue
+            if best is None or (job.priority, job.seq) < (best.priority, best.seq):
+                best = job
+        return best, wait_time
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self.running:
+                        return
+                    now = time.monotonic()
+                    job, wait_time = self._next_ready(now)
+                    if job is not None:
+                        break
+                    self._cond.wait(wait_time if self._jobs else None)
+                self._jobs.remove(job)
+                if job.edit_key and self._pending_edits.get(job.edit_key) is job:
+                    del self._pending_edits[job.edit_key]
+                if job.cancelled():
+                    # Natijani hech kim kutmayapti - limitni sarflamaymiz
+                    continue
+                if job.priority != PRIORITY_CALLBACK:
+                    self._global.take(now)
+                if job.chat_key is not None:
+                    self._chat_bucket(job.chat_key, job.is_group).take(now)
+                self._waits[job.priority].append(now - job.created)
+                if len(self._chats) > 10000:
+                    self._chats = {key: bucket for key, bucket in self._chats.items() if not bucket.idle(now)}
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            result = job.send(job.params)
+        except Exception as e:
+            if getattr(e, 'error_code', None) == 429 and job.retryable and job.retries < self.max_retries:
+                retry_after = (getattr(e, 'result_json', None) or {}).get('parameters', {}).get('retry_after', 1)
+                self._retry(job, retry_after)
+                return
+            job.resolve(error=e)
+            return
+        with self._cond:
+            self.sent += 1
+        job.resolve(result)
+
+    def _retry(self, job, retry_after):
+        """429 dan keyin: chatni retry_after ga to'xtatib, vazifani qayta navbatga qo'yish"""
+        now = time.monotonic()
+        with self._cond:
+            self.rate_limited += 1
+            job.retries += 1
+            job.not_before = now + retry_after
+            if job.chat_key is not None:
+                bucket = self._chat_bucket(job.chat_key, job.is_group)
+                bucket.blocked_until = max(bucket.blocked_until, job.not_before)
+            if job.edit_key:
+                newer = self._pending_edits.get(job.edit_key)
+                if newer is not None:
+                    # Orada yangi tahrir kelgan - eskisini qayta yubormaymiz
+                    newer.futures.extend(job.futures)
+                    self.coalesced += 1
+                    return
+                self._pending_edits[job.edit_key] = job
+            self._jobs.append(job)
+            self._cond.notify()
+
+    def start(self):
+        """Yuboruvchi oqimlarni ishga tushirish"""
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbound")
+        self.running = True
+        threading.Thread(target=self._dispatch_loop, name="outbound-scheduler", daemon=True).start()
+
+    def stop(self):
+        """Yuborishni to'xtatish; navbatda qolgan so'rovlar xato bilan yakunlanadi"""
+        with self._cond:
+            self.running = False
+            jobs, self._jobs = self._jobs, []
+            self._pending_edits.clear()
+            self._cond.notify_all()
+        for job in jobs:
+            job.resolve(error=RuntimeError("Chiquvchi so'rovlar navbati to'xtatildi"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._cond:
+            def p99(values):
+                values = sorted(values)
+                return values[int(len(values) * 0.99)] * 1000 if values else 0.0
+            return {'queued': len(self._jobs), 'sent': self.sent, 'coalesced': self.coalesced,
+                    'rate_limited': self.rate_limited,
+                    'callback_wait_p99_ms': p99(self._waits[PRIORITY_CALLBACK]),
+                    'interactive_wait_p99_ms': p99(self._waits[PRIORITY_INTERACTIVE]),
+                    'bulk_wait_p99_ms': p99(self._waits[PRIORITY_BULK])}
+
+
+outbound_scheduler = OutboundScheduler()
+metrics.gauge("makerbot_outbound_queued", "Yuborilishini kutayotgan Telegram so'rovlari", None,
+              lambda: outbound_scheduler.stats()['queued'])
+_direct_make_request = timed_api_request(apihelper._make_request)
+
+def upload_rewinder(files):
+    """
+    Yuklanadigan fayl oqimlarini boshlang'ich joyiga qaytaruvchi funksiya: 429 dan keyingi
+    qayta yuborish o'qib bo'lingan oqimni yubormasligi uchun. Oqim seek qilinmasa None.
+    """
+    positions = []
+    for value in (files or {}).values():
+        for item in (value if isinstance(value, tuple) else (value,)):
+            stream = item.file if isinstance(item, types.InputFile) else item
+            if not hasattr(stream, 'read'):
+                continue
+            try:
+                if not stream.seekable():
+                    return None
+                positions.append((stream, stream.tell()))
+            except (AttributeError, OSError, ValueError):
+                return None
+
+    def rewind():
+        for stream, position in positions:
+            stream.seek(position)
+    return rewind
+
+def scheduled_make_request(token, method_name, method='get', params=None, files=None):
+    """apihelper._make_request o'rnida: xabar yuboruvchi metodlar rejalashtiruvchi orqali"""
+    if not outbound_scheduler.running or method_name not in OUTBOUND_METHODS:
+        return _direct_make_request(token, method_name, method, params=params, files=files)
+    rewind = upload_rewinder(files)
+
+    def send(job_params):
+        if rewind is not None:
+            rewind()
+        return _direct_make_request(token, method_name, method, params=job_params, files=files)
+
+    future = outbound_scheduler.submit(method_name, params, send, retryable=rewind is not None)
+    try:
+        return future.result(timeout=OUTBOUND_RESULT_TIMEOUT)
+    except FutureTimeoutError:
+        # Hali navbatda bo'lsa yuborilmaydi
+        future.cancel()
+        raise
+
+apihelper._make_request = scheduled_make_request
+
+# ==================== SUHBAT HOLATI ====================
+# Keyingi qadam handlerlari xotiradagi closure sifatida emas, (qadam nomi, argumentlar)
+# ko'rinishida saqlanadi. Argumentlar JSON ga aylanadigan bo'lishi kerak.
+class MemoryConversationStore:
+    """Jarayon xotirasidagi TTL va LRU cheklovli suhbat holatlari"""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # chat_id -> (qadam, argumentlar, amal qilish muddati)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def set(self, chat_id, step, args):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[chat_id] = (step, list(args), now + self.ttl)
+            self._entries.move_to_end(chat_id)
+            # TTL bir xil - eskirganlar har doim boshida turadi
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if oldest[2] >= now:
+                    break
+                self._entries.popitem(last=False)
+                self.expired += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, chat_id):
+        """Chat kutayotgan qadam: (qadam, argumentlar) yoki None"""
+        with self._lock:
+            entry = self._entries.pop(chat_id, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] < time.monotonic():
+                self.expired += 1
+                return None
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def discard(self, chat_id):
+        with self._lock:
+            self._entries.pop(chat_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions}
+
+
+class PostgresConversationStore:
+    """conversation_states jadvalidagi suhbat holatlari (nusxalar orasida umumiy)"""
+
+    def __init__(self, ttl, max_size, sweep_interval=CONVERSATION_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def set(self, chat_id, step, args):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO conversation_states (chat_id, step, args, updated_at, expires_at)
+                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                        ON CONFLICT (chat_id) DO UPDATE
+                        SET step = EXCLUDED.step, args = EXCLUDED.args,
+                            updated_at = EXCLUDED.updated_at, expires_at = EXCLUDED.expires_at
+                    """, (chat_id, step, json.dumps(list(args)), self.ttl))
+                    conn.commit()
+        except Exception as e:
+            print(f"Suhbat holatini saqlashda xatolik: {e}")
+        self._maybe_sweep()
+
+    def pop(self, chat_id):
+        """Chat kutayotgan qadamni olish va o'chirish (bir nechta nusxadan faqat bittasi oladi)"""
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM conversation_states WHERE chat_id = %s
+                        RETURNING step, args, expires_at >= CURRENT_TIMESTAMP AS alive
+                    """, (chat_id,))
+                    row = cur.fetchone()
+                    conn.commit()
+        except Exception as e:
+            print(f"Suhbat holatini o'qishda xatolik: {e}")
+            return None
+        if row is None:
+            self._count('misses')
+            return None
+        if not row['alive']:
+            self._count('expired')
+            return None
+        self._count('hits')
+        return row['step'], row['args']
+
+    def discard(self, chat_id):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM conversation_states WHERE chat_id = %s", (chat_id,))
+                    conn.commit()
+        except Exception as e:
+            print(f"Suhbat holatini o'chirishda xatolik: {e}")
+
+    def _maybe_sweep(self):
+        """Eskirgan va chegaradan oshgan holatlarni vaqti-vaqti bilan tozalash"""
+        with self._lock:
+            if time.monotonic() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = time.monotonic()
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM conversation_states WHERE expires_at < CURRENT_TIMESTAMP")
+                    self._count('expired', cur.rowcount)
+                    cur.execute("""
+                        DELETE FROM conversation_states WHERE chat_id IN (
+                            SELECT chat_id FROM conversation_states
+                            ORDER BY updated_at DESC
+                            OFFSET %s
+                        )
+                    """, (self.max_size,))
+                    self._count('evictions', cur.rowcount)
+                    conn.commit()
+        except Exception as e:
+            print(f"Suhbat holatlarini tozalashda xatolik: {e}")
+
+    def stats(self):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT count(*) AS size FROM conversation_states")
+                    size = cur.fetchone()['size']
+        except Exception as e:
+            print(f"Suhbat holatlarini sanashda xatolik: {e}")
+            size = 0
+        with self._lock:
+            return {'size': size, 'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions}
+
+
+class ConversationStepBackend(HandlerBackend):
+    """
+    TeleBot next_step_backend: register_next_step_handler chaqiruvlarini
+    funksiya nomi bo'yicha suhbat holatlari omboriga yozadi.
+    """
+
+    def __init__(self, store, steps):
+        super().__init__()
+        self.store = store
+        self.steps = steps
+
+    def register_handler(self, handler_group_id, handler):
+        name = handler.callback.__name__
+        if self.steps.get(name) is not handler.callback:
+            raise ValueError(f"'{name}' suhbat qadami sifatida ro'yxatdan o'tmagan")
+        self.store.set(handler_group_id, name, handler.args)
+
+    def clear_handlers(self, handler_group_id):
+        self.store.discard(handler_group_id)
+
+    def get_handlers(self, handler_group_id):
+        state = self.store.pop(handler_group_id)
+        if state is None or state[0] not in self.steps:
+            return None
+        return [telebot.Handler(self.steps[state[0]], *state[1])]
+
+
+if CONVERSATION_STORE == "postgres":
+    conversation_store = PostgresConversationStore(CONVERSATION_TTL, CONVERSATION_MAX_SIZE)
+else:
+    conversation_store = MemoryConversationStore(CONVERSATION_TTL, CONVERSATION_MAX_SIZE)
+
+conversation_steps = {}
+
+def conversation_step(func):
+    """Funksiyani keyingi qadam handleri sifatida nomi bilan ro'yxatdan o'tkazish"""
+    func = timed_handler(func)
+    conversation_steps[func.__name__] = func
+    return func
+
+bot.next_step_backend = ConversationStepBackend(conversation_store, conversation_steps)
+
 # ==================== YORDAMCHI FUNKSIYALAR ====================
 def safe_edit_message_text(text, chat_id, message_id, reply_markup=None):
     """Xabarni tahrirlashda xatoliklarni ushlaydi"""
@@ -339,625 +2237,3025 @@ def safe_answer_callback_query(callback_query_id, text=None, show_alert=False, u
     except Exception as e:
         print(f"Callback javoblashda xato: {e}")
 
-# ==================== ADMIN PANEL ====================
-@bot.message_handler(commands=['start'])
-def start(message):
-    user_id = str(message.from_user.id)
-    
-    # Global majburiy kanallarni olish
-    global_channels = list_global_channels()
-    
-    # Majburiy obuna tekshiruvi
-    if global_channels and not check_subscription(bot, user_id, global_channels):
-        channels_text = "\n".join([f"🔹 {channel}" for channel in global_channels])
-        response_text = f"⚠️ <b>Botdan foydalanish uchun quyidagi kanallarga obuna bo'ling:</b>\n\n{channels_text}"
-        
-        markup = create_subscription_markup(global_channels)
-        bot.reply_to(message, response_text, parse_mode='HTML', reply_markup=markup)
-        return
-    
-    # Admin uchun maxsus menyular
-    if user_id == ADMIN_ID:
-        show_admin_menu(message)
-    else:
-        show_user_menu(message)
+def is_admin(user_id):
+    return str(user_id) == ADMIN_ID
 
-@bot.message_handler(commands=['addchannel'])
-def add_channel_command(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        bot.reply_to(message, "❌ Siz admin emassiz!")
-        return
-    
-    msg = bot.reply_to(message, "🆔 Qo'shish uchun kanal username yoki ID sini kiriting (@username yoki -100123456789 formatida):")
-    bot.register_next_step_handler(msg, process_add_channel)
+def bot_owner_filter(user_id):
+    """Admin barcha botlarni, oddiy foydalanuvchi faqat o'z botlarini boshqaradi"""
+    return None if is_admin(user_id) else str(user_id)
 
-def process_add_channel(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
-    
-    channel = message.text.strip()
-    if add_global_channel(channel):
-        # Keshni yangilash
-        list_global_channels.cache_clear()
-        bot.reply_to(message, f"✅ Kanal qo'shildi: {channel}")
-    else:
-        bot.reply_to(message, f"⚠️ Bu kanal allaqachon qo'shilgan: {channel}")
+# ==================== CALLBACK MARSHRUTLARI ====================
+# Har bir tugma amali bitta baytli kod bilan belgilanadi. callback_data = "!" + base64url
+# (kod + parametrlar): UUID 16 bayt, tanlov 1 bayt. Shuning uchun UUID li tugma 24 belgi
+# (64 bayt chegarasidan ancha kam). Oldin yuborilgan xabarlardagi eski "user_manage_bot_<id>"
+# ko'rinishidagi tugmalar legacy prefikslari orqali tanib olinadi.
+# Kodlarni o'zgartirmang va qayta ishlatmang: eski xabarlardagi tugmalar buziladi.
+CALLBACK_UUID = 'uuid'
+CALLBACK_PREFIX = "!"
 
-@bot.message_handler(commands=['removechannel'])
-def remove_channel_command(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        bot.reply_to(message, "❌ Siz admin emassiz!")
-        return
-    
-    msg = bot.reply_to(message, "🆔 O'chirish uchun kanal username yoki ID sini kiriting:")
-    bot.register_next_step_handler(msg, process_remove_channel)
+class CallbackAction:
+    """Tugma amali: kodi, parametr turlari, faqat admin uchunmi va eski callback_data ko'rinishi"""
 
-def process_remove_channel(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
-    
-    channel = message.text.strip()
-    if remove_global_channel(channel):
-        # Keshni yangilash
-        list_global_channels.cache_clear()
-        bot.reply_to(message, f"✅ Kanal o'chirildi: {channel}")
-    else:
-        bot.reply_to(message, f"❌ Bu kanal topilmadi: {channel}")
+    __slots__ = ('name', 'code', 'params', 'admin', 'legacy')
 
-@bot.message_handler(commands=['listchannels'])
-def list_channels_command(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        bot.reply_to(message, "❌ Siz admin emassiz!")
-        return
-    
-    channels = list_global_channels()
-    if channels:
-        channels_text = "\n".join([f"{i+1}. {channel}" for i, channel in enumerate(channels)])
-        bot.reply_to(message, f"📢 Majburiy obuna kanallari:\n\n{channels_text}")
-    else:
-        bot.reply_to(message, "📭 Hozircha kanal qo'shilmagan.")
+    def __init__(self, name, code, params=(), admin=False, legacy=None):
+        self.name = name
+        self.code = code
+        self.params = params
+        self.admin = admin
+        # {eski prefiks: oldindan qo'yiladigan parametrlar}; parametrsiz amalda prefiks = to'liq matn
+        if legacy is None:
+            legacy = name + "_" if params else name
+        self.legacy = {legacy: ()} if isinstance(legacy, str) else legacy
 
-def show_admin_menu(message):
-    """Admin menyusi"""
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("➕ Yangi bot shabloni qo'shish", callback_data="admin_add_template"))
-    markup.add(types.InlineKeyboardButton("📋 Mavjud shablonlar", callback_data="admin_list_templates"))
-    markup.add(types.InlineKeyboardButton("🤖 Mening botlarim", callback_data="user_show_bots"))
-    markup.add(types.InlineKeyboardButton("📢 Majburiy obuna", callback_data="admin_subscription_menu"))
-    bot.send_message(message.chat.id, "🤖 Bot menejeri - Admin panel", reply_markup=markup)
+CALLBACK_ACTIONS = (
+    CallbackAction('admin_main_menu', 1, admin=True),
+    CallbackAction('admin_subscription_menu', 2, admin=True),
+    CallbackAction('admin_add_channel', 3, admin=True),
+    CallbackAction('admin_list_channels', 4, admin=True),
+    CallbackAction('admin_clear_channels', 5, admin=True),
+    CallbackAction('admin_add_template', 6, admin=True),
+    CallbackAction('admin_list_templates', 7, admin=True),
+    CallbackAction('admin_view_template', 8, (CALLBACK_UUID,), admin=True),
+    CallbackAction('admin_delete_template', 9, (CALLBACK_UUID,), admin=True),
+    CallbackAction('admin_top_bots', 10, (('cpu', 'rss'),), admin=True),
+    CallbackAction('check_subscription', 20),
+    CallbackAction('user_show_bots', 21),
+    CallbackAction('user_back_to_main', 22),
+    CallbackAction('user_select_template', 23, (CALLBACK_UUID,)),
+    CallbackAction('user_create_bot', 24, (CALLBACK_UUID,)),
+    # ('template', shablon ID) - birinchi sahifa, ('next'/'prev', chetki bot ID) - keyingi/oldingi sahifa
+    CallbackAction('user_my_bots', 25, (('template', 'next', 'prev'), CALLBACK_UUID),
+                   legacy={"user_my_bots_": ('template',), "user_my_bots_n_": ('next',),
+                           "user_my_bots_p_": ('prev',)}),
+    CallbackAction('user_manage_bot', 26, (CALLBACK_UUID,)),
+    CallbackAction('user_stop_bot', 27, (CALLBACK_UUID,)),
+    CallbackAction('user_start_bot', 28, (CALLBACK_UUID,)),
+    CallbackAction('user_restart_bot', 29, (CALLBACK_UUID,)),
+    CallbackAction('user_delete_bot', 30, (CALLBACK_UUID,)),
+)
 
-def show_user_menu(message):
-    """Oddiy foydalanuvchi menyusi"""
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🤖 Botlar", callback_data="user_show_bots"))
-    bot.send_message(message.chat.id, "🤖 Botlar menyusi:", reply_markup=markup)
+class CallbackCodec:
+    """callback_data ni amal kodi va turlangan parametrlarga o'girish (va teskarisi)"""
 
-# ==================== MAJBURIY OBUNA MENYUSI ====================
-@bot.callback_query_handler(func=lambda call: call.data == "admin_subscription_menu" and str(call.from_user.id) == ADMIN_ID)
-def admin_subscription_menu(call):
+    def __init__(self, actions):
+        self.by_name = {action.name: action for action in actions}
+        self.by_code = {action.code: action for action in actions}
+        if len(self.by_code) != len(actions) or not all(0 < code < 256 for code in self.by_code):
+            raise ValueError("Callback amallari kodlari takrorlanmas va 1..255 oralig'ida bo'lishi kerak")
+        self.legacy = {}
+        for action in actions:
+            for prefix, preset in action.legacy.items():
+                self.legacy[prefix] = (action, preset)
+        self.max_params = max(len(action.params) for action in actions)
+        # Bir xil tugmalar qayta-qayta bosiladi: ochilgan natijalar keshlanadi
+        self.decode = functools.lru_cache(maxsize=CALLBACK_DECODE_CACHE_SIZE)(self._decode)
+
+    def encode(self, name, *args):
+        """Tugma uchun callback_data"""
+        action = self.by_name[name]
+        if len(args) != len(action.params):
+            raise ValueError(f"'{name}' amali {len(action.params)} ta parametr kutadi")
+        payload = bytearray([action.code])
+        for kind, value in zip(action.params, args):
+            if kind == CALLBACK_UUID:
+                payload += uuid.UUID(str(value)).bytes
+            else:
+                payload.append(kind.index(value))
+        data = CALLBACK_PREFIX + base64.urlsafe_b64encode(bytes(payload)).rstrip(b"=").decode()
+        if len(data) > 64:
+            raise ValueError(f"'{name}' callback_data 64 baytdan uzun")
+        return data
+
+    def _decode(self, data):
+        """(amal, parametrlar) yoki noto'g'ri/noma'lum callback_data uchun None"""
+        if not data:
+            return None
+        try:
+            if data.startswith(CALLBACK_PREFIX):
+                return self._decode_compact(data[len(CALLBACK_PREFIX):])
+            return self._decode_legacy(data)
+        except (ValueError, IndexError):
+            return None
+
+    def _decode_compact(self, text):
+        payload = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+        action = self.by_code.get(payload[0])
+        if action is None:
+            return None
+        args, offset = [], 1
+        for kind in action.params:
+            if kind == CALLBACK_UUID:
+                args.append(str(uuid.UUID(bytes=payload[offset:offset + 16])))
+                offset += 16
+            else:
+                args.append(kind[payload[offset]])
+                offset += 1
+        if offset != len(payload):
+            return None
+        return action, tuple(args)
+
+    def _decode_legacy(self, data):
+        # Eski ko'rinish: prefiks + "_" bilan ajratilgan parametrlar (UUID va tanlovlarda "_" yo'q),
+        # shuning uchun prefiks oxiridan 0, 1, ... ta qism kesib lug'atdan topiladi
+        for count in range(self.max_params + 1):
+            parts = data.rsplit("_", count)
+            if len(parts) <= count:
+                break
+            prefix = data if count == 0 else parts[0] + "_"
+            entry = self.legacy.get(prefix)
+            if entry is None:
+                continue
+            action, preset = entry
+            values = preset + tuple(parts[1:])
+            if len(values) != len(action.params):
+                return None
+            args = []
+            for kind, value in zip(action.params, values):
+                if kind == CALLBACK_UUID:
+                    args.append(str(uuid.UUID(value)))
+                elif value in kind:
+                    args.append(value)
+                else:
+                    return None
+            return action, tuple(args)
+        return None
+
+class CallbackRouter:
+    """
+    Callback so'rovlarini amal kodi bo'yicha lug'atdan topib handlerga yuborish.
+    Admin amallari uchun ruxsat shu yerda tekshiriladi; handler (call, *parametrlar) oladi.
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.handlers = {}
+
+    def route(self, name):
+        """Handlerni amalga bog'lash uchun dekorator"""
+        action = self.codec.by_name[name]
+
+        def decorator(func):
+            self.handlers[action.code] = timed_handler(func)
+            return func
+        return decorator
+
+    def resolve(self, call):
+        """(handler, parametrlar) yoki None (noma'lum tugma yoki ruxsat yo'q)"""
+        decoded = self.codec.decode(call.data)
+        if decoded is None:
+            return None
+        action, args = decoded
+        if action.admin and not is_admin(call.from_user.id):
+            return None
+        handler = self.handlers.get(action.code)
+        if handler is None:
+            return None
+        return handler, args
+
+callback_codec = CallbackCodec(CALLBACK_ACTIONS)
+callback_router = CallbackRouter(callback_codec)
+
+@bot.callback_query_handler(func=lambda call: True)
+def route_callback(call):
+    resolved = callback_router.resolve(call)
+    if resolved is not None:
+        handler, args = resolved
+        handler(call, *args)
+
+# ==================== EKRANLAR ====================
+# Sinxron va asinxron (makerbot_async.py) handlerlar bir xil matn va tugmalarni
+# shu funksiyalar orqali oladi. Har biri (matn, markup) qaytaradi.
+BOT_STATE_LABELS = {
+    'running': "🟢 Ishlamoqda",
+    'starting': "🟡 Ishga tushirilmoqda",
+    'backoff': "🟡 Qayta ishga tushirilmoqda",
+    'stopped': "🔴 To'xtatilgan",
+}
+
+def subscription_required_screen(channels, purpose="Botdan foydalanish"):
+    """Majburiy obuna haqidagi ogohlantirish (HTML)"""
+    channels_text = "\n".join([f"🔹 {channel}" for channel in channels])
+    response_text = f"⚠️ <b>{purpose} uchun quyidagi kanallarga obuna bo'ling:</b>\n\n{channels_text}"
+    return response_text, create_subscription_markup(channels)
+
+def admin_menu_screen():
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("➕ Kanal qo'shish", callback_data="admin_add_channel"))
-    markup.add(types.InlineKeyboardButton("📋 Kanallar ro'yxati", callback_data="admin_list_channels"))
-    markup.add(types.InlineKeyboardButton("🗑️ Kanallarni tozalash", callback_data="admin_clear_channels"))
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data="admin_main_menu"))
-    
-    safe_edit_message_text("📢 Majburiy obuna boshqaruvi:", call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+    markup.add(types.InlineKeyboardButton("➕ Yangi bot shabloni qo'shish", callback_data=callback_codec.encode("admin_add_template")))
+    markup.add(types.InlineKeyboardButton("📋 Mavjud shablonlar", callback_data=callback_codec.encode("admin_list_templates")))
+    markup.add(types.InlineKeyboardButton("🤖 Mening botlarim", callback_data=callback_codec.encode("user_show_bots")))
+    markup.add(types.InlineKeyboardButton("📢 Majburiy obuna", callback_data=callback_codec.encode("admin_subscription_menu")))
+    markup.add(types.InlineKeyboardButton("📈 Top botlar", callback_data=callback_codec.encode("admin_top_bots", 'cpu')))
+    return "🤖 Bot menejeri - Admin panel", markup
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_add_channel" and str(call.from_user.id) == ADMIN_ID)
-def admin_add_channel_callback(call):
-    msg = bot.send_message(call.message.chat.id, "🆔 Qo'shish uchun kanal username yoki ID sini kiriting (@username yoki -100123456789 formatida):")
-    bot.register_next_step_handler(msg, admin_process_add_channel)
-    safe_answer_callback_query(call.id)
+def user_menu_screen():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🤖 Botlar", callback_data=callback_codec.encode("user_show_bots")))
+    return "🤖 Botlar menyusi:", markup
 
-def admin_process_add_channel(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
-    
-    channel = message.text.strip()
-    if add_global_channel(channel):
-        # Keshni yangilash
-        list_global_channels.cache_clear()
-        bot.reply_to(message, f"✅ Kanal qo'shildi: {channel}")
-    else:
-        bot.reply_to(message, f"⚠️ Bu kanal allaqachon qo'shilgan: {channel}")
-    
-    # Menyuga qaytish
-    show_admin_menu(message)
+def subscription_menu_screen():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("➕ Kanal qo'shish", callback_data=callback_codec.encode("admin_add_channel")))
+    markup.add(types.InlineKeyboardButton("📋 Kanallar ro'yxati", callback_data=callback_codec.encode("admin_list_channels")))
+    markup.add(types.InlineKeyboardButton("🗑️ Kanallarni tozalash", callback_data=callback_codec.encode("admin_clear_channels")))
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("admin_main_menu")))
+    return "📢 Majburiy obuna boshqaruvi:", markup
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_list_channels" and str(call.from_user.id) == ADMIN_ID)
-def admin_list_channels_callback(call):
-    channels = list_global_channels()
+def channels_text(channels):
     if channels:
-        channels_text = "\n".join([f"{i+1}. {channel}" for i, channel in enumerate(channels)])
-        response_text = f"📢 Majburiy obuna kanallari:\n\n{channels_text}"
-    else:
-        response_text = "📭 Hozircha kanal qo'shilmagan."
-    
+        channels_list = "\n".join([f"{i+1}. {channel}" for i, channel in enumerate(channels)])
+        return f"📢 Majburiy obuna kanallari:\n\n{channels_list}"
+    return "📭 Hozircha kanal qo'shilmagan."
+
+def back_markup(action, *args):
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data="admin_subscription_menu"))
-    
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode(action, *args)))
+    return markup
+
+def stats_text():
+    pool_stats = db_pool.stats()
+    cache_stats = membership_cache.stats()
+    tracked_text = ""
+    if SUBSCRIPTION_SOURCE == "tracked":
+        tracked_text = (
+            f"A'zolik jadvali: topildi {channel_member_store.table_hits}, "
+            f"API dan to'ldirildi {channel_member_store.backfills}, hodisalar {channel_member_store.events}\n"
+            f"Fon tekshiruvi: {membership_sweeper.checked} ta (o'zgargan {membership_sweeper.changed})\n")
+    screen_stats = screen_cache.stats()
+    invalidator_stats = cache_invalidator.stats()
+    nodes_text = ""
+    if BOT_PLACEMENT == "workers":
+        nodes = load_worker_nodes()
+        nodes_text = f"🖥 Ishchi tugunlar: {len(nodes)} ta\n" + "".join(
+            f"{node['node_id']}: {node['bots']}/{node['capacity']} bot, "
+            f"heartbeat {node['heartbeat_age']:.0f} s oldin\n" for node in nodes) + "\n"
+    dispatch_text = ""
+    if update_dispatcher is not None:
+        dispatch_stats = update_dispatcher.stats()
+        chats = f", chatlar: {dispatch_stats['chats']}" if dispatch_stats['chats'] is not None else ""
+        dispatch_text = (
+            f"🧵 Yangilanishlar ({dispatch_stats['mode']}, {dispatch_stats['workers']} ishchi):\n"
+            f"Navbatda: {dispatch_stats['queued']}{chats}\n"
+            f"Qayta ishlangan: {dispatch_stats['processed']}, rad etilgan: {dispatch_stats['rejected']}\n\n")
+    conversation_stats = conversation_store.stats()
+    outbound_stats = outbound_scheduler.stats()
+    return (
+        "📊 Ma'lumotlar bazasi puli:\n"
+        f"Ulanishlar: {pool_stats['size']} (bo'sh: {pool_stats['idle']}, band: {pool_stats['in_use']})\n"
+        f"Kutayotganlar: {pool_stats['waiting']}\n"
+        f"Olishlar soni: {pool_stats['checkouts']}\n"
+        f"Olish vaqti: o'rtacha {pool_stats['checkout_avg_ms']:.1f} ms, maksimal {pool_stats['checkout_max_ms']:.1f} ms\n"
+        f"Kutish muddati tugagan: {pool_stats['timeouts']}\n"
+        f"Qayta ulanishlar: {pool_stats['reconnects']}\n\n"
+        "📢 Obuna keshi:\n"
+        f"Yozuvlar: {cache_stats['size']}\n"
+        f"Topildi: {cache_stats['hits']}, topilmadi: {cache_stats['misses']} ({cache_stats['hit_rate']:.0%})\n"
+        f"Chiqarib tashlangan: {cache_stats['evictions']}\n"
+        f"{tracked_text}\n"
+        "🗂 Katalog ekranlari keshi:\n"
+        f"Ekranlar: {screen_stats['size']} (katalog versiyasi: {screen_stats['version']})\n"
+        f"Topildi: {screen_stats['hits']}, topilmadi: {screen_stats['misses']} ({screen_stats['hit_rate']:.0%})\n\n"
+        f"🔔 Kesh tinglovchisi: {'ulangan' if invalidator_stats['connected'] else 'uzilgan'}\n"
+        f"Xabarlar: {invalidator_stats['received']}, qayta ulanishlar: {invalidator_stats['reconnects']}, "
+        f"zaxira tozalashlar: {invalidator_stats['fallback_flushes']}\n\n"
+        f"{nodes_text}"
+        f"{dispatch_text}"
+        f"🔁 Kanal tarqatish vazifalari: {len(pending_propagation_jobs())} ta kutmoqda\n\n"
+        "💬 Suhbat holatlari:\n"
+        f"Ochiq: {conversation_stats['size']}\n"
+        f"Topildi: {conversation_stats['hits']}, topilmadi: {conversation_stats['misses']}\n"
+        f"Muddati o'tgan: {conversation_stats['expired']}, chiqarib tashlangan: {conversation_stats['evictions']}\n\n"
+        "📤 Chiquvchi so'rovlar:\n"
+        f"Navbatda: {outbound_stats['queued']}, yuborildi: {outbound_stats['sent']}\n"
+        f"Birlashtirilgan tahrirlar: {outbound_stats['coalesced']}, 429 javoblari: {outbound_stats['rate_limited']}\n"
+        f"Navbatda kutish p99: callback {outbound_stats['callback_wait_p99_ms']:.0f} ms, "
+        f"tahrir/xabar {outbound_stats['interactive_wait_p99_ms']:.0f} ms, "
+        f"ommaviy {outbound_stats['bulk_wait_p99_ms']:.0f} ms"
+    )
+
+def admin_templates_screen(bot_templates):
+    markup = types.InlineKeyboardMarkup()
+    for template_id, template_data in bot_templates.items():
+        btn = types.InlineKeyboardButton(f"📄 {template_data['name']}", callback_data=callback_codec.encode("admin_view_template", template_id))
+        markup.add(btn)
+
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("admin_main_menu")))
+    return "📋 Mavjud shablonlar:", markup
+
+def admin_template_screen(template_id, template_data):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🗑️ O'chirish", callback_data=callback_codec.encode("admin_delete_template", template_id)))
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("admin_list_templates")))
+
+    response_text = f"📄 Shablon ma'lumotlari:\nNom: {template_data['name']}\nFayl: {template_data['filename']}"
+    return response_text, markup
+
+def user_catalog_screen(bot_templates, user_id):
+    markup = types.InlineKeyboardMarkup()
+    for template_id, template_data in bot_templates.items():
+        btn = types.InlineKeyboardButton(f"🤖 {template_data['name']}", callback_data=callback_codec.encode("user_select_template", template_id))
+        markup.add(btn)
+
+    back_data = callback_codec.encode("admin_main_menu" if is_admin(user_id) else "user_back_to_main")
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=back_data))
+    return "📋 Mavjud botlar:", markup
+
+def user_template_screen(template_id, template_data, has_bots):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🚀 Yangi bot yaratish", callback_data=callback_codec.encode("user_create_bot", template_id)))
+
+    # Agar foydalanuvchi allaqachon bot yaratgan bo'lsa
+    if has_bots:
+        markup.add(types.InlineKeyboardButton("⚙️ Mening botlarim", callback_data=callback_codec.encode("user_my_bots", 'template', template_id)))
+
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("user_show_bots")))
+
+    response_text = f"📄 Bot: {template_data['name']}\nFayl: {template_data['filename']}\n\nTanlang:"
+    return response_text, markup
+
+def my_bots_page_args(view, target_id):
+    """user_my_bots tugmasi parametrlarini load_owner_bots_page argumentlariga o'girish"""
+    if view == 'template':
+        return {'template_id': target_id}
+    return {'cursor': target_id, 'direction': view}
+
+def my_bots_screen(my_bots, has_prev, has_next):
+    markup = types.InlineKeyboardMarkup()
+    for bot_data in my_bots:
+        token_preview = bot_data['token'][:15] + "..."
+        admin_info = bot_data['admin_id'] if bot_data['admin_id'] else "yo'q"
+        channels_info = bot_data['channels_count']
+        btn_text = f"🔧 {token_preview} (Admin: {admin_info[:10]}..., 📢{channels_info})"
+        btn = types.InlineKeyboardButton(btn_text, callback_data=callback_codec.encode("user_manage_bot", bot_data['id']))
+        markup.add(btn)
+
+    # Sahifalash tugmalari
+    nav_buttons = []
+    if has_prev:
+        nav_buttons.append(types.InlineKeyboardButton("⬅️ Oldingi", callback_data=callback_codec.encode("user_my_bots", 'prev', my_bots[0]['id'])))
+    if has_next:
+        nav_buttons.append(types.InlineKeyboardButton("Keyingi ➡️", callback_data=callback_codec.encode("user_my_bots", 'next', my_bots[-1]['id'])))
+    if nav_buttons:
+        markup.row(*nav_buttons)
+
+    template_id = my_bots[0]['template_id']
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("user_select_template", template_id)))
+    return "⚙️ Sizning botlaringiz:", markup
+
+def manage_bot_screen(bot_id, bot_data, template_name):
+    """Bot boshqaruvi oynasi"""
+    if BOT_PLACEMENT == "workers":
+        # Jarayon boshqa tugunda: holat u yozgan bazadagi qiymatdan
+        state, pid = bot_data['process_state'], bot_data['pid']
+    else:
+        state, pid = bot_supervisor.status(bot_id)
+
+    markup = types.InlineKeyboardMarkup()
+    if bot_data['desired_state'] == 'running':
+        markup.add(types.InlineKeyboardButton("🛑 To'xtatish", callback_data=callback_codec.encode("user_stop_bot", bot_id)))
+        markup.add(types.InlineKeyboardButton("🔄 Qayta ishga tushirish", callback_data=callback_codec.encode("user_restart_bot", bot_id)))
+    else:
+        markup.add(types.InlineKeyboardButton("▶️ Ishga tushirish", callback_data=callback_codec.encode("user_start_bot", bot_id)))
+    markup.add(types.InlineKeyboardButton("🗑️ O'chirish", callback_data=callback_codec.encode("user_delete_bot", bot_id)))
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("user_my_bots", 'template', bot_data['template_id'])))
+
+    token_preview = bot_data['token'][:20] + "..."
+    admin_info = bot_data['admin_id'] if bot_data['admin_id'] else "yo'q"
+    state_info = BOT_STATE_LABELS.get(state, state)
+    if pid:
+        state_info += f" (PID: {pid})"
+    if BOT_PLACEMENT == "workers" and bot_data.get('node_id'):
+        state_info += f"\nTugun: {bot_data['node_id']}"
+
+    response_text = (f"🔧 Bot boshqaruvi:\nShablon: {template_name}\nToken: {token_preview}\n"
+                     f"Admin ID: {admin_info}\nHolati: {state_info}")
+    usage = bot_usage_sampler.current(bot_id) if pid else None
+    if usage:
+        response_text += f"\nResurslar: {usage_text(usage)}"
+    return response_text, markup
+
+def usage_text(usage):
+    return (f"CPU {usage['cpu']:.1f}% (o'rtacha {usage['cpu_avg']:.1f}%), "
+            f"RAM {usage['rss_mb']:.1f} MB (eng ko'p {usage['rss_peak_mb']:.1f} MB), "
+            f"fayllar {usage['open_files']}")
+
+def top_bots_screen(top, labels, sort_key):
+    """Eng ko'p resurs sarflayotgan botlar oynasi"""
+    markup = types.InlineKeyboardMarkup()
+    lines = []
+    for number, (bot_id, usage) in enumerate(top, 1):
+        label = labels.get(bot_id, bot_id[:8])
+        lines.append(f"{number}. {label}\n   {usage_text(usage)}")
+        markup.add(types.InlineKeyboardButton(f"{number}. {label}", callback_data=callback_codec.encode("user_manage_bot", bot_id)))
+    if sort_key == 'cpu':
+        markup.add(types.InlineKeyboardButton("🧠 RAM bo'yicha", callback_data=callback_codec.encode("admin_top_bots", 'rss')))
+    else:
+        markup.add(types.InlineKeyboardButton("⚙️ CPU bo'yicha", callback_data=callback_codec.encode("admin_top_bots", 'cpu')))
+    markup.add(types.InlineKeyboardButton("🔄 Yangilash", callback_data=callback_codec.encode("admin_top_bots", sort_key)))
+    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=callback_codec.encode("admin_main_menu")))
+
+    title = "CPU" if sort_key == 'cpu' else "RAM"
+    if not lines and BOT_PLACEMENT == "workers":
+        # Menejer faqat o'zi yoqqan jarayonlarni o'lchaydi; botlar esa tugunlarda
+        return ("📈 Botlar ishchi tugunlarda ishlaydi - resurs sarfi har bir tugunda o'lchanadi "
+                "(worker --metrics-port dagi makerbot_bots_rss_bytes)", markup)
+    if not lines:
+        return "📈 Hozircha o'lchangan ishlayotgan botlar yo'q", markup
+    return f"📈 Top botlar ({title} bo'yicha):\n\n" + "\n".join(lines), markup
+
+def bot_created_screen(result, user_token, admin_id, channels_count):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("⚙️ Botni boshqarish", callback_data=callback_codec.encode("user_manage_bot", result['id'])))
+    markup.add(types.InlineKeyboardButton("🔙 Botlar ro'yxati", callback_data=callback_codec.encode("user_show_bots")))
+
+    admin_info = f"Admin ID: {admin_id}" if admin_id else "Admin ID: yo'q"
+    response_text = (f"✅ Bot muvaffaqiyatli yaratildi va ishga tushdi!\n"
+                     f"Token: {user_token[:15]}...\n"
+                     f"{admin_info}\n"
+                     f"📢 Majburiy kanallar: {channels_count} ta")
+    return response_text, markup
+
+def template_saved_screen(template_name):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🏠 Bosh menyu", callback_data=callback_codec.encode("admin_main_menu")))
+    return f"✅ '{template_name}' shabloni muvaffaqiyatli qo'shildi!", markup
+
+def template_exists_screen():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🏠 Bosh menyu", callback_data=callback_codec.encode("admin_main_menu")))
+    return "⚠️ Bu shablon allaqachon qo'shilgan!", markup
+
+def template_save_failed_screen():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("➕ Qayta yuklash", callback_data=callback_codec.encode("admin_add_template")))
+    markup.add(types.InlineKeyboardButton("🏠 Bosh menyu", callback_data=callback_codec.encode("admin_main_menu")))
+    return "❌ Shablonni saqlab bo'lmadi, qayta urinib ko'ring!", markup
+
+# ==================== KATALOG EKRANLARI KESHI ====================
+# Shablonlar katalogi kamdan-kam o'zgaradi, uning ekranlari esa eng ko'p bosiladi.
+# Tayyor matn va tugmalar JSON i katalog versiyasi va ekran kaliti (rol, shablon) bo'yicha
+# saqlanadi. Shablon qo'shilsa yoki o'chirilsa versiya oshadi va kesh tozalanadi.
+class ScreenCache:
+    """Katalog versiyasi bo'yicha (matn, tugmalar JSON) ekranlar keshi, LRU cheklovli"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.version = 0
+        self._entries = OrderedDict()  # (versiya, kalit) -> ekran
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        """
+        Keshdagi ekran yoki render() natijasi. None (katalog bo'sh, shablon topilmadi
+        yoki bazada xatolik) keshlanmaydi.
+        """
+        with self._lock:
+            version = self.version
+            screen = self._entries.get((version, key))
+            if screen is not None:
+                self._entries.move_to_end((version, key))
+                self.hits += 1
+            else:
+                self.misses += 1
+        screen_cache_lookups.inc('hit' if screen is not None else 'miss')
+        if screen is not None:
+            return screen
+
+        screen = render()
+        if screen is not None:
+            with self._lock:
+                # Chizish paytida katalog o'zgargan bo'lsa eskirgan ekranni saqlamaymiz
+                if self.version == version:
+                    self._entries[(version, key)] = screen
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return screen
+
+    def invalidate(self):
+        """Katalog o'zgardi: versiyani oshirish va eski ekranlarni tashlash"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+screen_cache = ScreenCache(SCREEN_CACHE_SIZE)
+screen_cache_lookups = metrics.counter(
+    "makerbot_screen_cache_lookups_total", "Katalog ekranlari keshiga murojaatlar", "result")
+
+def serialize_screen(screen):
+    """(matn, markup) -> (matn, tugmalar JSON): tayyor JSON Telegramga o'zgarishsiz yuboriladi"""
+    response_text, markup = screen
+    return response_text, markup.to_json()
+
+def load_admin_templates_screen():
+    """Admin shablonlar ro'yxati ekrani; shablonlar bo'lmasa None"""
+    def render():
+        bot_templates = load_bot_templates()
+        return serialize_screen(admin_templates_screen(bot_templates)) if bot_templates else None
+    return screen_cache.get(('admin_templates',), render)
+
+def load_catalog_screen(user_id):
+    """Foydalanuvchi katalogi ekrani (admin va oddiy foydalanuvchida orqaga tugmasi farq qiladi)"""
+    def render():
+        bot_templates = load_bot_templates()
+        return serialize_screen(user_catalog_screen(bot_templates, user_id)) if bot_templates else None
+    return screen_cache.get(('catalog', is_admin(user_id)), render)
+
+def load_template_screens(template_id):
+    """
+    Shablon oynasining ikki varianti: [botlari yo'q, botlari bor] foydalanuvchi uchun.
+    Shablon topilmasa None.
+    """
+    def render():
+        bot_templates = load_bot_templates(template_id=template_id)
+        if template_id not in bot_templates:
+            return None
+        return tuple(serialize_screen(user_template_screen(template_id, bot_templates[template_id], has_bots))
+                     for has_bots in (False, True))
+    return screen_cache.get(('template', template_id), render)
+
+# ==================== AMALLAR ====================
+# Handlerlardan qat'i nazar bir xil bajariladigan biznes amallari (bloklovchi: DB, fayllar, jarayonlar)
+def load_manage_bot_screen(bot_id, user_id):
+    """Bot boshqaruvi oynasini yuklash; bot topilmasa None"""
+    user_bots = load_user_bots(bot_id=bot_id, owner_id=bot_owner_filter(user_id))
+    if bot_id not in user_bots:
+        return None
+    bot_data = user_bots[bot_id]
+    bot_templates = load_bot_templates(template_id=bot_data['template_id'])
+    return manage_bot_screen(bot_id, bot_data, bot_templates[bot_data['template_id']]['name'])
+
+def load_top_bots_screen(sort_key):
+    """Eng ko'p sarflayotgan botlar oynasini yuklash"""
+    top = bot_usage_sampler.top(sort_key)
+    return top_bots_screen(top, load_bot_labels([bot_id for bot_id, _ in top]), sort_key)
+
+def add_channel_action(channel):
+    """Global kanal qo'shish va keshni yangilash; natija matnini qaytaradi"""
+    if add_global_channel(channel):
+        # Keshni yangilash
+        list_global_channels.cache_clear()
+        return f"✅ Kanal qo'shildi: {channel}"
+    return f"⚠️ Bu kanal allaqachon qo'shilgan: {channel}"
+
+def remove_channel_action(channel):
+    """Global kanalni o'chirish va keshni yangilash; natija matnini qaytaradi"""
+    if remove_global_channel(channel):
+        # Keshni yangilash
+        list_global_channels.cache_clear()
+        return f"✅ Kanal o'chirildi: {channel}"
+    return f"❌ Bu kanal topilmadi: {channel}"
+
+TEMPLATE_CHECK_SCRIPT = """
+import sys
+try:
+    with open(sys.argv[1], 'rb') as f:
+        compile(f.read(), sys.argv[2], 'exec')
+except SyntaxError as e:
+    sys.exit(f"{e.msg} ({e.filename}, {e.lineno}-qator)")
+except Exception as e:
+    sys.exit(str(e))
+"""
+
+def template_download_chunks(file_path):
+    """Telegram serveridagi faylni xotiraga to'liq yuklamasdan bo'laklab o'qish"""
+    if apihelper.FILE_URL is None:
+        url = "https://api.telegram.org/file/bot{0}/{1}".format(TOKEN, file_path)
+    else:
+        url = apihelper.FILE_URL.format(TOKEN, file_path)
+    with apihelper._get_req_session().get(url, proxies=apihelper.proxy, stream=True,
+                                          timeout=TEMPLATE_DOWNLOAD_TIMEOUT) as response:
+        if response.status_code != 200:
+            raise apihelper.ApiHTTPException('Download file', response)
+        yield from response.iter_content(TEMPLATE_DOWNLOAD_CHUNK)
+
+def check_template_syntax(path, filename):
+    """Shablonni alohida jarayonda kompilyatsiya qilib ko'rish; xato matni yoki None qaytaradi"""
+    try:
+        result = subprocess.run([sys.executable, "-c", TEMPLATE_CHECK_SCRIPT, path, filename],
+                                capture_output=True, text=True, timeout=TEMPLATE_CHECK_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return "tekshiruv vaqti tugadi"
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return lines[-1] if lines else f"tekshiruvchi {result.returncode} kod bilan tugadi"
+    return None
+
+def store_template_file(chunks, filename):
+    """
+    Yuklanayotgan shablonni bo'laklab diskka yozish, yozish davomida SHA-256 ni hisoblash.
+    Fayl mazmuni bo'yicha bot_templates/<sha256>.py ga joylanadi, shuning uchun bir xil
+    shablon bir marta saqlanadi. (yuklash ma'lumotlari, xato matni) qaytaradi.
+    """
+    remove_orphan_template_files()
+    digest = hashlib.sha256()
+    size = 0
+    fd, part_path = tempfile.mkstemp(dir="bot_templates", suffix=".part")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > TEMPLATE_MAX_SIZE:
+                    return None, f"⚠️ Fayl juda katta! Maksimal hajm: {TEMPLATE_MAX_SIZE // 1024} KB"
+                digest.update(chunk)
+                f.write(chunk)
+
+        content_hash = digest.hexdigest()
+        existing_name = find_template_by_hash(content_hash)
+        if existing_name is not None:
+            return None, f"⚠️ Bu shablon allaqachon qo'shilgan: {existing_name}"
+
+        # Bazaga yozishdan oldin sintaksisni tekshirish
+        error = check_template_syntax(part_path, filename)
+        if error:
+            return None, f"❌ Shablonda xato: {error}"
+
+        template_path = f"bot_templates/{content_hash}.py"
+        os.replace(part_path, template_path)
+    except Exception as e:
+        print(f"Shablon faylini saqlashda xato: {e}")
+        return None, "❌ Faylni yuklab bo'lmadi, qayta urinib ko'ring!"
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return {'path': template_path, 'filename': filename, 'content_hash': content_hash}, None
+
+TEMPLATE_FILE_PATTERN = re.compile(r'^[0-9a-f]{64}\.py$')
+
+def discard_template_upload(upload):
+    """Bazaga yozilmagan yuklangan shablon faylini o'chirish (shu mazmundagi shablon bo'lsa fayl uniki)"""
+    if find_template_by_hash(upload['content_hash']) is not None:
+        return
+    try:
+        os.remove(upload['path'])
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Yuklangan shablon faylini o'chirishda xato: {e}")
+
+def remove_orphan_template_files(max_age=CONVERSATION_TTL):
+    """
+    Nom so'rovi javobsiz qolgan (suhbat holati eskirgan yoki almashtirilgan) yuklashlarning
+    fayllarini o'chirish: bazada shablon yo'q va max_age soniyadan eski bo'lgan
+    bot_templates/<sha256>.py fayllari.
+    """
+    try:
+        cutoff = time.time() - max_age
+        candidates = {}
+        for name in os.listdir("bot_templates"):
+            path = os.path.join("bot_templates", name)
+            if TEMPLATE_FILE_PATTERN.match(name) and os.path.getmtime(path) < cutoff:
+                candidates[name[:-3]] = path
+        if not candidates:
+            return 0
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT content_hash FROM bot_templates WHERE content_hash = ANY(%s)",
+                            (list(candidates),))
+                for row in cur.fetchall():
+                    candidates.pop(row['content_hash'], None)
+        for path in candidates.values():
+            os.remove(path)
+        return len(candidates)
+    except Exception as e:
+        print(f"Eski shablon fayllarini tozalashda xato: {e}")
+        return 0
+
+def receive_template_upload(document):
+    """Telegramdan yuborilgan shablon hujjatini yuklab olish; (yuklash ma'lumotlari, xato matni)"""
+    if document.file_size and document.file_size > TEMPLATE_MAX_SIZE:
+        return None, f"⚠️ Fayl juda katta! Maksimal hajm: {TEMPLATE_MAX_SIZE // 1024} KB"
+    file_info = bot.get_file(document.file_id)
+    return store_template_file(template_download_chunks(file_info.file_path), document.file_name)
+
+def register_template(template_name, upload):
+    """
+    Shablonni bazaga saqlash va undan bot yaratish uchun kerakli fayllarni tayyorlash.
+    Shablon ID qaytaradi; shu mazmundagi shablon allaqachon saqlangan bo'lsa False,
+    bazada xato bo'lsa None (yuklangan fayl o'chiriladi).
+    """
+    template_id = str(uuid.uuid4())
+    template_path = upload['path']
+
+    # Shablonni ma'lumotlar bazasiga saqlash
+    saved = save_bot_template(template_id, template_name, template_path, upload['filename'],
+                              upload['content_hash'])
+    if saved is None:
+        discard_template_upload(upload)
+    if not saved:
+        return saved
+
+    # Barcha botlar uchun umumiy faylni bir marta tayyorlash
+    if BOT_FILE_MODE == "shared":
+        set_template_runtime_path(template_id, prepare_shared_template(template_id, template_path))
+
+    # Nusxa rejimi uchun token qo'yish rejasini oldindan tuzib qo'yish
+    try:
+        with open(template_path, 'r', encoding='utf-8') as f:
+            get_injection_plan(f.read())
+    except Exception as e:
+        print(f"Token qo'yish rejasini tuzishda xato: {e}")
+    return template_id
+
+def remove_template(template_id):
+    """Shablonni fayllari bilan o'chirish; topilmasa False"""
+    bot_templates = load_bot_templates(template_id=template_id)
+    if template_id not in bot_templates:
+        return False
+
+    template_data = bot_templates[template_id]
+    # Faylni o'chirish
+    try:
+        if os.path.exists(template_data['path']):
+            os.remove(template_data['path'])
+    except Exception as e:
+        print(f"Fayl o'chirishda xato: {e}")
+    remove_shared_template(template_id)
+
+    # Ma'lumotlar bazasidan o'chirish
+    delete_bot_template(template_id)
+    return True
+
+def parse_admin_id(text):
+    admin_id = text.strip()
+    if admin_id.lower() in ['yoq', 'yo\'q', 'no', 'none', '']:
+        return None
+    return admin_id
+
+def create_and_start_user_bot(template_id, user_token, admin_id, owner_id):
+    """Bot faylini yaratish, bazaga saqlash, kanallarni bog'lash va ishga tushirish"""
+    # Bot yaratish
+    result = create_user_bot_from_template(template_id, user_token, admin_id)
+    if not result:
+        return None, 0
+
+    # Botni global kanallari bilan birga ma'lumotlar bazasiga saqlash
+    global_channels = list_global_channels()
+    save_user_bot(result['id'], template_id, user_token, admin_id, result['path'],
+                  str(owner_id), result['launch_mode'], global_channels)
+
+    # Botni nazoratchi (yoki ishchi tugunlar) orqali ishga tushirish
+    place_bot(result['id'], result['path'],
+              bot_launch_env({'launch_mode': result['launch_mode'], 'token': user_token, 'admin_id': admin_id}))
+    return result, len(global_channels)
+
+def bot_lifecycle_action(action, bot_id, user_id):
+    """
+    Botni to'xtatish/ishga tushirish/qayta ishga tushirish/o'chirish.
+    (callback javobi matni, yangilangan boshqaruv oynasi yoki None) qaytaradi.
+    """
+    user_bots = load_user_bots(bot_id=bot_id, owner_id=bot_owner_filter(user_id))
+    if bot_id not in user_bots:
+        return "❌ Bot topilmadi!", None
+    bot_data = user_bots[bot_id]
+
+    if action == 'stop':
+        try:
+            set_bot_desired_state(bot_id, 'stopped')
+            unplace_bot(bot_id)
+            answer = "✅ Bot to'xtatildi!"
+            bot_data['desired_state'] = 'stopped'
+        except Exception as e:
+            print(f"Bot to'xtatishda xato: {e}")
+            return "⚠️ Xatolik yuz berdi!", None
+    elif action in ('start', 'restart'):
+        set_bot_desired_state(bot_id, 'running')
+        if place_bot(bot_id, bot_data['path'], bot_launch_env(bot_data), restart=action == 'restart'):
+            answer = "✅ Bot ishga tushirildi!" if action == 'start' else "✅ Bot qayta ishga tushirildi!"
+        else:
+            answer = "⚠️ Bot ishga tushmadi, qayta urinib ko'riladi"
+        bot_data['desired_state'] = 'running'
+    elif action == 'delete':
+        try:
+            # Jarayonni to'xtatish
+            unplace_bot(bot_id, remove=True)
+            # Faylni o'chirish (umumiy shablon fayli boshqa botlarga ham kerak)
+            if bot_data['launch_mode'] == 'copy' and os.path.exists(bot_data['path']):
+                os.remove(bot_data['path'])
+            # Ma'lumotlar bazasidan o'chirish
+            delete_user_bot(bot_id)
+            return "✅ Bot o'chirildi!", None
+        except Exception as e:
+            print(f"Bot o'chirishda xato: {e}")
+            return f"❌ Xatolik: {str(e)}", None
+    else:
+        raise ValueError(f"Noma'lum amal: {action}")
+
+    bot_templates = load_bot_templates(template_id=bot_data['template_id'])
+    return answer, manage_bot_screen(bot_id, bot_data, bot_templates[bot_data['template_id']]['name'])
+
+# ==================== ADMIN PANEL ====================
+@bot.message_handler(commands=['start'])
+def start(message):
+    user_id = str(message.from_user.id)
+
+    # Global majburiy kanallarni olish
+    global_channels = list_global_channels()
+
+    # Majburiy obuna tekshiruvi
+    if global_channels and not check_subscription(bot, user_id, global_channels):
+        response_text, markup = subscription_required_screen(global_channels)
+        bot.reply_to(message, response_text, parse_mode='HTML', reply_markup=markup)
+        return
+
+    # Admin uchun maxsus menyular
+    if is_admin(user_id):
+        show_admin_menu(message)
+    else:
+        show_user_menu(message)
+
+@bot.message_handler(commands=['addchannel'])
+def add_channel_command(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    bot.register_next_step_handler_by_chat_id(message.chat.id, process_add_channel)
+    bot.reply_to(message, "🆔 Qo'shish uchun kanal username yoki ID sini kiriting (@username yoki -100123456789 formatida):")
+
+@conversation_step
+def process_add_channel(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    bot.reply_to(message, add_channel_action(message.text.strip()))
+
+@bot.message_handler(commands=['removechannel'])
+def remove_channel_command(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    bot.register_next_step_handler_by_chat_id(message.chat.id, process_remove_channel)
+    bot.reply_to(message, "🆔 O'chirish uchun kanal username yoki ID sini kiriting:")
+
+@conversation_step
+def process_remove_channel(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    bot.reply_to(message, remove_channel_action(message.text.strip()))
+
+@bot.message_handler(commands=['listchannels'])
+def list_channels_command(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    bot.reply_to(message, channels_text(list_global_channels()))
+
+@bot.message_handler(commands=['stats'])
+def stats_command(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Siz admin emassiz!")
+        return
+
+    bot.reply_to(message, stats_text())
+
+def show_admin_menu(message):
+    """Admin menyusi"""
+    response_text, markup = admin_menu_screen()
+    bot.send_message(message.chat.id, response_text, reply_markup=markup)
+
+def show_user_menu(message):
+    """Oddiy foydalanuvchi menyusi"""
+    response_text, markup = user_menu_screen()
+    bot.send_message(message.chat.id, response_text, reply_markup=markup)
+
+@callback_router.route("admin_top_bots")
+def admin_top_bots(call, sort_key):
+    response_text, markup = load_top_bots_screen(sort_key)
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id)
+
+# ==================== MAJBURIY OBUNA MENYUSI ====================
+@callback_router.route("admin_subscription_menu")
+def admin_subscription_menu(call):
+    response_text, markup = subscription_menu_screen()
     safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
     safe_answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_clear_channels" and str(call.from_user.id) == ADMIN_ID)
+@callback_router.route("admin_add_channel")
+def admin_add_channel_callback(call):
+    bot.register_next_step_handler_by_chat_id(call.message.chat.id, admin_process_add_channel)
+    bot.send_message(call.message.chat.id, "🆔 Qo'shish uchun kanal username yoki ID sini kiriting (@username yoki -100123456789 formatida):")
+    safe_answer_callback_query(call.id)
+
+@conversation_step
+def admin_process_add_channel(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    bot.reply_to(message, add_channel_action(message.text.strip()))
+
+    # Menyuga qaytish
+    show_admin_menu(message)
+
+@callback_router.route("admin_list_channels")
+def admin_list_channels_callback(call):
+    response_text = channels_text(list_global_channels())
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id,
+                           reply_markup=back_markup("admin_subscription_menu"))
+    safe_answer_callback_query(call.id)
+
+@callback_router.route("admin_clear_channels")
 def admin_clear_channels_callback(call):
     clear_global_channels()
     safe_answer_callback_query(call.id, "✅ Barcha kanallar o'chirildi!")
-    
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data="admin_subscription_menu"))
-    
-    safe_edit_message_text("📢 Majburiy obuna boshqaruvi:", call.message.chat.id, call.message.message_id, reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data == "check_subscription")
+    safe_edit_message_text("📢 Majburiy obuna boshqaruvi:", call.message.chat.id, call.message.message_id,
+                           reply_markup=back_markup("admin_subscription_menu"))
+
+@callback_router.route("check_subscription")
 def check_subscription_callback(call):
     user_id = call.from_user.id
     global_channels = list_global_channels()
-    
-    if check_subscription(bot, user_id, global_channels):
+
+    if check_subscription(bot, user_id, global_channels, recheck_negative=True):
         safe_edit_message_text(
             "✅ Barcha kanallarga obuna bo'ldingiz! Endi botdan foydalanishingiz mumkin.",
-            call.message.chat.id, 
+            call.message.chat.id,
             call.message.message_id
         )
         # Foydalanuvchi menyusini ko'rsatish
-        if str(user_id) == ADMIN_ID:
+        if is_admin(user_id):
             show_admin_menu(call.message)
         else:
             show_user_menu(call.message)
     else:
         safe_answer_callback_query(call.id, "❌ Hali barcha kanallarga obuna bo'lmadingiz!", show_alert=True)
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_main_menu" and str(call.from_user.id) == ADMIN_ID)
-def admin_main_menu_callback(call):
-    show_admin_menu(call.message)
-    safe_answer_callback_query(call.id)
+@callback_router.route("admin_main_menu")
+def admin_main_menu_callback(call):
+    show_admin_menu(call.message)
+    safe_answer_callback_query(call.id)
+
+# ==================== ADMIN: SHABLONLARNI QO'SHISH ====================
+@callback_router.route("admin_add_template")
+def admin_add_template_handler(call):
+    bot.register_next_step_handler_by_chat_id(call.message.chat.id, admin_handle_template_file)
+    bot.send_message(call.message.chat.id, "📁 Bot shablon faylini yuboring (.py formatda):")
+    safe_answer_callback_query(call.id)
+
+@conversation_step
+def admin_handle_template_file(message):
+    if not is_admin(message.from_user.id):
+        return
+
+    if not message.document or not message.document.file_name.endswith('.py'):
+        bot.register_next_step_handler_by_chat_id(message.chat.id, admin_handle_template_file)
+        bot.send_message(message.chat.id, "⚠️ Iltimos, faqat .py faylini yuboring!")
+        return
+
+    # Faylni bo'laklab yuklab olib saqlash
+    upload, error = receive_template_upload(message.document)
+    if error:
+        bot.register_next_step_handler_by_chat_id(message.chat.id, admin_handle_template_file)
+        bot.send_message(message.chat.id, error)
+        return
+
+    bot.register_next_step_handler_by_chat_id(message.chat.id, admin_get_template_name, upload)
+    bot.send_message(message.chat.id, "📝 Shablon uchun nom kiriting:")
+
+@conversation_step
+def admin_get_template_name(message, upload):
+    if not is_admin(message.from_user.id):
+        return
+
+    template_name = message.text
+    template_id = register_template(template_name, upload)
+    if template_id is None:
+        response_text, markup = template_save_failed_screen()
+    elif template_id is False:
+        response_text, markup = template_exists_screen()
+    else:
+        response_text, markup = template_saved_screen(template_name)
+    bot.send_message(message.chat.id, response_text, reply_markup=markup)
+
+# ==================== ADMIN: SHABLONLAR RO'YXATI ====================
+@callback_router.route("admin_list_templates")
+def admin_list_templates(call, answer=None):
+    screen = load_admin_templates_screen()
+    if screen is None:
+        bot.send_message(call.message.chat.id, "📭 Hozircha hech qanday shablon qo'shilmagan.")
+        safe_answer_callback_query(call.id, answer)
+        return
+
+    response_text, markup = screen
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id, answer)
+
+@callback_router.route("admin_view_template")
+def admin_view_template(call, template_id):
+    bot_templates = load_bot_templates(template_id=template_id)
+
+    if template_id not in bot_templates:
+        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+        return
+
+    response_text, markup = admin_template_screen(template_id, bot_templates[template_id])
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id)
+
+@callback_router.route("admin_delete_template")
+def admin_delete_template(call, template_id):
+    if remove_template(template_id):
+        # Orqaga qaytish
+        admin_list_templates(call, "✅ Shablon o'chirildi!")
+    else:
+        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+
+# ==================== FOYDALANUVCHI: BOTLAR MENYUSI ====================
+@callback_router.route("user_show_bots")
+def user_show_bots(call):
+    screen = load_catalog_screen(call.from_user.id)
+    if screen is None:
+        bot.send_message(call.message.chat.id, "📭 Hozircha hech qanday bot shabloni mavjud emas.")
+        safe_answer_callback_query(call.id)
+        return
+
+    response_text, markup = screen
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id)
+
+@callback_router.route("user_select_template")
+def user_select_template(call, template_id):
+    screens = load_template_screens(template_id)
+
+    if screens is None:
+        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+        return
+
+    my_bots, _, _ = load_owner_bots_page(call.from_user.id, template_id=template_id, limit=1)
+    response_text, markup = screens[bool(my_bots)]
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id)
+
+@callback_router.route("user_create_bot")
+def user_create_bot(call, template_id):
+    # Avval majburiy obunani tekshirish
+    user_id = str(call.from_user.id)
+    global_channels = list_global_channels()
+
+    if global_channels and not check_subscription(bot, user_id, global_channels):
+        response_text, markup = subscription_required_screen(global_channels, "Bot yaratish")
+        bot.send_message(call.message.chat.id, response_text, parse_mode='HTML', reply_markup=markup)
+        safe_answer_callback_query(call.id)
+        return
+
+    bot_templates = load_bot_templates(template_id=template_id)
+
+    if template_id not in bot_templates:
+        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+        return
+
+    # Avval token so'raymiz
+    bot.register_next_step_handler_by_chat_id(call.message.chat.id, user_get_bot_token, template_id)
+    bot.send_message(call.message.chat.id, "🔑 Yangi bot uchun token kiriting:")
+    safe_answer_callback_query(call.id)
+
+@conversation_step
+def user_get_bot_token(message, template_id):
+    user_token = message.text.strip()
+
+    # Endi admin ID so'raymiz
+    bot.register_next_step_handler_by_chat_id(message.chat.id, user_get_admin_id, template_id, user_token)
+    bot.send_message(message.chat.id, "🆔 Yangi bot uchun admin ID kiriting (agar kerak bo'lmasa 'yoq' deb yozing):")
+
+@conversation_step
+def user_get_admin_id(message, template_id, user_token):
+    admin_id = parse_admin_id(message.text)
+    result, channels_count = create_and_start_user_bot(template_id, user_token, admin_id, message.from_user.id)
+
+    if result:
+        response_text, markup = bot_created_screen(result, user_token, admin_id, channels_count)
+        bot.send_message(message.chat.id, response_text, reply_markup=markup)
+    else:
+        bot.send_message(message.chat.id, "❌ Xatolik yuz berdi! Bot yaratilmadi.")
+
+# ==================== FOYDALANUVCHI: MENING BOTLARIM ====================
+@callback_router.route("user_my_bots")
+def user_my_bots(call, view, target_id):
+    my_bots, has_prev, has_next = load_owner_bots_page(call.from_user.id, **my_bots_page_args(view, target_id))
+
+    if not my_bots:
+        bot.send_message(call.message.chat.id, "📭 Siz hali bot yaratmagansiz.")
+        safe_answer_callback_query(call.id)
+        return
+
+    response_text, markup = my_bots_screen(my_bots, has_prev, has_next)
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id)
+
+@callback_router.route("user_manage_bot")
+def user_manage_bot(call, bot_id):
+    screen = load_manage_bot_screen(bot_id, call.from_user.id)
+
+    if screen is None:
+        safe_answer_callback_query(call.id, "❌ Bot topilmadi!")
+        return
+
+    response_text, markup = screen
+    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    safe_answer_callback_query(call.id)
+
+def answer_bot_lifecycle(call, action, bot_id):
+    answer, screen = bot_lifecycle_action(action, bot_id, call.from_user.id)
+    safe_answer_callback_query(call.id, answer)
+    if screen is not None:
+        response_text, markup = screen
+        safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+
+@callback_router.route("user_stop_bot")
+def user_stop_bot(call, bot_id):
+    answer_bot_lifecycle(call, 'stop', bot_id)
+
+@callback_router.route("user_start_bot")
+def user_start_bot(call, bot_id):
+    answer_bot_lifecycle(call, 'start', bot_id)
+
+@callback_router.route("user_restart_bot")
+def user_restart_bot(call, bot_id):
+    answer_bot_lifecycle(call, 'restart', bot_id)
+
+@callback_router.route("user_delete_bot")
+def user_delete_bot(call, bot_id):
+    answer_bot_lifecycle(call, 'delete', bot_id)
+
+@callback_router.route("user_back_to_main")
+def user_back_to_main(call):
+    show_user_menu(call.message)
+    safe_answer_callback_query(call.id)
+
+# ==================== UNIVERSAL TOKEN, ADMIN ID VA KANALLAR QO'LLAB-QUVVATLASH ====================
+def inject_token_and_admin_id_regex(content, token, admin_id=None):
+    """
+    Har qanday token, admin ID funksiyasini qo'llab-quvvatlaydi (regex usuli).
+    Faqat tokenize qila olinmaydigan shablonlar uchun zaxira sifatida ishlatiladi.
+    """
+
+    # 1. Oddiy TOKEN = "..." usuli
+    content = re.sub(r'(TOKEN\s*=\s*["\']).*?(["\'])', f'TOKEN = "{token}"', content, flags=re.IGNORECASE)
+
+    # 2. BOT_TOKEN = "..." usuli
+    content = re.sub(r'(BOT_TOKEN\s*=\s*["\']).*?(["\'])', f'BOT_TOKEN = "{token}"', content, flags=re.IGNORECASE)
+
+    # 3. API_TOKEN = "..." usuli
+    content = re.sub(r'(API_TOKEN\s*=\s*["\']).*?(["\'])', f'API_TOKEN = "{token}"', content, flags=re.IGNORECASE)
+
+    # 4. token = "..." usuli (kichik harf)
+    content = re.sub(r'(token\s*=\s*["\']).*?(["\'])', f'token = "{token}"', content)
+
+    # 5. BOT_API_TOKEN = "..." usuli
+    content = re.sub(r'(BOT_API_TOKEN\s*=\s*["\']).*?(["\'])', f'BOT_API_TOKEN = "{token}"', content, flags=re.IGNORECASE)
+
+    # 6. ADMIN_ID = ... usullari
+    if admin_id:
+        # ADMIN_ID = "..." usuli
+        content = re.sub(r"(ADMIN_ID\s*=\s*['\"]).*?(['\"])", f"ADMIN_ID = '{admin_id}'", content, flags=re.IGNORECASE)
+        # ADMIN_ID = ... (raqam) usuli
+        content = re.sub(r'(ADMIN_ID\s*=\s*)\d+', f'ADMIN_ID = {admin_id}', content, flags=re.IGNORECASE)
+        # admin_id = "..." usuli
+        content = re.sub(r"(admin_id\s*=\s*['\"]).*?(['\"])", f"admin_id = '{admin_id}'", content)
+    else:
+        # Agar admin_id berilmagan bo'lsa, mavjud admin_id larni o'chiramiz
+        content = re.sub(r'^.*ADMIN_ID\s*=.*$', '', content, flags=re.MULTILINE | re.IGNORECASE)
+        content = re.sub(r'^.*admin_id\s*=.*$', '', content, flags=re.MULTILINE)
+
+    # 7. Agar hech qanday token topilmasa, yangi TOKEN qo'shamiz
+    if not re.search(r'(TOKEN|BOT_TOKEN|API_TOKEN|token|BOT_API_TOKEN)\s*=', content, re.IGNORECASE):
+        # import qatoridan keyin qo'shamiz
+        import_match = re.search(r'^.*import.*$', content, re.MULTILINE)
+        if import_match:
+            insert_pos = import_match.end() + 1
+            content = content[:insert_pos] + f'\nTOKEN = "{token}"\n' + content[insert_pos:]
+        else:
+            # Agar import topilmasa, fayl boshiga qo'shamiz
+            content = f'TOKEN = "{token}"\n' + content
+
+    content = f'TOKEN = "{token}"\n' + content
+
+    # 8. Agar admin_id kerak bo'lsa va topilmasa, qo'shamiz
+    if admin_id and not re.search(r'(ADMIN_ID|admin_id)\s*=', content, re.IGNORECASE):
+        # import qatoridan keyin qo'shamiz
+        import_match = re.search(r'^.*import.*$', content, re.MULTILINE)
+        if import_match:
+            insert_pos = import_match.end() + 1
+            content = content[:insert_pos] + f"\nADMIN_ID = '{admin_id}'\n" + content[insert_pos:]
+        else:
+            content = f"ADMIN_ID = '{admin_id}'\n" + content
+
+    return content
+
+class InjectionPlan:
+    """Shablondagi token va admin ID qiymatlarining aniq o'rinlari (belgi indekslari)"""
+
+    def __init__(self):
+        self.token_spans = []        # (boshi, oxiri) - token satr literallari
+        self.admin_spans = []        # (boshi, oxiri, tur) - admin ID qiymatlari, tur: 'str' yoki 'num'
+        self.admin_line_spans = []   # (boshi, oxiri) - admin ID qatorlari (qiymati literal bo'lmasa o'chiriladi)
+        self.import_end = None       # Birinchi import qatoridan keyingi o'rin
+
+    @property
+    def has_token(self):
+        return bool(self.token_spans)
+
+    @property
+    def has_admin(self):
+        return bool(self.admin_line_spans)
+
+
+_injection_plans = OrderedDict()
+_injection_plans_lock = threading.Lock()
+
+def build_injection_plan(content):
+    """Shablonni tokenize qilib, token va admin ID o'rinlarini topish"""
+    line_starts = [0]
+    for line in content.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+
+    def offset(position):
+        row, col = position
+        return line_starts[row - 1] + col
+
+    def line_span(row):
+        line_end = line_starts[row]
+        line = content[line_starts[row - 1]:line_end]
+        return line_starts[row - 1], line_end - (len(line) - len(line.rstrip('\r\n')))
+
+    plan = InjectionPlan()
+    significant = [tok for tok in tokenize.generate_tokens(io.StringIO(content).readline)
+                   if tok.type not in (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT)]
+    for i, tok in enumerate(significant):
+        if tok.type != tokenize.NAME:
+            continue
+        if tok.string == 'import' and plan.import_end is None:
+            plan.import_end = line_starts[tok.start[0]]
+            continue
+        if i + 2 >= len(significant) or significant[i + 1].string != '=':
+            continue
+        name = tok.string.lower()
+        value = significant[i + 2]
+        if name.endswith('token') and value.type == tokenize.STRING:
+            plan.token_spans.append((offset(value.start), offset(value.end)))
+        elif name.endswith('admin_id'):
+            plan.admin_line_spans.append(line_span(tok.start[0]))
+            if value.type in (tokenize.STRING, tokenize.NUMBER):
+                kind = 'str' if value.type == tokenize.STRING else 'num'
+                plan.admin_spans.append((offset(value.start), offset(value.end), kind))
+    return plan
+
+def get_injection_plan(content):
+    """Shablon mazmuni xeshi bo'yicha keshlangan rejani qaytarish"""
+    key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    with _injection_plans_lock:
+        plan = _injection_plans.get(key)
+        if plan is not None:
+            _injection_plans.move_to_end(key)
+            return plan
+    plan = build_injection_plan(content)
+    with _injection_plans_lock:
+        _injection_plans[key] = plan
+        while len(_injection_plans) > INJECTION_PLAN_CACHE_SIZE:
+            _injection_plans.popitem(last=False)
+    return plan
+
+def apply_injection_plan(plan, content, token, admin_id=None):
+    """Reja bo'yicha token va admin ID ni bitta o'tishda joylashtirish"""
+    edits = [(start, end, f'"{token}"') for start, end in plan.token_spans]
+    if admin_id:
+        for start, end, kind in plan.admin_spans:
+            edits.append((start, end, f"'{admin_id}'" if kind == 'str' else str(admin_id)))
+    else:
+        # Admin berilmagan: literal qiymat None ga almashadi (umumiy shablondagi kabi), qolgan qatorlar o'chiriladi
+        edits.extend((start, end, 'None') for start, end, kind in plan.admin_spans)
+        edits.extend((start, end, '') for start, end in plan.admin_line_spans
+                     if not any(start <= value_start < end for value_start, _, _ in plan.admin_spans))
+
+    # Import qatoridan keyin qo'shiladiganlar (admin ID tokendan oldin turadi)
+    insert_pos = plan.import_end
+    if admin_id and not plan.has_admin and insert_pos is not None:
+        edits.append((insert_pos, insert_pos, f"\nADMIN_ID = '{admin_id}'\n"))
+    if not plan.has_token and insert_pos is not None:
+        edits.append((insert_pos, insert_pos, f'\nTOKEN = "{token}"\n'))
+
+    prefix = []
+    if admin_id and not plan.has_admin and insert_pos is None:
+        prefix.append(f"ADMIN_ID = '{admin_id}'\n")
+    prefix.append(f'TOKEN = "{token}"\n')
+    if not plan.has_token and insert_pos is None:
+        prefix.append(f'TOKEN = "{token}"\n')
+
+    pieces = prefix
+    position = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+        pieces.append(content[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(content[position:])
+    return ''.join(pieces)
+
+def inject_token_and_admin_id_universal(content, token, admin_id=None):
+    """
+    Har qanday token, admin ID funksiyasini qo'llab-quvvatlaydi
+    """
+    try:
+        plan = get_injection_plan(content)
+    except (tokenize.TokenError, SyntaxError) as e:
+        print(f"Shablonni tokenize qilib bo'lmadi, regex usuliga o'tamiz: {e}")
+        return inject_token_and_admin_id_regex(content, token, admin_id)
+    return apply_injection_plan(plan, content, token, admin_id)
+
+# ==================== UMUMIY SHABLON FAYLI (RUNTIME KONFIGURATSIYA) ====================
+BOT_TOKEN_ENV = "MAKER_BOT_TOKEN"
+BOT_ADMIN_ID_ENV = "MAKER_ADMIN_ID"
+TOKEN_VARIABLE_NAMES = {'token', 'bot_token', 'api_token', 'bot_api_token'}
+ADMIN_VARIABLE_NAMES = {'admin_id'}
+TOKEN_LITERAL_PATTERN = re.compile(r'^\d+:[A-Za-z0-9_-]{30,}$')
+
+class RuntimeConfigTransformer(ast.NodeTransformer):
+    """Shablondagi token va admin ID qiymatlarini muhit o'zgaruvchilaridan o'qiydigan ifodalarga almashtiradi"""
+
+    def __init__(self):
+        self.token_found = False
+
+    @staticmethod
+    def _env_expression(source):
+        return ast.parse(source, mode='eval').body
+
+    def _token_expression(self):
+        self.token_found = True
+        return self._env_expression(f'__import__("os").environ["{BOT_TOKEN_ENV}"]')
+
+    def _admin_expression(self, original):
+        # Admin berilmagan bo'lsa None: shablon muallifining ID si boshqa botlarga o'tib qolmasligi kerak
+        if isinstance(original.value, int):
+            return self._env_expression(
+                f'(lambda v: int(v) if v else None)(__import__("os").environ.get("{BOT_ADMIN_ID_ENV}"))')
+        return self._env_expression(f'__import__("os").environ.get("{BOT_ADMIN_ID_ENV}") or None')
+
+    def _replace_value(self, name, value):
+        if not isinstance(value, ast.Constant):
+            return value
+        name = name.lower()
+        if name in TOKEN_VARIABLE_NAMES and isinstance(value.value, str):
+            return self._token_expression()
+        if name in ADMIN_VARIABLE_NAMES and isinstance(value.value, (str, int)) and not isinstance(value.value, bool):
+            return self._admin_expression(value)
+        return value
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            node.value = self._replace_value(node.targets[0].id, node.value)
+        return node
+
+    def visit_AnnAssign(self, node):
+        self.generic_visit(node)
+        if isinstance(node.target, ast.Name) and node.value is not None:
+            node.value = self._replace_value(node.target.id, node.value)
+        return node
+
+    def visit_keyword(self, node):
+        self.generic_visit(node)
+        if node.arg is not None:
+            node.value = self._replace_value(node.arg, node.value)
+        return node
+
+    def visit_Constant(self, node):
+        # telebot.TeleBot("123:ABC...") kabi to'g'ridan-to'g'ri yozilgan tokenlar
+        if isinstance(node.value, str) and TOKEN_LITERAL_PATTERN.match(node.value):
+            return self._token_expression()
+        return node
+
+def prepare_shared_template(template_id, template_path):
+    """
+    Shablondan barcha botlar uchun umumiy, oldindan kompilyatsiya qilingan fayl tayyorlash.
+    Kompilyatsiya qilingan fayl yo'lini, shablon token topilmasa '' qaytaradi.
+    """
+    try:
+        with open(template_path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=template_path)
+    except Exception as e:
+        print(f"Shablonni tahlil qilishda xato: {e}")
+        return ''
+
+    transformer = RuntimeConfigTransformer()
+    tree = ast.fix_missing_locations(transformer.visit(tree))
+    if not transformer.token_found:
+        return ''
+
+    source_path = f"bot_templates/{template_id}.runtime.py"
+    compiled_path = f"bot_templates/{template_id}.runtime.pyc"
+    try:
+        with open(source_path, 'w', encoding='utf-8') as f:
+            f.write(ast.unparse(tree))
+        py_compile.compile(source_path, cfile=compiled_path, doraise=True)
+    except Exception as e:
+        print(f"Umumiy shablonni kompilyatsiya qilishda xato: {e}")
+        return ''
+    return compiled_path
+
+def ensure_shared_template(template_id, template_data):
+    """Shablonning umumiy faylini qaytarish (kerak bo'lsa bir marta tayyorlash)"""
+    runtime_path = template_data.get('runtime_path')
+    if runtime_path is None or (runtime_path and not os.path.exists(runtime_path)):
+        runtime_path = prepare_shared_template(template_id, template_data['path'])
+        set_template_runtime_path(template_id, runtime_path)
+    return runtime_path
+
+def remove_shared_template(template_id):
+    """Shablonning umumiy fayllarini o'chirish"""
+    for path in (f"bot_templates/{template_id}.runtime.py", f"bot_templates/{template_id}.runtime.pyc"):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"Fayl o'chirishda xato: {e}")
+
+def bot_launch_env(bot_data):
+    """Umumiy shablondan ishlovchi bot uchun muhit o'zgaruvchilari"""
+    if bot_data.get('launch_mode') != 'shared':
+        return None
+    env = {BOT_TOKEN_ENV: bot_data['token']}
+    if bot_data.get('admin_id'):
+        env[BOT_ADMIN_ID_ENV] = str(bot_data['admin_id'])
+    return env
+
+# ==================== BOT YARATISH FUNKSIYASI ====================
+def create_user_bot_from_template(template_id, user_token, admin_id=None):
+    """Shablondan yangi bot faylini yaratish (ishga tushirish nazoratchi orqali)"""
+    bot_templates = load_bot_templates(template_id=template_id)
+    
+    if template_id not in bot_templates:
+        return None
+
+    return render_user_bot(template_id, bot_templates[template_id], user_token, admin_id)
+
+def render_user_bot(template_id, template_data, user_token, admin_id=None, template_content=None):
+    """
+    Yuklangan shablon ma'lumotlari bo'yicha bot faylini tayyorlash.
+    template_content berilsa shablon fayli qayta o'qilmaydi (ommaviy yaratishda).
+    """
+    # Umumiy shablon rejimi: alohida fayl yozilmaydi
+    if BOT_FILE_MODE == "shared":
+        runtime_path = ensure_shared_template(template_id, template_data)
+        if runtime_path:
+            return {
+                'path': runtime_path,
+                'id': str(uuid.uuid4()),
+                'launch_mode': 'shared'
+            }
+
+    # Template faylni o'qish
+    if template_content is None:
+        try:
+            with open(template_data['path'], 'r', encoding='utf-8') as f:
+                template_content = f.read()
+        except Exception as e:
+            print(f"Shablon faylni o'qishda xato: {e}")
+            return None
+
+    # Universal token, admin ID qo'yish
+    updated_content = inject_token_and_admin_id_universal(template_content, user_token, admin_id)
+
+    # Yangi bot faylini yaratish
+    bot_instance_id = str(uuid.uuid4())
+    bot_path = f"user_bots/{bot_instance_id}.py"
+
+    try:
+        with open(bot_path, 'w', encoding='utf-8') as f:
+            f.write(updated_content)
+    except Exception as e:
+        print(f"Yangi bot faylini yaratishda xato: {e}")
+        return None
+
+    return {
+        'path': bot_path,
+        'id': bot_instance_id,
+        'launch_mode': 'copy'
+    }
+
+# ==================== BOT JARAYONLARI NAZORATCHISI ====================
+class SupervisedBot:
+    """Nazoratchi kuzatayotgan bitta bot jarayoni"""
+
+    def __init__(self, bot_id, path, env=None):
+        self.bot_id = bot_id
+        self.path = path
+        self.env = env
+        self.process = None
+        self.state = 'stopped'
+        self.desired_state = 'running'
+        self.restart_count = 0
+        self.failures = 0          # Ketma-ket qulashlar soni
+        self.started_at = None
+        self.next_start = None
+
+
+class BotSupervisor:
+    """Foydalanuvchi botlari jarayonlarini ishga tushiradi, kuzatadi va qayta yoqadi"""
+
+    def __init__(self, node_id=None):
+        self.node_id = node_id       # Ishchi tugunda: faqat shu tugun lease qilgan botlar
+        self._bots = {}
+        self._lock = threading.RLock()
+        self._fence_generation = 0
+        self._fenced = {}            # bot ID -> remove_many chaqirilgandagi avlod
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_sync = time.monotonic()
+        self._forkserver = None
+        self._forkserver_lock = threading.Lock()
+
+    def _get_forkserver(self):
+        """Zigotani kerak bo'lganda ishga tushirish (o'lgan bo'lsa qayta yoqish)"""
+        from bot_zygote import ForkServerClient
+
+        with self._forkserver_lock:
+            if self._forkserver is None or not self._forkserver.alive():
+                # Ishchi tugunda zigota bolalari tugun bilan birga o'ladi (lease boshqaga o'tganda
+                # eski jarayon tokenni so'rashda davom etmasin)
+                self._forkserver = ForkServerClient(FORKSERVER_PRELOAD, kill_children=self.node_id is not None)
+                self._forkserver.start()
+            return self._forkserver
+
+    def _spawn(self, entry):
+        """Bot faylini alohida jarayonda ishga tushirish"""
+        limits = bot_resource_limits()
+        if BOT_LAUNCH_MODE == "forkserver":
+            try:
+                # Chegaralar zigota bolasida bot kodi boshlanishidan oldin qo'yiladi
+                return self._get_forkserver().spawn(entry.path, env=entry.env, limits=limits)
+            except Exception as e:
+                print(f"Zigota orqali ishga tushirib bo'lmadi, oddiy usulga o'tamiz: {e}")
+        env = {**os.environ, **entry.env} if entry.env else None
+        return subprocess.Popen(bot_launch_command(entry.path, limits, parent_death=self.node_id is not None), env=env)
+
+    def _launch(self, entry):
+        try:
+            process = self._spawn(entry)
+        except Exception as e:
+            print(f"Botni ishga tushirishda xato: {e}")
+            self._schedule_restart(entry)
+            return False
+        with self._lock:
+            # Yoqish paytida bot to'xtatilgan, nazoratdan chiqarilgan yoki boshqa oqim uni
+            # allaqachon yoqib ulgurgan bo'lsa ikkinchi jarayon qolmasin (bitta token - bitta jarayon)
+            stale = (self._bots.get(entry.bot_id) is not entry or entry.desired_state != 'running'
+                     or (entry.process is not None and entry.process.poll() is None))
+            if not stale:
+                entry.process = process
+                entry.state = 'running'
+                entry.started_at = time.monotonic()
+                entry.next_start = None
+        if stale:
+            self._terminate(process)
+            return False
+        update_bot_process_state(entry.bot_id, 'running', process.pid, entry.restart_count)
+        return True
+
+    def _schedule_restart(self, entry):
+        """Qulagan botni eksponensial kutish bilan qayta yoqishni rejalashtirish"""
+        with self._lock:
+            if entry.started_at is not None and time.monotonic() - entry.started_at >= SUPERVISOR_STABLE_AFTER:
+                entry.failures = 0
+            entry.failures += 1
+            entry.restart_count += 1
+            delay = min(SUPERVISOR_BACKOFF_BASE * 2 ** (entry.failures - 1), SUPERVISOR_BACKOFF_MAX)
+            entry.process = None
+            entry.started_at = None
+            entry.state = 'backoff'
+            entry.next_start = time.monotonic() + delay
+        print(f"Bot {entry.bot_id} to'xtab qoldi, {delay} soniyadan keyin qayta yoqiladi")
+        update_bot_process_state(entry.bot_id, 'backoff', None, entry.restart_count)
+
+    def _terminate(self, process):
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=SUPERVISOR_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def start(self, bot_id, path, env=None, fence_generation=None):
+        """
+        Botni ishga tushirish (allaqachon ishlayotgan bo'lsa hech narsa qilmaydi).
+        fence_generation - sync ro'yxati o'qilgan avlod: undan keyin remove_many
+        chiqargan bot yoqilmaydi.
+        """
+        with self._lock:
+            if fence_generation is not None and self._fenced.get(bot_id, 0) > fence_generation:
+                return False
+            entry = self._bots.get(bot_id)
+            if entry is None:
+                entry = self._bots[bot_id] = SupervisedBot(bot_id, path, env)
+            entry.path = path
+            entry.env = env
+            entry.desired_state = 'running'
+            if entry.process is not None and entry.process.poll() is None:
+                return True
+            # Boshqa oqim (masalan NOTIFY dan keyingi sync) allaqachon yoqmoqda
+            if entry.state == 'starting':
+                return True
+            entry.failures = 0
+            entry.state = 'starting'
+        return self._launch(entry)
+
+    def stop(self, bot_id):
+        """Botni to'xtatish va qayta yoqilmasligini ta'minlash"""
+        with self._lock:
+            entry = self._bots.get(bot_id)
+            if entry is None:
+                return False
+            entry.desired_state = 'stopped'
+            process, entry.process = entry.process, None
+            entry.state = 'stopped'
+            entry.next_start = None
+        self._terminate(process)
+        update_bot_process_state(bot_id, 'stopped')
+        return True
+
+    def restart(self, bot_id, path, env=None):
+        """Botni to'xtatib, qaytadan ishga tushirish"""
+        self.stop(bot_id)
+        return self.start(bot_id, path, env)
+
+    def remove(self, bot_id):
+        """Botni to'xtatib, nazoratdan chiqarish"""
+        self.stop(bot_id)
+        with self._lock:
+            self._bots.pop(bot_id, None)
+
+    def remove_many(self, bot_ids):
+        """
+        Botlarni to'xtatib nazoratdan chiqarish (avval hammasiga SIGTERM, keyin kutish).
+        Botlar belgilab qo'yiladi: shu paytda bajarilayotgan sync oldin o'qilgan ro'yxat
+        bo'yicha ularni qayta yoqmaydi.
+        """
+        processes = []
+        with self._lock:
+            self._fence_generation += 1
+            for bot_id in bot_ids:
+                self._fenced[bot_id] = self._fence_generation
+                entry = self._bots.pop(bot_id, None)
+                if entry is not None:
+                    entry.desired_state = 'stopped'
+                    processes.append((bot_id, entry.process))
+                    entry.process = None
+        for _, process in processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for bot_id, process in processes:
+            self._terminate(process)
+            update_bot_process_state(bot_id, 'stopped')
+
+    def status(self, bot_id):
+        """Botning joriy holati: (holat, PID)"""
+        with self._lock:
+            entry = self._bots.get(bot_id)
+            if entry is None:
+                return 'stopped', None
+            return entry.state, entry.process.pid if entry.process else None
+
+    def bot_ids(self):
+        """Nazoratdagi barcha botlar ID lari"""
+        with self._lock:
+            return set(self._bots)
+
+    def pids(self):
+        """Ishlayotgan bot jarayonlari: {bot ID: PID}"""
+        with self._lock:
+            return {bot_id: entry.process.pid for bot_id, entry in self._bots.items()
+                    if entry.state == 'running' and entry.process is not None}
+
+    def counts(self):
+        """Har bir holatdagi botlar soni"""
+        with self._lock:
+            counts = {}
+            for entry in self._bots.values():
+                counts[entry.state] = counts.get(entry.state, 0) + 1
+            return counts
+
+    @staticmethod
+    def _terminate_stale(pid, path):
+        """Menejer qayta ishga tushganidan oldin qolib ketgan eski jarayonni to'xtatish"""
+        if not pid:
+            return
+        try:
+            with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                cmdline = f.read().decode(errors='replace')
+        except OSError:
+            return
+        # Umumiy shablon fayli bir nechta botda bir xil, zigota bolalari esa
+        # zigota buyrug'i bilan ko'rinadi - shuning uchun eskilar yangi botlar
+        # yoqilishidan oldin to'xtatiladi
+        if path in cmdline or 'bot_zygote.py' in cmdline:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def boot(self):
+        """Faol botlarni cheklangan parallellik bilan qayta yoqish"""
+        rows = load_bots_to_run()
+        if rows is None:
+            return
+        print(f"{len(rows)} ta bot qayta ishga tushirilmoqda...")
+
+        for row in rows:
+            self._terminate_stale(row['pid'], row['path'])
+
+        def boot_one(row):
+            self.start(row['id'], row['path'], bot_launch_env(row))
+            time.sleep(SUPERVISOR_BOOT_STAGGER)
+
+        with ThreadPoolExecutor(max_workers=SUPERVISOR_BOOT_CONCURRENCY, thread_name_prefix="supervisor-boot") as executor:
+            list(executor.map(boot_one, rows))
+
+    def sync(self):
+        """Bazadagi kerakli holat bilan solishtirish (boshqa jarayonlar qilgan o'zgarishlar uchun)"""
+        with self._lock:
+            generation = self._fence_generation
+        rows = load_bots_to_run(self.node_id)
+        if rows is None:
+            return
+        rows = {row['id']: row for row in rows}
+        with self._lock:
+            running = {bot_id for bot_id, entry in self._bots.items() if entry.desired_state == 'running'}
+            # Ro'yxatdan oldingi belgilar endi kerak emas - ro'yxat ulardan yangiroq
+            self._fenced = {bot_id: fenced_at for bot_id, fenced_at in self._fenced.items() if fenced_at > generation}
+        for bot_id in running - rows.keys():
+            self.remove(bot_id)
+        for bot_id in rows.keys() - running:
+            self.start(bot_id, rows[bot_id]['path'], bot_launch_env(rows[bot_id]), fence_generation=generation)
+
+    def request_sync(self):
+        """Bazadagi kerakli holat bilan navbatdagi tekshiruvda solishtirish"""
+        self._last_sync = 0
+
+    def _check_children(self):
+        now = time.monotonic()
+        crashed, due = [], []
+        with self._lock:
+            for entry in self._bots.values():
+                if entry.desired_state != 'running':
+                    continue
+                if entry.process is not None and entry.process.poll() is not None:
+                    crashed.append(entry)
+                elif entry.state == 'backoff' and entry.next_start is not None and now >= entry.next_start:
+                    # Qulf ichida band qilinadi: shu orada start() botni ikkinchi marta yoqmaydi
+                    entry.state = 'starting'
+                    entry.next_start = None
+                    due.append(entry)
+        for entry in crashed:
+            if entry.process.returncode == -signal.SIGXCPU:
+                print(f"Bot {entry.bot_id} CPU vaqti chegarasiga ({BOT_CPU_TIME_LIMIT} s) yetdi")
+            self._schedule_restart(entry)
+        for entry in due:
+            self._launch(entry)
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(SUPERVISOR_POLL_INTERVAL):
+            try:
+                self._check_children()
+                if time.monotonic() - self._last_sync >= SUPERVISOR_SYNC_INTERVAL:
+                    self._last_sync = time.monotonic()
+                    self.sync()
+            except Exception as e:
+                print(f"Nazoratchi xatosi: {e}")
+
+    def run(self):
+        """Kuzatuv oqimini ishga tushirish"""
+        self._thread = threading.Thread(target=self._monitor_loop, name="bot-supervisor", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """Kuzatuvni to'xtatish va barcha bot jarayonlarini yopish"""
+        self._stop_event.set()
+        with self._lock:
+            entries = list(self._bots.values())
+        for entry in entries:
+            self._terminate(entry.process)
+            update_bot_process_state(entry.bot_id, 'stopped')
+        if self._forkserver is not None:
+            self._forkserver.close()
+
+
+bot_supervisor = BotSupervisor()
+metrics.gauge("makerbot_bots", "Nazoratchidagi bot jarayonlari holatlar bo'yicha", "state",
+              lambda: {state: 0 for state in ('running', 'starting', 'backoff', 'stopped')} | bot_supervisor.counts())
+
+# ==================== ISHCHI TUGUNLAR (LEASE) ====================
+# BOT_PLACEMENT = "workers" da botlarni bir nechta "worker" jarayonlari yoqadi. Har bir bot
+# bot_leases da bitta tugunga yoziladi: tugun heartbeat bilan lease larini uzaytiradi, bo'sh
+# yoki muddati o'tgan botlarni sig'imiga mutanosib ulushigacha oladi, ortiqchasini bo'shatadi.
+# Bo'shatish tartibi: lease released deb belgilanadi -> jarayon to'xtatiladi -> lease
+# o'chiriladi, shuning uchun bitta token ikki tugunda bir vaqtda ishlamaydi.
+# Tugun jarayoni o'lsa (SIGKILL ham) uning botlari PR_SET_PDEATHSIG orqali SIGTERM oladi
+# (bot_launch_command) - aks holda ular yangi egasi bilan birga ishlab qolardi.
+PR_SET_PDEATHSIG = 1
+
+
+class WorkerNode:
+    """Bitta ishchi tugun: heartbeat, lease larni yangilash, olish va bo'shatish"""
+
+    def __init__(self, node_id, capacity):
+        self.node_id = node_id
+        self.capacity = capacity
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._fence_thread = None
+        self._conn = None
+        self._deadline_lock = threading.Lock()
+        self._lease_deadline = None   # monotonic: shu vaqtgacha lease larimiz boshqaga o'tmaydi
+        self.owned = 0
+        self.target = 0
+        self.live_nodes = 0
+        self.claimed = 0
+        self.released = 0
+        self.lost = 0
+
+    def wake(self):
+        self._wake_event.set()
+
+    def _drop(self, bot_ids):
+        """Botlarni shu tugunda to'xtatish (lease bilan ish qilmaydi)"""
+        bot_supervisor.remove_many(bot_ids)
+
+    def _release(self, cur, conn, bot_ids):
+        """Belgilangan (released) botlarni to'xtatib, lease larini o'chirish"""
+        self._drop(bot_ids)
+        cur.execute("DELETE FROM bot_leases WHERE node_id = %s AND bot_id = ANY(%s::uuid[])",
+                    (self.node_id, list(bot_ids)))
+        conn.commit()
+
+    def _connection(self):
+        """
+        Heartbeat uchun alohida ulanish: puldan ulanish kutilmaydi, ulanish va har bir so'rov
+        WORKER_DB_TIMEOUT bilan cheklangan - osilib qolgan so'rov heartbeat ni lease muddatidan
+        uzoq to'xtatib turmaydi.
+        """
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**db_pool.config, cursor_factory=RealDictCursor,
+                                          connect_timeout=WORKER_DB_TIMEOUT,
+                                          options=f"-c statement_timeout={WORKER_DB_TIMEOUT * 1000}")
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            DatabasePool._close_quietly(self._conn)
+            self._conn = None
+
+    def heartbeat(self):
+        """Bitta heartbeat; yangi botlar olingan bo'lsa True (nazoratchi sinxronlanishi kerak)"""
+        started = time.monotonic()
+        conn = self._connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO worker_nodes (node_id, hostname, pid, capacity)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (node_id) DO UPDATE
+                    SET capacity = EXCLUDED.capacity, heartbeat_at = CURRENT_TIMESTAMP
+                """, (self.node_id, os.uname().nodename, os.getpid(), self.capacity))
+                # Uzoq vaqt heartbeat yubormagan tugunlar yozuvlari
+                cur.execute("""
+                    DELETE FROM worker_nodes
+                    WHERE heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """, (WORKER_LEASE_TTL * 10,))
+                # Bo'shatilayotganlari ham uzaytiriladi: jarayon to'xtab lease o'chirilguncha
+                # boshqa tugun ularni faqat shu tugun o'lganda (muddat o'tganda) oladi
+                cur.execute("""
+                    UPDATE bot_leases SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE node_id = %s
+                    RETURNING bot_id
+                """, (WORKER_LEASE_TTL, self.node_id))
+                leased = {str(row['bot_id']) for row in cur.fetchall()}
+                conn.commit()
+                with self._deadline_lock:
+                    self._lease_deadline = started + WORKER_LEASE_TTL - WORKER_HEARTBEAT_INTERVAL
+
+                # Lease i boshqa tugunga o'tgan botlar (heartbeat kechikkan) darhol to'xtatiladi
+                lost = bot_supervisor.bot_ids() - leased
+                if lost:
+                    print(f"Tugun {self.node_id}: {len(lost)} ta bot lease i yo'qoldi, to'xtatilmoqda")
+                    self.lost += len(lost)
+                    self._drop(lost)
+
+                # Qayta ishga tushirish so'ralgan, to'xtatilgan yoki o'chirilgan botlarning lease lari
+                cur.execute("""
+                    SELECT l.bot_id FROM bot_leases l
+                    JOIN user_bots b ON b.id = l.bot_id
+                    WHERE l.node_id = %s
+                      AND (l.released_at IS NOT NULL OR NOT b.is_active OR b.desired_state <> 'running')
+                """, (self.node_id,))
+                retired = [str(row['bot_id']) for row in cur.fetchall()]
+                conn.commit()
+                if retired:
+                    self._release(cur, conn, retired)
+
+                cur.execute("""
+                    SELECT (SELECT count(*) FROM user_bots
+                            WHERE is_active = TRUE AND desired_state = 'running') AS total,
+                           count(*) AS nodes, COALESCE(sum(capacity), 0)::int AS capacity,
+                           (SELECT count(*) FROM bot_leases
+                            WHERE node_id = %(node)s AND released_at IS NULL) AS owned
+                    FROM worker_nodes
+                    WHERE heartbeat_at > CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+                """, {'node': self.node_id, 'ttl': WORKER_LEASE_TTL})
+                row = cur.fetchone()
+                self.live_nodes = row['nodes']
+                self.owned = row['owned']
+                self.target = min(self.capacity, -(-row['total'] * self.capacity // max(row['capacity'], 1)))
+                conn.commit()
+
+                if self.owned < self.target:
+                    # Bo'sh va muddati o'tgan lease lar; ON CONFLICT sharti bir vaqtda olayotgan
+                    # ikkinchi tugunga yangi yozilgan lease ni tortib olishga yo'l qo'ymaydi
+                    cur.execute("""
+                        INSERT INTO bot_leases (bot_id, node_id, lease_until)
+                        SELECT b.id, %(node)s, CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s)
+                        FROM user_bots b
+                        LEFT JOIN bot_leases l ON l.bot_id = b.id
+                        WHERE b.is_active = TRUE AND b.desired_state = 'running'
+                          AND (l.bot_id IS NULL OR l.lease_until < CURRENT_TIMESTAMP)
+                        ORDER BY b.created_at, b.id
+                        LIMIT %(limit)s
+                        ON CONFLICT (bot_id) DO UPDATE
+                        SET node_id = EXCLUDED.node_id, lease_until = EXCLUDED.lease_until,
+                            acquired_at = CURRENT_TIMESTAMP, released_at = NULL
+                        WHERE bot_leases.lease_until < CURRENT_TIMESTAMP
+                        RETURNING bot_id
+                    """, {'node': self.node_id, 'ttl': WORKER_LEASE_TTL,
+                          'limit': min(self.target - self.owned, WORKER_CLAIM_BATCH)})
+                    claimed = len(cur.fetchall())
+                    conn.commit()
+                    self.owned += claimed
+                    self.claimed += claimed
+                    return claimed > 0
+
+                # Ulushlar yuqoriga yaxlitlangan (yig'indisi >= botlar soni), shuning uchun
+                # hamma o'z ulushida bo'lganda hech kim bo'shatmaydi - tebranish bo'lmaydi
+                if self.owned > self.target:
+                    # Oxirgi olinganlardan boshlab bo'shatamiz; jarayon to'xtaguncha lease band turadi
+                    cur.execute("""
+                        UPDATE bot_leases SET released_at = CURRENT_TIMESTAMP
+                        WHERE bot_id IN (SELECT bot_id FROM bot_leases
+                                         WHERE node_id = %s AND released_at IS NULL
+                                         ORDER BY acquired_at DESC, bot_id
+                                         LIMIT %s)
+                        RETURNING bot_id
+                    """, (self.node_id, min(self.owned - self.target, WORKER_CLAIM_BATCH)))
+                    excess = [str(row['bot_id']) for row in cur.fetchall()]
+                    conn.commit()
+                    self._release(cur, conn, excess)
+                    self.owned -= len(excess)
+                    self.released += len(excess)
+        except Exception:
+            self._close_connection()
+            raise
+        return False
+
+    def _fence(self):
+        """Baza bilan aloqa yo'q: lease lar muddati o'tishidan oldin barcha botlarni to'xtatish"""
+        with self._deadline_lock:
+            if self._lease_deadline is None or time.monotonic() < self._lease_deadline:
+                return
+            self._lease_deadline = None
+        bot_ids = bot_supervisor.bot_ids()
+        print(f"Tugun {self.node_id}: lease larni yangilab bo'lmadi, {len(bot_ids)} ta bot to'xtatilmoqda")
+        self.lost += len(bot_ids)
+        self._drop(bot_ids)
+
+    def _fence_loop(self):
+        # Heartbeat oqimidan mustaqil: u qayerda osilib qolmasin, muddat o'tishi bilan botlar to'xtaydi
+        while not self._stop_event.wait(1):
+            self._fence()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+            # Botlar to'xtatilgan (yoki birinchi heartbeat): lease lar tiklangach qayta yoqiladi
+            resumed = self._lease_deadline is None
+            try:
+                if self.heartbeat() or resumed:
+                    bot_supervisor.request_sync()
+            except Exception as e:
+                print(f"Tugun heartbeat xatosi: {e}")
+            self._wake_event.wait(WORKER_HEARTBEAT_INTERVAL)
+
+    def start(self):
+        """Heartbeat va lease muddatini kuzatuvchi oqimlarni ishga tushirish"""
+        self._thread = threading.Thread(target=self._loop, name="worker-node", daemon=True)
+        self._thread.start()
+        self._fence_thread = threading.Thread(target=self._fence_loop, name="worker-fence", daemon=True)
+        self._fence_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=SUPERVISOR_STOP_TIMEOUT)
+        self._close_connection()
+
+    def leave(self):
+        """Botlar to'xtatilgandan keyin: lease larni darhol boshqa tugunlarga bo'shatish"""
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM bot_leases WHERE node_id = %s", (self.node_id,))
+                    cur.execute("DELETE FROM worker_nodes WHERE node_id = %s", (self.node_id,))
+                    conn.commit()
+        except Exception as e:
+            print(f"Tugunni ro'yxatdan chiqarishda xatolik: {e}")
+
+    def stats(self):
+        return {
+            'owned': self.owned,
+            'target': self.target,
+            'live_nodes': self.live_nodes,
+            'claimed': self.claimed,
+            'released': self.released,
+            'lost': self.lost,
+        }
+
+
+worker_node = None    # Faqat "worker" buyrug'ida yaratiladi
+metrics.gauge("makerbot_worker_leased_bots", "Shu tugun lease qilgan botlar", None,
+              lambda: worker_node.owned if worker_node is not None else 0)
+
+def bots_changed():
+    """NOTIFY: botlar o'zgardi - nazoratchi sinxronlanadi, tugun darhol heartbeat qiladi"""
+    bot_supervisor.request_sync()
+    if worker_node is not None:
+        worker_node.wake()
+
+def request_bot_restart(bot_id):
+    """workers rejimida qayta ishga tushirish: egasi botni to'xtatib bo'shatadi, so'ng bot qayta olinadi"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE bot_leases SET released_at = CURRENT_TIMESTAMP
+                    WHERE bot_id = %s AND released_at IS NULL
+                """, (bot_id,))
+                notify_cache_change(cur, 'bots', bot_id)
+                conn.commit()
+    except Exception as e:
+        print(f"Botni qayta ishga tushirishni so'rashda xatolik: {e}")
+
+def place_bot(bot_id, path, env, restart=False):
+    """Botni ishga tushirish: local - shu jarayonda; workers - kerakli holat bazada, tugunlardan biri oladi"""
+    if BOT_PLACEMENT == "workers":
+        if restart:
+            request_bot_restart(bot_id)
+        return True
+    launch = bot_supervisor.restart if restart else bot_supervisor.start
+    return launch(bot_id, path, env)
+
+def unplace_bot(bot_id, remove=False):
+    """Botni to'xtatish (workers rejimida egasi NOTIFY dan keyin o'zi to'xtatadi)"""
+    if BOT_PLACEMENT == "workers":
+        return
+    if remove:
+        bot_supervisor.remove(bot_id)
+    else:
+        bot_supervisor.stop(bot_id)
+
+def load_worker_nodes():
+    """Tirik ishchi tugunlar va ulardagi botlar soni"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT n.node_id, n.capacity,
+                           EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - n.heartbeat_at) AS heartbeat_age,
+                           (SELECT count(*) FROM bot_leases l
+                            WHERE l.node_id = n.node_id AND l.released_at IS NULL) AS bots
+                    FROM worker_nodes n
+                    WHERE n.heartbeat_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY n.node_id
+                """, (WORKER_LEASE_TTL,))
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Ishchi tugunlarni yuklashda xatolik: {e}")
+        return []
+
+def run_worker(args):
+    """worker buyrug'i: shu jarayonni ishchi tugun sifatida SIGTERM/SIGINT gacha ishlatish"""
+    global worker_node
+
+    worker_node = WorkerNode(args.node_id or f"{os.uname().nodename}-{os.getpid()}", args.capacity)
+    bot_supervisor.node_id = worker_node.node_id
+    stop_event = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop_event.set())
+
+    print(f"Ishchi tugun {worker_node.node_id} ishga tushdi (sig'im {worker_node.capacity})")
+    cache_invalidator.start()
+    bot_supervisor.run()
+    worker_node.start()
+    bot_usage_sampler.start()
+    metrics_server = start_metrics_server(port=args.metrics_port) if METRICS_ENABLED and args.metrics_port else None
+    try:
+        stop_event.wait()
+    finally:
+        print(f"Ishchi tugun {worker_node.node_id} to'xtatilmoqda...")
+        worker_node.stop()
+        cache_invalidator.stop()
+        bot_usage_sampler.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        bot_supervisor.shutdown()
+        worker_node.leave()
+
+# ==================== BOT RESURSLARI ====================
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def bot_resource_limits():
+    """Sozlamalardagi chegaralar: [(resurs, yumshoq, qattiq), ...]"""
+    limits = []
+    if BOT_CPU_TIME_LIMIT:
+        # Yumshoq chegarada SIGXCPU keladi, qattiq chegara esa jarayonni albatta to'xtatadi
+        limits.append((resource.RLIMIT_CPU, BOT_CPU_TIME_LIMIT, BOT_CPU_TIME_LIMIT + 10))
+    if BOT_ADDRESS_SPACE_LIMIT:
+        limits.append((resource.RLIMIT_AS, BOT_ADDRESS_SPACE_LIMIT, BOT_ADDRESS_SPACE_LIMIT))
+    if BOT_OPEN_FILES_LIMIT:
+        limits.append((resource.RLIMIT_NOFILE, BOT_OPEN_FILES_LIMIT, BOT_OPEN_FILES_LIMIT))
+    return limits
+
+# python -c bilan ishga tushadigan oraliq kod: argv = [chegaralar JSON, ota PID yoki "", bot fayli].
+# Ota jarayon o'limi signali va chegaralar shu yerda, bot kodi boshlanishidan oldin qo'yiladi
+# (zigota bolasidagi kabi), keyin bot fayli __main__ sifatida shu jarayonning o'zida ishlaydi.
+BOT_LAUNCH_SHIM = f"""\
+import json, os, resource, runpy, sys
+limits, parent_pid, path = json.loads(sys.argv[1]), sys.argv[2], sys.argv[3]
+if parent_pid:
+    import ctypes, signal
+    ctypes.CDLL(None, use_errno=True).prctl({PR_SET_PDEATHSIG}, signal.SIGTERM)
+    if os.getppid() != int(parent_pid):
+        os._exit(1)
+for resource_id, soft, hard in limits:
+    try:
+        resource.setrlimit(resource_id, (soft, hard))
+    except (OSError, ValueError) as e:
+        print(f"Bot resurs chegarasini qo'yib bo'lmadi: {{e}}", file=sys.stderr)
+sys.argv = [path]
+sys.path[0] = os.path.dirname(os.path.abspath(path))
+runpy.run_path(path, run_name="__main__")
+"""
+
+def bot_launch_command(path, limits, parent_death=False):
+    """
+    Bot jarayoni buyrug'i. Chegaralar yoki parent_death=True bo'lsa bot BOT_LAUNCH_SHIM orqali
+    ishga tushadi: preexec_fn ko'p oqimli menejerda ishlatilmaydi (fork va exec orasidagi
+    bolada boshqa oqim ushlab qolgan qulf tufayli qotib qolishi mumkin). Linux o'lim signalini
+    botni yaratgan oqim tugaganda yuboradi; tugunda botlar faqat nazoratchi oqimidan yoqiladi.
+    """
+    if not limits and not parent_death:
+        return [sys.executable, path]
+    parent_pid = str(os.getpid()) if parent_death else ""
+    return [sys.executable, "-c", BOT_LAUNCH_SHIM, json.dumps(limits), parent_pid, path]
+
+def read_proc_usage(pid):
+    """/proc dan jarayonning (CPU tiklari, ishga tushgan vaqti tiklarda, RSS bayt, ochiq fayllar) qiymatlari"""
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            # Jarayon nomi (2-maydon) bo'sh joy saqlashi mumkin, shuning uchun oxirgi ')' dan keyin bo'lamiz
+            fields = f.read().rsplit(b')', 1)[1].split()
+        open_files = len(os.listdir(f"/proc/{pid}/fd"))
+    except (OSError, IndexError):
+        return None
+    if fields[0] == b'Z':
+        return None
+    return int(fields[11]) + int(fields[12]), int(fields[19]), int(fields[21]) * PAGE_SIZE, open_files
+
+def read_uptime_ticks():
+    with open("/proc/uptime") as f:
+        return float(f.read().split()[0]) * CLOCK_TICKS
+
+
+class UsageSeries:
+    """Bitta bot jarayonining so'nggi o'lchovlari (ixcham massivlarda halqali bufer)"""
+
+    def __init__(self, pid, size):
+        self.pid = pid
+        self.size = size
+        self.rss_kb = array('L', [0]) * size
+        self.cpu_permille = array('L', [0]) * size   # CPU foizining o'ndan biri (100% = 1000)
+        self.open_files = array('L', [0]) * size
+        self.count = 0
+        self.last_ticks = None
+        self.last_time = None
+
+    def record(self, usage, now_ticks):
+        cpu_ticks, start_ticks, rss_bytes, open_files = usage
+        if self.last_ticks is None:
+            # Birinchi o'lchovda jarayon boshlanganidan beri o'rtacha yuklama
+            elapsed = now_ticks - start_ticks
+            used = cpu_ticks
+        else:
+            elapsed = now_ticks - self.last_time
+            used = cpu_ticks - self.last_ticks
+        self.last_ticks, self.last_time = cpu_ticks, now_ticks
+
+        index = self.count % self.size
+        self.rss_kb[index] = rss_bytes // 1024
+        self.cpu_permille[index] = int(1000 * used / elapsed) if elapsed > 0 else 0
+        self.open_files[index] = open_files
+        self.count += 1
+
+    def summary(self):
+        """Joriy va oyna bo'yicha qiymatlar"""
+        index = (self.count - 1) % self.size
+        filled = min(self.count, self.size)
+        return {
+            'pid': self.pid,
+            'cpu': self.cpu_permille[index] / 10,
+            'cpu_avg': sum(self.cpu_permille[:filled]) / filled / 10,
+            'rss_mb': self.rss_kb[index] / 1024,
+            'rss_peak_mb': max(self.rss_kb[:filled]) / 1024,
+            'open_files': self.open_files[index],
+            'samples': filled,
+        }
+
+
+class BotUsageSampler:
+    """Nazoratchi ishga tushirgan bot jarayonlarining RSS va CPU sarfini /proc dan davriy o'lchaydi"""
+
+    SORT_KEYS = {'cpu': 'cpu', 'rss': 'rss_mb'}
 
-# ==================== ADMIN: SHABLONLARNI QO'SHISH ====================
-@bot.callback_query_handler(func=lambda call: call.data == "admin_add_template" and str(call.from_user.id) == ADMIN_ID)
-def admin_add_template_handler(call):
-    msg = bot.send_message(call.message.chat.id, "📁 Bot shablon faylini yuboring (.py formatda):")
-    bot.register_next_step_handler(msg, admin_handle_template_file)
-    safe_answer_callback_query(call.id)
+    def __init__(self, supervisor, interval, history):
+        self.supervisor = supervisor
+        self.interval = interval
+        self.history = history
+        self._series = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
 
-def admin_handle_template_file(message):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
+    def sample(self):
+        """Barcha ishlayotgan botlarni bir marta o'lchash"""
+        pids = self.supervisor.pids()
+        readings = {bot_id: (pid, read_proc_usage(pid)) for bot_id, pid in pids.items()}
+        now_ticks = read_uptime_ticks()
+        with self._lock:
+            for bot_id in self._series.keys() - pids.keys():
+                del self._series[bot_id]
+            for bot_id, (pid, usage) in readings.items():
+                if usage is None:
+                    continue
+                series = self._series.get(bot_id)
+                if series is None or series.pid != pid:
+                    # Bot qayta ishga tushgan: yangi jarayon uchun yangi qator
+                    series = self._series[bot_id] = UsageSeries(pid, self.history)
+                series.record(usage, now_ticks)
 
-    if not message.document or not message.document.file_name.endswith('.py'):
-        msg = bot.send_message(message.chat.id, "⚠️ Iltimos, faqat .py faylini yuboring!")
-        bot.register_next_step_handler(msg, admin_handle_template_file)
-        return
+    def current(self, bot_id):
+        """Botning joriy sarfi; o'lchanmagan bo'lsa None"""
+        with self._lock:
+            series = self._series.get(bot_id)
+            return series.summary() if series else None
 
-    # Faylni yuklab olamiz
-    file_info = bot.get_file(message.document.file_id)
-    downloaded_file = bot.download_file(file_info.file_path)
+    def top(self, sort_key='cpu', limit=TOP_BOTS_LIMIT):
+        """Eng ko'p sarflayotgan botlar: [(bot ID, sarf), ...]"""
+        field = self.SORT_KEYS[sort_key]
+        with self._lock:
+            usages = [(bot_id, series.summary()) for bot_id, series in self._series.items()]
+        usages.sort(key=lambda item: item[1][field], reverse=True)
+        return usages[:limit]
 
-    # Faylni saqlash
-    template_id = str(uuid.uuid4())
-    template_path = f"bot_templates/{template_id}.py"
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Bot resurslarini o'lchashda xato: {e}")
 
-    with open(template_path, 'wb') as f:
-        f.write(downloaded_file)
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="bot-usage-sampler", daemon=True)
+        self._thread.start()
 
-    msg = bot.send_message(message.chat.id, "📝 Shablon uchun nom kiriting:")
-    bot.register_next_step_handler(msg, admin_get_template_name, template_id, template_path)
+    def stop(self):
+        self._stop_event.set()
 
-def admin_get_template_name(message, template_id, template_path):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
 
-    template_name = message.text
+bot_usage_sampler = BotUsageSampler(bot_supervisor, BOT_USAGE_SAMPLE_INTERVAL, BOT_USAGE_HISTORY)
+metrics.gauge("makerbot_bots_rss_bytes", "Bot jarayonlarining umumiy RSS xotirasi (oxirgi o'lchov)", None,
+              lambda: int(sum(usage['rss_mb'] for _, usage in bot_usage_sampler.top(limit=None)) * 1024 * 1024))
 
-    # Shablonni ma'lumotlar bazasiga saqlash
-    save_bot_template(template_id, template_name, template_path, os.path.basename(template_path))
+# ==================== YANGILANISHLARNI TAQSIMLASH ====================
+update_dispatch_rejections = metrics.counter(
+    "makerbot_update_dispatch_rejected_total", "Navbat to'lgani uchun rad etilgan yangilanishlar", "reason")
 
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🏠 Bosh menyu", callback_data="admin_main_menu"))
-    bot.send_message(message.chat.id, f"✅ '{template_name}' shabloni muvaffaqiyatli qo'shildi!", reply_markup=markup)
+def update_chat_key(update):
+    """Yangilanish tegishli chat (tartib shu kalit bo'yicha saqlanadi); chatsiz yangilanishlar uchun None"""
+    if update.chat_member is not None:
+        # Katta kanal a'zoligi o'zgarishlari bitta navbatni to'ldirmasligi uchun foydalanuvchi bo'yicha
+        return update.chat_member.chat.id, update.chat_member.new_chat_member.user.id
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                  'my_chat_member', 'chat_join_request'):
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.chat.id
+    call = update.callback_query
+    if call is not None:
+        return call.message.chat.id if call.message is not None else call.from_user.id
+    for field in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.from_user.id
+    return None
 
-# ==================== ADMIN: SHABLONLAR RO'YXATI ====================
-@bot.callback_query_handler(func=lambda call: call.data == "admin_list_templates" and str(call.from_user.id) == ADMIN_ID)
-def admin_list_templates(call):
-    bot_templates = load_bot_templates()
-    if not bot_templates:
-        bot.send_message(call.message.chat.id, "📭 Hozircha hech qanday shablon qo'shilmagan.")
-        safe_answer_callback_query(call.id)
-        return
 
-    markup = types.InlineKeyboardMarkup()
-    for template_id, template_data in bot_templates.items():
-        btn = types.InlineKeyboardButton(f"📄 {template_data['name']}", callback_data=f"admin_view_template_{template_id}")
-        markup.add(btn)
+class ChatOrderedDispatcher:
+    """Yangilanishlarni chatlar bo'yicha navbatlarga taqsimlovchi (HANDLER_DISPATCH = "ordered").
 
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data="admin_main_menu"))
-    safe_edit_message_text("📋 Mavjud shablonlar:", call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+    Bitta chatning yangilanishlari kelgan tartibda, oldingisi tugagandan keyingina bajariladi -
+    keyingi qadam handleri keyingi xabar kelguncha ro'yxatdan o'tib ulguradi. Turli chatlar
+    ishchilar orasida parallel: chat bitta yangilanishni bajarib, tayyorlar navbati oxiriga
+    qaytadi, shuning uchun faol chat boshqalarni to'sib qo'ymaydi.
+    """
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("admin_view_template_") and str(call.from_user.id) == ADMIN_ID)
-def admin_view_template(call):
-    template_id = call.data.split("_")[3]
-    bot_templates = load_bot_templates()
-    
-    if template_id not in bot_templates:
-        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
-        return
+    def __init__(self, process, workers, queue_size, chat_queue_size):
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.chat_queue_size = chat_queue_size
+        # chat kaliti -> deque; birinchi element bajarilayotgan yoki navbatdagi yangilanish
+        self._lanes = {}
+        # Bajarilishga tayyor chatlar: har bir chat bu yerda ko'pi bilan bir marta turadi
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._queued = 0
+        self._accepting = True
+        self._threads = []
+        self.processed = 0
+        self.rejected = 0
 
-    template_data = bot_templates[template_id]
+    def submit(self, update, block=False):
+        """
+        Yangilanishni o'z chati navbatiga qo'yish. Joy bo'lmasa block=False da darhol,
+        block=True da taqsimlovchi to'xtatilgandagina False qaytaradi.
+        """
+        key = update_chat_key(update)
+        if key is None:
+            # Chatga bog'lanmagan yangilanishlar o'zaro tartib talab qilmaydi
+            key = ('update', update.update_id)
+        with self._lock:
+            while True:
+                if not self._accepting:
+                    return False
+                lane = self._lanes.get(key)
+                if self._queued >= self.queue_size:
+                    reason = 'queue_full'
+                elif lane is not None and len(lane) >= self.chat_queue_size:
+                    reason = 'chat_full'
+                else:
+                    if lane is None:
+                        self._lanes[key] = deque((update,))
+                        self._ready.put(key)
+                    else:
+                        lane.append(update)
+                    self._queued += 1
+                    return True
+                if not block:
+                    break
+                self._space.wait()
+            self.rejected += 1
+        update_dispatch_rejections.inc(reason)
+        return False
 
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🗑️ O'chirish", callback_data=f"admin_delete_template_{template_id}"))
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data="admin_list_templates"))
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                update = self._lanes[key][0]
+            try:
+                self.process([update])
+            except Exception as e:
+                print(f"Yangilanishni qayta ishlashda xato: {e}")
+            finally:
+                with self._lock:
+                    lane = self._lanes[key]
+                    lane.popleft()
+                    self._queued -= 1
+                    self.processed += 1
+                    if lane:
+                        self._ready.put(key)
+                    else:
+                        del self._lanes[key]
+                    self._space.notify_all()
+                    if not self._queued:
+                        self._drained.notify_all()
 
-    response_text = f"📄 Shablon ma'lumotlari:\nNom: {template_data['name']}\nFayl: {template_data['filename']}"
-    
-    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"update-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("admin_delete_template_") and str(call.from_user.id) == ADMIN_ID)
-def admin_delete_template(call):
-    template_id = call.data.split("_")[3]
-    bot_templates = load_bot_templates()
-    
-    if template_id in bot_templates:
-        template_data = bot_templates[template_id]
-        # Faylni o'chirish
-        try:
-            if os.path.exists(template_data['path']):
-                os.remove(template_data['path'])
-        except Exception as e:
-            print(f"Fayl o'chirishda xato: {e}")
-        
-        # Ma'lumotlar bazasidan o'chirish
-        delete_bot_template(template_id)
-        
-        safe_answer_callback_query(call.id, "✅ Shablon o'chirildi!")
-        # Orqaga qaytish
-        call_data = type('obj', (object,), {'data': 'admin_list_templates', 'message': call.message, 'from_user': call.from_user})
-        admin_list_templates(call_data)
-    else:
-        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
+    def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Yangi yangilanishlarni rad etib, navbatdagilarni tugatish"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._accepting = False
+            self._space.notify_all()
+            while self._queued:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._drained.wait(remaining):
+                    break
+            pending = self._queued
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if pending:
+            print(f"Taqsimlovchi to'xtatildi, {pending} ta yangilanish qayta ishlanmadi")
 
-# ==================== FOYDALANUVCHI: BOTLAR MENYUSI ====================
-@bot.callback_query_handler(func=lambda call: call.data == "user_show_bots")
-def user_show_bots(call):
-    bot_templates = load_bot_templates()
-    if not bot_templates:
-        bot.send_message(call.message.chat.id, "📭 Hozircha hech qanday bot shabloni mavjud emas.")
-        safe_answer_callback_query(call.id)
-        return
+    def stats(self):
+        with self._lock:
+            return {'mode': "ordered", 'workers': self.workers, 'queued': self._queued,
+                    'chats': len(self._lanes), 'processed': self.processed, 'rejected': self.rejected}
 
-    markup = types.InlineKeyboardMarkup()
-    for template_id, template_data in bot_templates.items():
-        btn = types.InlineKeyboardButton(f"🤖 {template_data['name']}", callback_data=f"user_select_template_{template_id}")
-        markup.add(btn)
 
-    back_data = "admin_main_menu" if str(call.from_user.id) == ADMIN_ID else "user_back_to_main"
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=back_data))
-    
-    safe_edit_message_text("📋 Mavjud botlar:", call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+class SharedUpdateQueue:
+    """Umumiy FIFO navbat va ishchilar puli (HANDLER_DISPATCH = "threaded"): bitta chatning
+    yangilanishlari turli ishchilarda bir vaqtda bajarilishi mumkin"""
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_select_template_"))
-def user_select_template(call):
-    template_id = call.data.split("_")[3]
-    bot_templates = load_bot_templates()
-    
-    if template_id not in bot_templates:
-        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
-        return
+    def __init__(self, process, workers, queue_size):
+        self.process = process
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._accepting = True
+        self._threads = []
+        self.processed = 0
+        self.rejected = 0
 
-    template_data = bot_templates[template_id]
+    def submit(self, update, block=False):
+        """
+        Yangilanishni navbatga qo'yish. Joy bo'lmasa block=False da darhol,
+        block=True da taqsimlovchi to'xtatilgandagina False qaytaradi.
+        """
+        # stop() to'xtatish belgilarini qo'yishdan oldin shu qulfni oladi - qabul qilingan
+        # yangilanish belgilardan oldin navbatga tushadi
+        with self._lock:
+            while True:
+                if not self._accepting:
+                    return False
+                try:
+                    self.updates.put_nowait(update)
+                    return True
+                except queue.Full:
+                    if not block:
+                        break
+                    self._space.wait()
+            self.rejected += 1
+        update_dispatch_rejections.inc('queue_full')
+        return False
 
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🚀 Yangi bot yaratish", callback_data=f"user_create_bot_{template_id}"))
+    def _worker(self):
+        while True:
+            update = self.updates.get()
+            with self._lock:
+                self._space.notify_all()
+            try:
+                if update is None:
+                    return
+                self.process([update])
+                self.processed += 1
+            except Exception as e:
+                print(f"Yangilanishni qayta ishlashda xato: {e}")
+            finally:
+                self.updates.task_done()
 
-    # Agar foydalanuvchi allaqachon bot yaratgan bo'lsa
-    user_bots = load_user_bots()
-    user_bots_count = len([ub for ub in user_bots.values() if ub['template_id'] == template_id])
-    if user_bots_count > 0:
-        markup.add(types.InlineKeyboardButton("⚙️ Mening botlarim", callback_data=f"user_my_bots_{template_id}"))
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"update-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
 
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data="user_show_bots"))
+    def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Yangi yangilanishlarni rad etib, navbatdagilarni tugatish"""
+        with self._lock:
+            self._accepting = False
+            self._space.notify_all()
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            # Navbat FIFO - to'xtatish belgisi oldingi yangilanishlardan keyin olinadi.
+            # Navbat muddatgacha bo'shamasa ishchilar (daemon) jarayon bilan tugaydi
+            try:
+                self.updates.put(None, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        pending = self.updates.qsize()
+        if pending:
+            print(f"Taqsimlovchi to'xtatildi, {pending} ta yangilanish qayta ishlanmadi")
 
-    response_text = f"📄 Bot: {template_data['name']}\nFayl: {template_data['filename']}\n\nTanlang:"
-    
-    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+    def stats(self):
+        return {'mode': "threaded", 'workers': self.workers, 'queued': self.updates.qsize(),
+                'chats': None, 'processed': self.processed, 'rejected': self.rejected}
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_create_bot_"))
-def user_create_bot(call):
-    # Avval majburiy obunani tekshirish
-    user_id = str(call.from_user.id)
-    global_channels = list_global_channels()
-    
-    if global_channels and not check_subscription(bot, user_id, global_channels):
-        channels_text = "\n".join([f"🔹 {channel}" for channel in global_channels])
-        response_text = f"⚠️ <b>Bot yaratish uchun quyidagi kanallarga obuna bo'ling:</b>\n\n{channels_text}"
-        
-        markup = create_subscription_markup(global_channels)
-        bot.send_message(call.message.chat.id, response_text, parse_mode='HTML', reply_markup=markup)
-        safe_answer_callback_query(call.id)
-        return
-    
-    template_id = call.data.split("_")[3]
-    bot_templates = load_bot_templates()
-    
-    if template_id not in bot_templates:
-        safe_answer_callback_query(call.id, "❌ Shablon topilmadi!")
-        return
 
-    # Avval token so'raymiz
-    msg = bot.send_message(call.message.chat.id, "🔑 Yangi bot uchun token kiriting:")
-    bot.register_next_step_handler(msg, user_get_bot_token, template_id)
-    safe_answer_callback_query(call.id)
+# main() da yaratiladi (polling "threaded" rejimida TeleBot ning o'z puli ishlatiladi - None)
+update_dispatcher = None
+metrics.gauge("makerbot_update_dispatch_queued", "Qayta ishlanishini kutayotgan yangilanishlar", None,
+              lambda: update_dispatcher.stats()['queued'] if update_dispatcher is not None else 0)
 
-def user_get_bot_token(message, template_id):
-    user_token = message.text.strip()
+def create_update_dispatcher(process, mode=None):
+    """HANDLER_DISPATCH bo'yicha yangilanishlar taqsimlovchisi"""
+    if (mode or HANDLER_DISPATCH) == "ordered":
+        return ChatOrderedDispatcher(process, HANDLER_WORKERS, HANDLER_QUEUE_SIZE, HANDLER_CHAT_QUEUE_SIZE)
+    return SharedUpdateQueue(process, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
 
-    # Endi admin ID so'raymiz
-    msg = bot.send_message(message.chat.id, "🆔 Yangi bot uchun admin ID kiriting (agar kerak bo'lmasa 'yoq' deb yozing):")
-    bot.register_next_step_handler(msg, user_get_admin_id, template_id, user_token)
+def route_polling_updates(bot_instance, dispatcher):
+    """Pollingda olingan yangilanishlarni TeleBot puli o'rniga taqsimlovchiga berish"""
+    # Handlerlar taqsimlovchi ishchilarida to'g'ridan-to'g'ri bajariladi
+    bot_instance.threaded = False
 
-def user_get_admin_id(message, template_id, user_token):
-    admin_id = message.text.strip()
-    if admin_id.lower() in ['yoq', 'yo\'q', 'no', 'none', '']:
-        admin_id = None
+    def enqueue(updates):
+        for update in updates:
+            # Navbat to'lsa joy bo'shaguncha kutamiz - getUpdates ham to'xtab turadi, yangilanish
+            # tashlanmaydi. Taqsimlovchi to'xtatilgan bo'lsa qolganlari qabul qilinmaydi
+            if not dispatcher.submit(update, block=True):
+                print(f"Taqsimlovchi to'xtatilgan: {update.update_id} dan boshlab yangilanishlar qayta olinadi")
+                return
+            # Keyingi getUpdates offseti odatda process_new_updates ichida suriladi - faqat
+            # navbatga qabul qilingan yangilanish uchun shu yerda suramiz
+            if update.update_id > bot_instance.last_update_id:
+                bot_instance.last_update_id = update.update_id
 
-    # Bot yaratish
-    result = create_user_bot_from_template(template_id, user_token, admin_id)
+    bot_instance.process_new_updates = enqueue
 
-    if result:
-        # Botni ma'lumotlar bazasiga saqlash
-        save_user_bot(result['id'], template_id, user_token, admin_id, result['path'])
-        
-        # Global kanallarni botga bog'lash
-        global_channels = list_global_channels()
+# ==================== WEBHOOK SERVERI ====================
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """Telegram yuborgan yangilanishlarni qabul qiladi va navbatga qo'yadi"""
+
+    def _respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path != webhook.path:
+            self._respond(404)
+            return
+        secret = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secret, webhook.secret):
+            self._respond(403)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > WEBHOOK_MAX_BODY:
+            self._respond(413 if length > 0 else 400)
+            return
         try:
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    for channel in global_channels:
-                        cur.execute("""
-                            INSERT INTO bot_channels (bot_id, channel_identifier)
-                            VALUES (%s, %s)
-                            ON CONFLICT DO NOTHING
-                        """, (result['id'], channel))
-                    conn.commit()
+            update = types.Update.de_json(self.rfile.read(length).decode("utf-8"))
         except Exception as e:
-            print(f"Bot kanallarini saqlashda xatolik: {e}")
-
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("⚙️ Botni boshqarish", callback_data=f"user_manage_bot_{result['id']}"))
-        markup.add(types.InlineKeyboardButton("🔙 Botlar ro'yxati", callback_data="user_show_bots"))
-
-        admin_info = f"Admin ID: {admin_id}" if admin_id else "Admin ID: yo'q"
-        channels_info = len(global_channels)
-        bot.send_message(message.chat.id,
-                        f"✅ Bot muvaffaqiyatli yaratildi va ishga tushdi!\n"
-                        f"Token: {user_token[:15]}...\n"
-                        f"{admin_info}\n"
-                        f"📢 Majburiy kanallar: {channels_info} ta",
-                        reply_markup=markup)
-    else:
-        bot.send_message(message.chat.id, "❌ Xatolik yuz berdi! Bot yaratilmadi.")
+            print(f"Webhook yangilanishini o'qishda xato: {e}")
+            self._respond(400)
+            return
+        # Navbat to'lgan yoki server to'xtatilayotgan bo'lsa Telegram keyinroq qayta yuboradi
+        self._respond(200 if webhook.submit(update) else 503)
 
-# ==================== FOYDALANUVCHI: MENING BOTLARIM ====================
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_my_bots_"))
-def user_my_bots(call):
-    template_id = call.data.split("_")[3]
-    bot_templates = load_bot_templates()
-    user_bots = load_user_bots()
+    def log_message(self, format, *args):
+        pass
 
-    # Foydalanuvchining ushbu shablondan yaratgan botlari
-    my_bots = {k: v for k, v in user_bots.items() if v['template_id'] == template_id}
 
-    if not my_bots:
-        bot.send_message(call.message.chat.id, "📭 Siz hali bot yaratmagansiz.")
-        safe_answer_callback_query(call.id)
-        return
+class WebhookServer:
+    """Ichki HTTP server; qabul qilingan yangilanishlar taqsimlovchiga beriladi"""
 
-    markup = types.InlineKeyboardMarkup()
-    for bot_id, bot_data in my_bots.items():
-        token_preview = bot_data['token'][:15] + "..."
-        admin_info = bot_data['admin_id'] if bot_data['admin_id'] else "yo'q"
-        channels_info = len(bot_data['channels'])
-        btn_text = f"🔧 {token_preview} (Admin: {admin_info[:10]}..., 📢{channels_info})"
-        btn = types.InlineKeyboardButton(btn_text, callback_data=f"user_manage_bot_{bot_id}")
-        markup.add(btn)
+    def __init__(self, host, port, path, secret, dispatcher):
+        self.path = path
+        self.secret = secret
+        self.dispatcher = dispatcher
+        self.httpd = ThreadingHTTPServer((host, port), WebhookRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.webhook = self
 
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=f"user_select_template_{template_id}"))
-    
-    safe_edit_message_text("⚙️ Sizning botlaringiz:", call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_manage_bot_"))
-def user_manage_bot(call):
-    bot_id = call.data.split("_")[3]
-    user_bots = load_user_bots()
-    
-    if bot_id not in user_bots:
-        safe_answer_callback_query(call.id, "❌ Bot topilmadi!")
-        return
+    def submit(self, update):
+        """Yangilanishni navbatga qo'yish (joy bo'lmasa False)"""
+        return self.dispatcher.submit(update)
 
-    bot_data = user_bots[bot_id]
-    bot_templates = load_bot_templates()
+    def start(self):
+        """Ishchilarni va HTTP serverni ishga tushirish"""
+        self.dispatcher.start()
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True).start()
 
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🛑 To'xtatish", callback_data=f"user_stop_bot_{bot_id}"))
-    markup.add(types.InlineKeyboardButton("🗑️ O'chirish", callback_data=f"user_delete_bot_{bot_id}"))
+    def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Yangi so'rovlarni to'xtatib, navbatdagilarni tugatish"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.dispatcher.stop(timeout)
 
-    template_name = bot_templates[bot_data['template_id']]['name']
-    markup.add(types.InlineKeyboardButton("🔙 Orqaga", callback_data=f"user_my_bots_{bot_data['template_id']}"))
+def run_webhook(dispatcher):
+    """Webhook rejimida ishlash (SIGTERM/SIGINT kelguncha)"""
+    # Handlerlar taqsimlovchi ishchilarida bajariladi, TeleBot ning o'z puli kerak emas
+    bot.threaded = False
+    server = WebhookServer(WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, dispatcher)
+    server.start()
+    bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, max_connections=dispatcher.workers,
+                    allowed_updates=subscription_allowed_updates())
+    print(f"Webhook {WEBHOOK_LISTEN}:{server.port}{WEBHOOK_PATH} manzilida tinglanmoqda")
 
-    token_preview = bot_data['token'][:20] + "..."
-    admin_info = bot_data['admin_id'] if bot_data['admin_id'] else "yo'q"
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    while not stop_event.wait(1):
+        pass
+    print("Webhook to'xtatilmoqda...")
+    server.stop()
 
-    response_text = f"🔧 Bot boshqaruvi:\nShablon: {template_name}\nToken: {token_preview}\nAdmin ID: {admin_info}"
-    
-    safe_edit_message_text(response_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
-    safe_answer_callback_query(call.id)
+# ==================== OMMAVIY BOT YARATISH ====================
+BOT_TOKEN_PATTERN = re.compile(r'^\d+:[A-Za-z0-9_-]{30,}$')
+PROVISION_FIELDS = ('template', 'token', 'admin_id', 'owner')
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_stop_bot_"))
-def user_stop_bot(call):
-    bot_id = call.data.split("_")[3]
-    user_bots = load_user_bots()
-    
-    if bot_id in user_bots:
-        try:
-            if user_bots[bot_id]['process']:
-                user_bots[bot_id]['process'].terminate()
-            safe_answer_callback_query(call.id, "✅ Bot to'xtatildi!")
-        except Exception as e:
-            print(f"Bot to'xtatishda xato: {e}")
-            safe_answer_callback_query(call.id, "⚠️ Xatolik yuz berdi!")
-    else:
-        safe_answer_callback_query(call.id, "❌ Bot topilmadi!")
+def read_provision_rows(path, input_format=None):
+    """CSV yoki JSONL fayldan (qator raqami, yozuv) juftliklarini oqim bilan o'qish ('-' - stdin)"""
+    if input_format is None:
+        input_format = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+    stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8', newline='')
+    try:
+        if input_format == 'jsonl':
+            for line_no, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, {'_error': f"JSON xato: {e}"}
+        else:
+            reader = csv.DictReader(stream)
+            for record in reader:
+                yield reader.line_num, record
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_delete_bot_"))
-def user_delete_bot(call):
-    bot_id = call.data.split("_")[3]
-    user_bots = load_user_bots()
-    
-    if bot_id in user_bots:
-        try:
-            # Jarayonni to'xtatish
-            if user_bots[bot_id]['process']:
-                user_bots[bot_id]['process'].terminate()
-            # Faylni o'chirish
-            if os.path.exists(user_bots[bot_id]['path']):
-                os.remove(user_bots[bot_id]['path'])
-            # Ma'lumotlar bazasidan o'chirish
-            delete_user_bot(bot_id)
-            safe_answer_callback_query(call.id, "✅ Bot o'chirildi!")
-        except Exception as e:
-            print(f"Bot o'chirishda xato: {e}")
-            safe_answer_callback_query(call.id, f"❌ Xatolik: {str(e)}")
-    else:
-        safe_answer_callback_query(call.id, "❌ Bot topilmadi!")
+def load_existing_tokens(tokens):
+    """Faol botlarda allaqachon ishlatilgan tokenlar"""
+    if not tokens:
+        return set()
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT token FROM user_bots WHERE is_active = TRUE AND token = ANY(%s)", (list(tokens),))
+            return {row['token'] for row in cur.fetchall()}
 
-@bot.callback_query_handler(func=lambda call: call.data == "user_back_to_main")
-def user_back_to_main(call):
-    show_user_menu(call.message)
-    safe_answer_callback_query(call.id)
+def save_user_bots_batch(bots, channels, desired_state='running'):
+    """Botlar va ularning kanallarini bitta tranzaksiyada ko'p qatorli INSERT lar bilan yozish"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO user_bots (id, template_id, token, admin_id, owner_id, file_path,
+                                           launch_mode, desired_state)
+                    VALUES %s
+                """, [(bot_data['id'], bot_data['template_id'], bot_data['token'], bot_data['admin_id'],
+                       bot_data['owner_id'], bot_data['path'], bot_data['launch_mode'], desired_state)
+                      for bot_data in bots], page_size=1000)
+                insert_bot_channels(cur, [(bot_data['id'], channel) for bot_data in bots for channel in channels])
+                notify_cache_change(cur, 'bots')
+                conn.commit()
+                return True
+    except Exception as e:
+        print(f"Botlarni ommaviy saqlashda xatolik: {e}")
+        return False
 
-# ==================== UNIVERSAL TOKEN, ADMIN ID VA KANALLAR QO'LLAB-QUVVATLASH ====================
-def inject_token_and_admin_id_universal(content, token, admin_id=None):
+class BotProvisioner:
     """
-    Har qanday token, admin ID funksiyasini qo'llab-quvvatlaydi
+    Fayldagi botlarni partiyalab yaratadi: tekshirish -> fayllarni oqimlar pulida
+    tayyorlash -> bazaga ommaviy yozish. Har bir partiyadan keyin erishilgan qator
+    progress fayliga yoziladi; qayta ishga tushirilganda o'sha joydan davom etadi,
+    bazada allaqachon bor tokenlar esa o'tkazib yuboriladi.
     """
 
-    # 1. Oddiy TOKEN = "..." usuli
-    content = re.sub(r'(TOKEN\s*=\s*["\']).*?(["\'])', f'TOKEN = "{token}"', content, flags=re.IGNORECASE)
+    def __init__(self, batch_size=PROVISION_BATCH_SIZE, workers=PROVISION_WORKERS,
+                 progress_path=None, reject_path=None, desired_state='running'):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress_path = progress_path
+        self.reject_path = reject_path
+        self.desired_state = desired_state
+        self.created = 0
+        self.skipped = 0
+        self.rejected = 0
+        self._templates = {}      # shablon ID -> ma'lumotlar (mazmuni bilan)
+        self._template_names = {}
+        self._seen_tokens = set()
 
-    # 2. BOT_TOKEN = "..." usuli
-    content = re.sub(r'(BOT_TOKEN\s*=\s*["\']).*?(["\'])', f'BOT_TOKEN = "{token}"', content, flags=re.IGNORECASE)
+    def _load_templates(self):
+        for template_id, template_data in load_bot_templates().items():
+            self._templates[template_id] = template_data
+            self._template_names.setdefault(template_data['name'], []).append(template_id)
 
-    # 3. API_TOKEN = "..." usuli
-    content = re.sub(r'(API_TOKEN\s*=\s*["\']).*?(["\'])', f'API_TOKEN = "{token}"', content, flags=re.IGNORECASE)
+    def _template_for(self, value):
+        """Shablonni ID yoki nom bo'yicha topish, bir marta tayyorlash"""
+        if value in self._templates:
+            template_id = value
+        else:
+            template_ids = self._template_names.get(value, [])
+            if len(template_ids) != 1:
+                return None, "shablon topilmadi" if not template_ids else "shablon nomi bir nechta"
+            template_id = template_ids[0]
 
-    # 4. token = "..." usuli (kichik harf)
-    content = re.sub(r'(token\s*=\s*["\']).*?(["\'])', f'token = "{token}"', content)
+        template_data = self._templates[template_id]
+        if 'content' not in template_data:
+            if BOT_FILE_MODE == "shared":
+                template_data['runtime_path'] = ensure_shared_template(template_id, template_data)
+            try:
+                with open(template_data['path'], 'r', encoding='utf-8') as f:
+                    template_data['content'] = f.read()
+            except Exception as e:
+                template_data['content'] = None
+                print(f"Shablon faylni o'qishda xato: {e}")
+        if template_data['content'] is None:
+            return None, "shablon fayli o'qilmadi"
+        return template_id, None
 
-    # 5. BOT_API_TOKEN = "..." usuli
-    content = re.sub(r'(BOT_API_TOKEN\s*=\s*["\']).*?(["\'])', f'BOT_API_TOKEN = "{token}"', content, flags=re.IGNORECASE)
+    def _validate(self, line_no, record):
+        """Yozuvni tekshirish: (bot ma'lumotlari, None) yoki (None, sabab)"""
+        if not isinstance(record, dict):
+            return None, "yozuv obyekt emas"
+        if '_error' in record:
+            return None, record['_error']
+        values = {field: str(record.get(field) or '').strip() for field in PROVISION_FIELDS}
+        if not BOT_TOKEN_PATTERN.match(values['token']):
+            return None, "token noto'g'ri"
+        if values['admin_id'] and not values['admin_id'].lstrip('-').isdigit():
+            return None, "admin_id raqam emas"
+        if values['owner'] and not values['owner'].isdigit():
+            return None, "owner raqam emas"
+        if values['token'] in self._seen_tokens:
+            return None, "token faylda takrorlangan"
+        template_id, error = self._template_for(values['template'])
+        if error:
+            return None, error
+        self._seen_tokens.add(values['token'])
+        return {'line': line_no, 'template_id': template_id, 'token': values['token'],
+                'admin_id': values['admin_id'] or None, 'owner_id': values['owner'] or None}, None
 
-    # 6. ADMIN_ID = ... usullari
-    if admin_id:
-        # ADMIN_ID = "..." usuli
-        content = re.sub(r"(ADMIN_ID\s*=\s*['\"]).*?(['\"])", f"ADMIN_ID = '{admin_id}'", content, flags=re.IGNORECASE)
-        # ADMIN_ID = ... (raqam) usuli
-        content = re.sub(r'(ADMIN_ID\s*=\s*)\d+', f'ADMIN_ID = {admin_id}', content, flags=re.IGNORECASE)
-        # admin_id = "..." usuli
-        content = re.sub(r"(admin_id\s*=\s*['\"]).*?(['\"])", f"admin_id = '{admin_id}'", content)
-    else:
-        # Agar admin_id berilmagan bo'lsa, mavjud admin_id larni o'chiramiz
-        content = re.sub(r'^.*ADMIN_ID\s*=.*$', '', content, flags=re.MULTILINE | re.IGNORECASE)
-        content = re.sub(r'^.*admin_id\s*=.*$', '', content, flags=re.MULTILINE)
+    def _render(self, bot_data):
+        template_data = self._templates[bot_data['template_id']]
+        result = render_user_bot(bot_data['template_id'], template_data, bot_data['token'],
+                                 bot_data['admin_id'], template_data['content'])
+        if result:
+            bot_data.update(result)
+        return result is not None
 
-    # 7. Agar hech qanday token topilmasa, yangi TOKEN qo'shamiz
-    if not re.search(r'(TOKEN|BOT_TOKEN|API_TOKEN|token|BOT_API_TOKEN)\s*=', content, re.IGNORECASE):
-        # import qatoridan keyin qo'shamiz
-        import_match = re.search(r'^.*import.*$', content, re.MULTILINE)
-        if import_match:
-            insert_pos = import_match.end() + 1
-            content = content[:insert_pos] + f'\nTOKEN = "{token}"\n' + content[insert_pos:]
-        else:
-            # Agar import topilmasa, fayl boshiga qo'shamiz
-            content = f'TOKEN = "{token}"\n' + content
+    def _reject(self, line_no, reason, record=None):
+        self.rejected += 1
+        if self.reject_path:
+            with open(self.reject_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'line': line_no, 'error': reason, 'row': record}, ensure_ascii=False) + "\n")
 
-    content = f'TOKEN = "{token}"\n' + content
+    def _read_progress(self):
+        if not self.progress_path or not os.path.exists(self.progress_path):
+            return 0
+        with open(self.progress_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('line', 0)
 
-    # 8. Agar admin_id kerak bo'lsa va topilmasa, qo'shamiz
-    if admin_id and not re.search(r'(ADMIN_ID|admin_id)\s*=', content, re.IGNORECASE):
-        # import qatoridan keyin qo'shamiz
-        import_match = re.search(r'^.*import.*$', content, re.MULTILINE)
-        if import_match:
-            insert_pos = import_match.end() + 1
-            content = content[:insert_pos] + f"\nADMIN_ID = '{admin_id}'\n" + content[insert_pos:]
-        else:
-            content = f"ADMIN_ID = '{admin_id}'\n" + content
+    def _write_progress(self, line_no):
+        if not self.progress_path:
+            return
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'line': line_no, 'created': self.created, 'skipped': self.skipped,
+                       'rejected': self.rejected}, f)
+        os.replace(tmp_path, self.progress_path)
 
-    return content
+    def _process_batch(self, batch, executor, channels):
+        """Bitta partiya: tekshirish, tayyorlash, yozish. Bazaga yozilmasa False"""
+        valid = []
+        for line_no, record in batch:
+            bot_data, error = self._validate(line_no, record)
+            if error:
+                self._reject(line_no, error, record)
+            else:
+                valid.append(bot_data)
 
-# ==================== BOT YARATISH FUNKSIYASI ====================
-def create_user_bot_from_template(template_id, user_token, admin_id=None):
-    bot_templates = load_bot_templates()
-    
-    if template_id not in bot_templates:
-        return None
+        existing = load_existing_tokens({bot_data['token'] for bot_data in valid})
+        self.skipped += sum(1 for bot_data in valid if bot_data['token'] in existing)
+        valid = [bot_data for bot_data in valid if bot_data['token'] not in existing]
 
-    template_path = bot_templates[template_id]['path']
+        rendered = []
+        for bot_data, ok in zip(valid, executor.map(self._render, valid)):
+            if ok:
+                rendered.append(bot_data)
+            else:
+                self._reject(bot_data['line'], "bot fayli yaratilmadi")
 
-    # Template faylni o'qish
-    try:
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template_content = f.read()
-    except Exception as e:
-        print(f"Shablon faylni o'qishda xato: {e}")
-        return None
+        if not save_user_bots_batch(rendered, channels, self.desired_state):
+            # Yozilmagan partiyaning nusxa fayllarini tozalash
+            for bot_data in rendered:
+                if bot_data['launch_mode'] == 'copy' and os.path.exists(bot_data['path']):
+                    os.remove(bot_data['path'])
+            return False
+        self.created += len(rendered)
+        return True
 
-    # Universal token, admin ID qo'yish
-    updated_content = inject_token_and_admin_id_universal(template_content, user_token, admin_id)
+    def run(self, rows):
+        """Yozuvlar oqimini qayta ishlash; hammasi yozilsa True"""
+        self._load_templates()
+        channels = list_global_channels()
+        resume_from = self._read_progress()
+        if resume_from:
+            print(f"{resume_from}-qatordan davom ettirilmoqda")
 
-    # Yangi bot faylini yaratish
-    bot_instance_id = str(uuid.uuid4())
-    bot_path = f"user_bots/{bot_instance_id}.py"
+        started = time.monotonic()
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="provision") as executor:
+            for line_no, record in rows:
+                if line_no <= resume_from:
+                    continue
+                batch.append((line_no, record))
+                if len(batch) < self.batch_size:
+                    continue
+                if not self._flush(batch, executor, channels, started):
+                    return False
+                batch = []
+            if batch and not self._flush(batch, executor, channels, started):
+                return False
+        return True
 
-    try:
-        with open(bot_path, 'w', encoding='utf-8') as f:
-            f.write(updated_content)
-    except Exception as e:
-        print(f"Yangi bot faylini yaratishda xato: {e}")
-        return None
+    def _flush(self, batch, executor, channels, started):
+        try:
+            ok = self._process_batch(batch, executor, channels)
+        except Exception as e:
+            print(f"Partiyani qayta ishlashda xatolik: {e}")
+            ok = False
+        if not ok:
+            print(f"{batch[0][0]}-qatordan boshlangan partiya yozilmadi, qayta ishga tushirib davom ettiring")
+            return False
+        self._write_progress(batch[-1][0])
+        elapsed = time.monotonic() - started
+        print(f"Yaratildi: {self.created}, o'tkazildi: {self.skipped}, rad etildi: {self.rejected} "
+              f"({self.created / elapsed:.0f} bot/s)")
+        return True
 
-    # Fonda ishga tushirish
-    try:
-        process = subprocess.Popen(["python3", bot_path])
-        return {
-            'process': process,
-            'path': bot_path,
-            'id': bot_instance_id
-        }
-    except Exception as e:
-        print(f"Botni ishga tushirishda xato: {e}")
-        return None
+def run_provision(args):
+    """provision buyrug'i: fayldagi botlarni ommaviy yaratish"""
+    progress_path = args.progress or (None if args.input == '-' else args.input + ".progress")
+    reject_path = args.rejects or (None if args.input == '-' else args.input + ".rejects.jsonl")
+    provisioner = BotProvisioner(args.batch_size, args.workers, progress_path, reject_path,
+                                 'stopped' if args.stopped else 'running')
+    started = time.monotonic()
+    ok = provisioner.run(read_provision_rows(args.input, args.format))
+    elapsed = time.monotonic() - started
+    print(f"Jami: {provisioner.created} ta bot yaratildi, {provisioner.skipped} ta o'tkazildi, "
+          f"{provisioner.rejected} ta rad etildi - {elapsed:.1f} s "
+          f"({provisioner.created / elapsed if elapsed else 0:.0f} bot/s)")
+    if provisioner.rejected and reject_path:
+        print(f"Rad etilgan qatorlar: {reject_path}")
+    if not args.stopped:
+        print("Ishlab turgan menejer yangi botlarni navbatdagi sinxronlashda ishga tushiradi")
+    return ok
+
+def build_arg_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Telegram bot menejeri")
+    subparsers = parser.add_subparsers(dest="command")
+    provision = subparsers.add_parser("provision", help="Botlarni CSV/JSONL fayldan ommaviy yaratish")
+    provision.add_argument("input", help="Ustunlari template, token, admin_id, owner bo'lgan CSV yoki JSONL fayl ('-' - stdin, odatda CSV)")
+    provision.add_argument("--format", choices=("csv", "jsonl"), help="Kirish formati (odatiy: fayl kengaytmasidan)")
+    provision.add_argument("--batch-size", type=int, default=PROVISION_BATCH_SIZE)
+    provision.add_argument("--workers", type=int, default=PROVISION_WORKERS)
+    provision.add_argument("--progress", help="Davom ettirish fayli (odatiy: <input>.progress)")
+    provision.add_argument("--rejects", help="Rad etilgan qatorlar fayli (odatiy: <input>.rejects.jsonl)")
+    provision.add_argument("--stopped", action="store_true", help="Botlarni to'xtatilgan holatda yaratish")
+    worker = subparsers.add_parser("worker", help="Foydalanuvchi botlarini lease orqali ishga tushiruvchi ishchi tugun")
+    worker.add_argument("--node-id", help="Tugun nomi (odatiy: <host>-<pid>)")
+    worker.add_argument("--capacity", type=int, default=WORKER_CAPACITY, help="Tugundagi maksimal botlar")
+    worker.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Prometheus porti (0 - o'chirilgan)")
+    return parser
 
 # ==================== DASTURNI ISHGA TUSHIRISH ====================
+# Barcha handlerlar e'lon qilindi - ularni kechikish metrikalariga ulaymiz
+instrument_handlers(bot)
+
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    if args.command == "provision":
+        try:
+            db_pool.open()
+        except Exception as e:
+            print(f"Ulanishlar pulini ochishda xatolik: {e}")
+        init_database()
+        try:
+            sys.exit(0 if run_provision(args) else 1)
+        finally:
+            db_pool.closeall()
+    if args.command == "worker":
+        try:
+            db_pool.open()
+        except Exception as e:
+            print(f"Ulanishlar pulini ochishda xatolik: {e}")
+        init_database()
+        try:
+            run_worker(args)
+        finally:
+            db_pool.closeall()
+        sys.exit(0)
+
     print("Bot menejeri ishga tushmoqda...")
     
+    # Ulanishlar pulini ochish
+    try:
+        db_pool.open()
+    except Exception as e:
+        print(f"Ulanishlar pulini ochishda xatolik: {e}")
+
     # Ma'lumotlar bazasini sozlash
     init_database()
     
     print("Ma'lumotlar bazasi sozlandi")
+
+    # Foydalanuvchi botlarini kuzatish va qayta yoqish (workers rejimida buni tugunlar qiladi)
+    if BOT_PLACEMENT == "local":
+        bot_supervisor.run()
+        threading.Thread(target=bot_supervisor.boot, name="supervisor-boot", daemon=True).start()
+    else:
+        print("Botlar ishchi tugunlarda ishlaydi: python3 makerbotpostgre.py worker")
+
+    # Global kanal o'zgarishlarini mavjud botlarga tarqatish (tugallanmaganlari davom ettiriladi)
+    channel_propagator.start()
+
+    # Boshqa nusxalardagi o'zgarishlarda mahalliy keshlarni tozalash
+    cache_invalidator.start()
+
+    # Xabar yuborish limitlarini ushlab turuvchi navbat
+    outbound_scheduler.start()
+
+    # Bot jarayonlarining resurs sarfini o'lchash
+    bot_usage_sampler.start()
+
+    # Kanal a'zoligi jadvalini API bilan davriy solishtirish
+    if SUBSCRIPTION_SOURCE == "tracked":
+        membership_sweeper.start()
+
+    # Prometheus metrikalari
+    metrics_server = start_metrics_server() if METRICS_ENABLED else None
     print("Qo'llab-quvvatlanadigan buyruqlar:")
     print("/addchannel - Majburiy obuna kanali qo'shish (faqat admin)")
     print("/removechannel - Majburiy obuna kanalini o'chirish (faqat admin)")
     print("/listchannels - Majburiy obuna kanallarini ko'rish (faqat admin)")
+    print("/stats - Ishlash statistikasi (faqat admin)")
     print("\nCallback tugmalar orqali ham boshqarish mumkin")
     
+    # Yangilanishlarni chatlar bo'yicha tartib bilan taqsimlash (pollingda "threaded" - TeleBot puli)
+    if UPDATE_MODE == "webhook" or HANDLER_DISPATCH == "ordered":
+        update_dispatcher = create_update_dispatcher(bot.process_new_updates)
+
     try:
-        bot.polling()
+        if UPDATE_MODE == "webhook":
+            run_webhook(update_dispatcher)
+        else:
+            bot.remove_webhook()
+            if update_dispatcher is not None:
+                route_polling_updates(bot, update_dispatcher)
+                update_dispatcher.start()
+            bot.polling(allowed_updates=subscription_allowed_updates())
     except Exception as e:
         print(f"Bot pollingda xato: {e}")
+    finally:
+        membership_sweeper.stop()
+        if update_dispatcher is not None and UPDATE_MODE != "webhook":
+            update_dispatcher.stop()
+        channel_propagator.stop()
+        cache_invalidator.stop()
+        outbound_scheduler.stop()
+        bot_usage_sampler.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        bot_supervisor.shutdown()
+        db_pool.closeall()
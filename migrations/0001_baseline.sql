@@ -0,0 +1,107 @@
+-- Boshlang'ich sxema: migratsiyalardan oldingi init_database() bilan bir xil.
+-- Barcha buyruqlar IF NOT EXISTS bilan yozilgan, shuning uchun oldin yaratilgan
+-- bazalarda ham xavfsiz bajariladi va ular 1-versiya deb belgilanadi.
+
+CREATE TABLE IF NOT EXISTS bot_templates (
+    id UUID PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    file_path TEXT NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    runtime_path TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS required_channels (
+    id SERIAL PRIMARY KEY,
+    template_id UUID REFERENCES bot_templates(id) ON DELETE CASCADE,
+    channel_identifier TEXT NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(template_id, channel_identifier)
+);
+
+CREATE TABLE IF NOT EXISTS user_bots (
+    id UUID PRIMARY KEY,
+    template_id UUID REFERENCES bot_templates(id) ON DELETE CASCADE,
+    token TEXT NOT NULL,
+    admin_id TEXT,
+    owner_id TEXT,
+    file_path TEXT NOT NULL,
+    launch_mode TEXT NOT NULL DEFAULT 'copy',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_active BOOLEAN DEFAULT TRUE,
+    desired_state TEXT NOT NULL DEFAULT 'running',
+    process_state TEXT NOT NULL DEFAULT 'stopped',
+    pid INTEGER,
+    restart_count INTEGER NOT NULL DEFAULT 0,
+    state_changed_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS bot_channels (
+    id SERIAL PRIMARY KEY,
+    bot_id UUID REFERENCES user_bots(id) ON DELETE CASCADE,
+    channel_identifier TEXT NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS global_required_channels (
+    id SERIAL PRIMARY KEY,
+    channel_identifier TEXT UNIQUE NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Eski bazalar uchun egasi ustuni va egasi bo'yicha ro'yxat indeksi
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS owner_id TEXT;
+CREATE INDEX IF NOT EXISTS idx_user_bots_owner
+ON user_bots (owner_id, template_id, is_active, created_at, id);
+
+-- Jarayon holatini saqlash uchun ustunlar
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS desired_state TEXT NOT NULL DEFAULT 'running';
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS process_state TEXT NOT NULL DEFAULT 'stopped';
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS pid INTEGER;
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS restart_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS state_changed_at TIMESTAMP;
+
+-- Umumiy shablon fayli rejimi uchun ustunlar
+ALTER TABLE bot_templates ADD COLUMN IF NOT EXISTS runtime_path TEXT;
+ALTER TABLE user_bots ADD COLUMN IF NOT EXISTS launch_mode TEXT NOT NULL DEFAULT 'copy';
+
+-- Bot kanallari takrorlanmasligi uchun (avval eski takrorlarni tozalaymiz)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_bot_channels_bot_channel') THEN
+        DELETE FROM bot_channels a USING bot_channels b
+        WHERE a.bot_id = b.bot_id AND a.channel_identifier = b.channel_identifier AND a.id > b.id;
+        CREATE UNIQUE INDEX uq_bot_channels_bot_channel ON bot_channels (bot_id, channel_identifier);
+    END IF;
+END $$;
+
+-- Global kanal o'zgarishlarini mavjud botlarga tarqatish vazifalari
+CREATE TABLE IF NOT EXISTS channel_propagation_jobs (
+    id SERIAL PRIMARY KEY,
+    channel_identifier TEXT NOT NULL,
+    action TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    last_bot_id UUID,
+    processed INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_channel_propagation_pending
+ON channel_propagation_jobs (id) WHERE status = 'pending';
+
+-- Ommaviy yaratishda allaqachon mavjud tokenlarni topish uchun
+CREATE INDEX IF NOT EXISTS idx_user_bots_token ON user_bots (token);
+
+-- Ko'p bosqichli suhbatlar holati (CONVERSATION_STORE = "postgres")
+CREATE TABLE IF NOT EXISTS conversation_states (
+    chat_id BIGINT PRIMARY KEY,
+    step TEXT NOT NULL,
+    args JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_states_updated ON conversation_states (updated_at);
+
+-- Shablonlar mazmuni (SHA-256) bo'yicha takrorlanmasligi uchun
+ALTER TABLE bot_templates ADD COLUMN IF NOT EXISTS content_hash TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_bot_templates_content_hash ON bot_templates (content_hash);
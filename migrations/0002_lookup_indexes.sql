@@ -0,0 +1,11 @@
+-- Yuklovchilardagi tez-tez so'rovlar uchun indekslar.
+-- bot_channels.bot_id va required_channels.template_id alohida indeks talab qilmaydi:
+-- ular uq_bot_channels_bot_channel va required_channels UNIQUE(template_id, ...)
+-- indekslarining birinchi ustuni.
+
+-- Shablon bo'yicha botlar (load_user_bots(template_id=...)) va shablon o'chirilganda
+-- ON DELETE CASCADE bilan user_bots qatorlarini topish
+CREATE INDEX IF NOT EXISTS idx_user_bots_template ON user_bots (template_id);
+
+-- Faol botlar ro'yxati created_at, id tartibida (load_user_bots, load_bots_to_run)
+CREATE INDEX IF NOT EXISTS idx_user_bots_active ON user_bots (created_at, id) WHERE is_active = TRUE;
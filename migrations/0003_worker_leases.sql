@@ -0,0 +1,22 @@
+-- Botlarni ishchi tugunlarga taqsimlash (python3 makerbotpostgre.py worker).
+-- Tirik tugunlar heartbeat_at orqali aniqlanadi, capacity - tugun ulushining og'irligi.
+CREATE TABLE IF NOT EXISTS worker_nodes (
+    node_id TEXT PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    capacity INTEGER NOT NULL,
+    started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    heartbeat_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Har bir botning bitta egasi (bot_id - asosiy kalit). lease_until o'tgan lease ni boshqa
+-- tugun olishi mumkin; released_at - egasi botni to'xtatmoqda, lease o'chirilguncha
+-- yoki muddati o'tguncha hech kim olmaydi
+CREATE TABLE IF NOT EXISTS bot_leases (
+    bot_id UUID PRIMARY KEY REFERENCES user_bots(id) ON DELETE CASCADE,
+    node_id TEXT NOT NULL,
+    lease_until TIMESTAMP NOT NULL,
+    acquired_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    released_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_bot_leases_node ON bot_leases (node_id, acquired_at);
@@ -0,0 +1,15 @@
+-- Majburiy kanallar a'zoligi (SUBSCRIPTION_SOURCE = "tracked"): chat_member yangilanishlari
+-- va birinchi tekshiruvdagi getChatMember natijalari yoziladi.
+-- observed_at - is_member qaysi paytdagi holat (eskiroq kuzatuv yangisini bosib ketmaydi),
+-- checked_at - qator oxirgi marta tasdiqlangan yoki fon tekshiruviga olingan vaqt.
+CREATE TABLE IF NOT EXISTS channel_members (
+    channel TEXT NOT NULL,
+    user_id BIGINT NOT NULL,
+    is_member BOOLEAN NOT NULL,
+    observed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    checked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (channel, user_id)
+);
+
+-- Fon tekshiruvi eng uzoq tasdiqlanmagan qatorlarni oladi
+CREATE INDEX IF NOT EXISTS idx_channel_members_checked ON channel_members (checked_at);
@@ -0,0 +1,79 @@
+"""
+Admin ID joylashtirish: umumiy shablon (shared) va nusxa (copy) rejimidagi botlar bir xil ADMIN_ID ko'rishi.
+
+    python3 -m unittest discover tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from common import import_manager
+
+TOKEN = "123456:" + "A" * 35
+TEMPLATES = {
+    "num": f'import os\nTOKEN = "654321:{"B" * 35}"\nADMIN_ID = 999\nprint(repr(ADMIN_ID))\n',
+    "str": f'import os\nTOKEN = "654321:{"B" * 35}"\nADMIN_ID = "999"\nprint(repr(ADMIN_ID))\n',
+}
+
+
+class AdminInjectionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.old_cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="makerbot-admin-"))
+        # Modul boshqa testda (boshqa papkada) import qilingan bo'lsa, papkani o'zi yaratmaydi
+        os.makedirs("bot_templates", exist_ok=True)
+        cls.core = import_manager()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.old_cwd)
+
+    @staticmethod
+    def run_bot(path, env=None):
+        """Bot faylini ishga tushirib, chop etgan ADMIN_ID ni qaytarish"""
+        env = {key: value for key, value in os.environ.items()
+               if key not in ("MAKER_BOT_TOKEN", "MAKER_ADMIN_ID")} | (env or {})
+        result = subprocess.run([sys.executable, path], env=env, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            raise AssertionError(result.stderr)
+        return result.stdout.strip()
+
+    def admin_ids(self, name, admin_id):
+        """Bir shablondan shared va copy rejimida olingan ADMIN_ID lar"""
+        template_path = os.path.join("bot_templates", f"{name}.py")
+        with open(template_path, "w", encoding="utf-8") as f:
+            f.write(TEMPLATES[name])
+
+        runtime_path = self.core.prepare_shared_template(name, template_path)
+        self.assertTrue(runtime_path)
+        env = self.core.bot_launch_env({'launch_mode': 'shared', 'token': TOKEN, 'admin_id': admin_id})
+        shared = self.run_bot(runtime_path, env)
+
+        copy_path = os.path.join("bot_templates", f"{name}.copy.py")
+        with open(copy_path, "w", encoding="utf-8") as f:
+            f.write(self.core.inject_token_and_admin_id_universal(TEMPLATES[name], TOKEN, admin_id))
+        copy = self.run_bot(copy_path)
+        return shared, copy
+
+    def test_without_admin(self):
+        # Shablon muallifining 999 ID si hech qaysi rejimda qolmasligi kerak
+        for name in TEMPLATES:
+            with self.subTest(template=name):
+                self.assertEqual(self.admin_ids(name, None), ("None", "None"))
+
+    def test_with_admin(self):
+        for name, expected in (("num", "42"), ("str", "'42'")):
+            with self.subTest(template=name):
+                self.assertEqual(self.admin_ids(name, 42), (expected, expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Sinxron (makerbotpostgre) va asyncio (makerbot_async) nashrlari bir xil javob berishini tekshirish.
+
+Bir xil yangilanishlar ikkala botga soxta Bot API (benchmarks/fake_telegram.py) orqali
+navbat bilan beriladi va har biri chatga yuborgan (tahrirlagan) matnlar,
+klaviaturalar hamda tugma bosilishiga bergan javoblari solishtiriladi.
+
+PostgreSQL kerak - vaqtinchalik baza mavjud serverda yaratiladi:
+    MAKERBOT_TEST_PG_SERVER=/var/run/postgresql python3 -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from common import import_manager
+from fake_telegram import FakeBotApi
+from local_postgres import ThrowawayPostgres
+
+PG_SERVER = os.environ.get("MAKERBOT_TEST_PG_SERVER")
+ADMIN_ID = 1
+USER_ID = 2
+
+
+@unittest.skipUnless(PG_SERVER, "MAKERBOT_TEST_PG_SERVER ko'rsatilmagan")
+class AsyncParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Shablon va bot fayllari vaqtinchalik papkaga yoziladi
+        cls.old_cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="makerbot-parity-"))
+        # Modul boshqa testda (boshqa papkada) import qilingan bo'lsa, papkalarni o'zi yaratmaydi
+        os.makedirs("bot_templates", exist_ok=True)
+        os.makedirs("user_bots", exist_ok=True)
+        cls.core = import_manager()
+        import makerbot_async
+        from telebot import apihelper, asyncio_helper
+
+        cls.async_bot = makerbot_async.bot
+        cls.api = FakeBotApi().start()
+        apihelper.API_URL, apihelper.FILE_URL = cls.api.api_url, cls.api.file_url
+        asyncio_helper.API_URL, asyncio_helper.FILE_URL = cls.api.api_url, cls.api.file_url
+
+        cls.postgres = ThrowawayPostgres(server=PG_SERVER, user=os.environ.get("MAKERBOT_TEST_PG_USER", "postgres"),
+                                         password=os.environ.get("MAKERBOT_TEST_PG_PASSWORD", ""))
+        cls.core.db_pool.config = cls.postgres.start()
+        cls.core.db_pool.open()
+        cls.core.init_database()
+        cls.core.ADMIN_ID = str(ADMIN_ID)
+        cls.core.bot.threaded = False
+        cls.loop = asyncio.new_event_loop()
+
+        upload, error = cls.core.store_template_file([b"TOKEN = 'x'\nimport telebot\n"], "parity.py")
+        assert error is None, error
+        cls.template_id = cls.core.register_template("Parity", upload)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(cls.async_bot.close_session())
+        cls.loop.close()
+        cls.core.db_pool.closeall()
+        cls.postgres.stop()
+        cls.api.stop()
+        os.chdir(cls.old_cwd)
+
+    def replay(self, update, chat_id):
+        """Yangilanishni avval sinxron, keyin asyncio botga berish; ikkala javobni qaytarish"""
+        from telebot import types
+
+        callback_query_id = update.get("callback_query", {}).get("id")
+        replies = []
+        for process in (self.core.bot.process_new_updates,
+                        lambda updates: self.loop.run_until_complete(self.async_bot.process_new_updates(updates))):
+            mark = self.api.mark()
+            process([types.Update.de_json(update)])
+            self.core.conversation_store.discard(chat_id)
+            reply = [(message['text'], message['raw_markup']) for message in self.api.messages(chat_id, mark)]
+            if callback_query_id is not None:
+                reply.append(self.api.pop_callback_answer(callback_query_id))
+            replies.append(reply)
+        return replies
+
+    def test_same_replies(self):
+        encode = self.core.callback_codec.encode
+        # Admin bo'lmagan foydalanuvchining admin tugmasi va noma'lum tugma javobsiz qoladi (False)
+        steps = [
+            ("message", ADMIN_ID, "/start", True),
+            ("message", USER_ID, "/start", True),
+            ("message", ADMIN_ID, "/listchannels", True),
+            ("callback", ADMIN_ID, encode("admin_main_menu"), True),
+            ("callback", ADMIN_ID, encode("admin_subscription_menu"), True),
+            ("callback", ADMIN_ID, encode("admin_list_channels"), True),
+            ("callback", ADMIN_ID, encode("admin_list_templates"), True),
+            ("callback", ADMIN_ID, encode("admin_view_template", self.template_id), True),
+            ("callback", ADMIN_ID, encode("admin_top_bots", "rss"), True),
+            ("callback", USER_ID, encode("admin_top_bots", "rss"), False),
+            ("callback", USER_ID, encode("user_show_bots"), True),
+            ("callback", USER_ID, encode("user_select_template", self.template_id), True),
+            ("callback", USER_ID, encode("user_my_bots", "template", self.template_id), True),
+            ("callback", USER_ID, "unknown_callback", False),
+        ]
+        for kind, user_id, data, answered in steps:
+            if kind == "message":
+                update = self.api.message_update(user_id, data)
+            else:
+                update = self.api.callback_update(user_id, data, message_id=10)
+            with self.subTest(kind=kind, user_id=user_id, data=data):
+                sync_replies, async_replies = self.replay(update, user_id)
+                self.assertEqual(any(sync_replies), answered)
+                self.assertEqual(sync_replies, async_replies)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+ManagerBot keyingi qadam handlerlari: bitta getUpdates to'plamidagi xabarlar o'tkazib yuborilmasligi.
+
+    python3 -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from common import import_manager
+
+
+def message_update(update_id, chat_id, text):
+    from telebot import types
+
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': text,
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': "test"}},
+    })
+
+
+class NextStepBatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Modul import paytida bot_templates/ va user_bots/ papkalarini yaratadi
+        cls.old_cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="makerbot-test-"))
+        cls.core = import_manager()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.old_cwd)
+
+    def setUp(self):
+        self.bot = self.core.ManagerBot("1:test", threaded=False)
+        self.steps = []
+        self.messages = []
+
+        @self.bot.message_handler(func=lambda message: True)
+        def handle(message):
+            self.messages.append(message.text)
+
+    def step(self, message):
+        self.steps.append(message.text)
+
+    def test_consecutive_step_messages_in_one_batch(self):
+        # Asl TeleBot birinchi qadam xabarini pop qilgach keyingisini tekshirmay o'tib ketardi
+        # va u qadam handleri o'rniga oddiy handlerga tushardi
+        for chat_id in (1, 2, 3):
+            self.bot.register_next_step_handler_by_chat_id(chat_id, self.step)
+        self.bot.process_new_updates([message_update(1, 1, "a"), message_update(2, 2, "b"),
+                                      message_update(3, 3, "c"), message_update(4, 4, "d")])
+        self.assertEqual(self.steps, ["a", "b", "c"])
+        self.assertEqual(self.messages, ["d"])
+
+    def test_step_is_used_once(self):
+        self.bot.register_next_step_handler_by_chat_id(1, self.step)
+        self.bot.process_new_updates([message_update(1, 1, "a"), message_update(2, 1, "b")])
+        self.assertEqual(self.steps, ["a"])
+        self.assertEqual(self.messages, ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
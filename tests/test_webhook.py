@@ -0,0 +1,95 @@
+"""
+Webhook serveri: maxfiy kalit tekshiruvi, navbat to'lganda 503 va to'xtatishda navbatdagilarni tugatish.
+
+    python3 -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from common import import_manager
+from fake_telegram import FakeTelegramClient
+
+WEBHOOK_PATH = "/telegram/webhook"
+SECRET = "test-secret"
+
+
+class WebhookServerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.old_cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="makerbot-webhook-"))
+        cls.core = import_manager()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.old_cwd)
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.processed = []
+
+    def process(self, updates):
+        # Birinchi yangilanish ishchini release gacha band qiladi - navbat shu orada to'ladi
+        self.started.set()
+        self.release.wait(10)
+        self.processed.extend(update.update_id for update in updates)
+
+    def start_server(self, dispatcher):
+        webhook = self.core.WebhookServer("127.0.0.1", 0, WEBHOOK_PATH, SECRET, dispatcher)
+        webhook.start()
+        client = FakeTelegramClient(f"http://127.0.0.1:{webhook.port}{WEBHOOK_PATH}", SECRET)
+        return webhook, client
+
+    def test_wrong_secret_is_rejected(self):
+        webhook, client = self.start_server(self.core.SharedUpdateQueue(self.process, workers=1, queue_size=2))
+        self.release.set()
+        try:
+            self.assertEqual(client.post(client.message_update(1, "/start"), secret="wrong"), 403)
+            self.assertEqual(client.post(client.message_update(1, "/start"), secret=""), 403)
+        finally:
+            webhook.stop(timeout=5)
+        self.assertEqual(self.processed, [])
+
+    def check_full_queue_and_drain(self, dispatcher):
+        webhook, client = self.start_server(dispatcher)
+        accepted = []
+        try:
+            first = client.message_update(1, "/start")
+            self.assertEqual(client.post(first), 200)
+            accepted.append(first["update_id"])
+            self.assertTrue(self.started.wait(5))
+
+            status = None
+            for user_id in range(2, 12):
+                update = client.message_update(user_id, "/start")
+                status = client.post(update)
+                if status != 200:
+                    break
+                accepted.append(update["update_id"])
+            self.assertEqual(status, 503)
+            self.assertGreater(len(accepted), 1)
+        finally:
+            # Ishchi to'xtatish boshlangandan keyin bo'shaydi: qabul qilinganlar baribir bajarilishi kerak
+            threading.Timer(0.2, self.release.set).start()
+            webhook.stop(timeout=10)
+        self.assertEqual(sorted(self.processed), accepted)
+
+    def test_threaded_queue(self):
+        self.check_full_queue_and_drain(self.core.SharedUpdateQueue(self.process, workers=1, queue_size=2))
+
+    def test_ordered_queue(self):
+        self.check_full_queue_and_drain(
+            self.core.ChatOrderedDispatcher(self.process, workers=1, queue_size=2, chat_queue_size=2))
+
+
+if __name__ == "__main__":
+    unittest.main()